@@ -42,10 +42,11 @@
 import { InfoCircleOutlined } from "@ant-design/icons";
 import { Button, Card, Col, Flex, Row, Tooltip, Typography } from "antd";
 import Paragraph from "antd/es/typography/Paragraph";
-import _ from "lodash";
 import { useState } from "react";
 
 import { GenerateRefinedPromptResponse } from "src/api/apis";
+
+import { formatPromptStyle } from "../utils";
 import { TestPromptModal } from "./TestModalPrompt";
 
 const { Text } = Typography;
@@ -82,10 +83,7 @@ export const GeneratedPromptCard = ({
           <Row align="middle">
             <Col span={12}>
               <Text style={{ textWrap: "pretty" }}>
-                {_.startCase(
-                  prompt.prompt_style.toLowerCase().replace(/_/g, " "),
-                )}{" "}
-                Prompt
+                {formatPromptStyle(prompt.prompt_style)} Prompt
                 {infoText[prompt.prompt_style] ? (
                   <Tooltip title={infoText[prompt.prompt_style]}>
                     <InfoCircleOutlined style={{ marginLeft: 4 }} />
@@ -100,9 +100,11 @@ export const TestPromptModal = ({
     });
 
   const handlePromptTest = () => {
+    setModelResponse("");
     testPromptMutate({
       input_variables: inputVariableValues,
       prompt: modalPrompt?.refined_prompt || "",
+      onPartialResponse: setModelResponse,
     });
   };
 
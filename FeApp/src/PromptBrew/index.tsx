@@ -39,7 +39,7 @@
  *
  * ***************************************************************************
  */
-import { useEffect, useState } from "react";
+import { useEffect, useRef, useState } from "react";
 import { Button, Collapse, Flex, Form, message } from "antd";
 import { GenerateRefinedPromptResponse } from "../api/apis";
 import { InputVariablesInitialState } from "./Variables/InputVariablesContainer.tsx";
@@ -49,13 +49,13 @@ import {
   useRefinePromptMutation,
 } from "src/api/mutations.tsx";
 
-import { translateInputVariables } from "./utils.ts";
+import { formatPromptStyle, translateInputVariables } from "./utils.ts";
 import {
   FieldTypeTaskDescription,
   MappedDimension,
   Variable,
 } from "./types.ts";
-import { onErrorHandler, transformSuggestedDimensions } from "src/api/utils.ts";
+import { onErrorHandler, transformSuggestedDimension } from "src/api/utils.ts";
 import { TaskDescription } from "./TaskDescription/index.tsx";
 import { collapseDimensions, dimensionPanelName } from "./Dimensions/index.tsx";
 import { collapseVariables, variablesPanelName } from "./Variables/index.tsx";
@@ -74,22 +74,29 @@ const PromptBrew = () => {
   const [generatedPrompts, setGeneratedPrompts] = useState<
     GenerateRefinedPromptResponse[]
   >([]);
+  // generating again from the same inputs asks for new results, not cached ones
+  const lastTaskDescription = useRef<string>();
+  const lastRefineInputs = useRef<string>();
 
   const {
     mutate: generateDimensionsMutate,
     isPending: generateDimensionsPending,
   } = useGenerateDimensionsMutation({
-    onSuccess: (result) => {
-      const suggestedDimensions = transformSuggestedDimensions(result);
-      setSelectedDimensions(suggestedDimensions);
-      setRequestedPrompt(result.prompt);
-    },
+    onSuccess: (result) => setRequestedPrompt(result.prompt),
     onError: (error: Error) => onErrorHandler(error, messageApi),
   });
 
   const { mutate: refinePromptMutate, isPending: isRefinePromptPending } =
     useRefinePromptMutation({
-      onSuccess: (result) => setGeneratedPrompts(result),
+      onSuccess: ({ refinedPrompts, failures }) => {
+        setGeneratedPrompts(refinedPrompts);
+        failures.forEach(({ prompt_style, error }) =>
+          messageApi.open({
+            type: "error",
+            content: `Failed to generate ${formatPromptStyle(prompt_style)} prompt: ${error}`,
+          }),
+        );
+      },
       onError: (error: Error) => onErrorHandler(error, messageApi),
     });
 
@@ -108,7 +115,25 @@ const PromptBrew = () => {
     setSelectedDimensions([]);
     setInputVariables([InputVariablesInitialState()]);
     setGeneratedPrompts([]);
-    generateDimensionsMutate(taskDescription);
+    const regenerate =
+      taskDescription.taskDescription === lastTaskDescription.current;
+    lastTaskDescription.current = taskDescription.taskDescription;
+    generateDimensionsMutate({
+      ...taskDescription,
+      bypassCache: regenerate,
+      // show each dimension as soon as it has been generated, replacing any
+      // of the same name, as a nominal and an ordinal dimension may share one
+      onDimension: (name, values) =>
+        setSelectedDimensions((dimensions) =>
+          dimensions.some((dimension) => dimension.name === name)
+            ? dimensions.map((dimension) =>
+                dimension.name === name
+                  ? transformSuggestedDimension(name, values)
+                  : dimension,
+              )
+            : [...dimensions, transformSuggestedDimension(name, values)],
+        ),
+    });
   };
 
   const handleGenerateRefinedPrompt = () => {
@@ -120,6 +145,13 @@ const PromptBrew = () => {
       }
     });
 
+    const inputs = {
+      prompt: selectPrompt,
+      dimensions: dimensions,
+      input_variables: translateInputVariables(inputVariables),
+    };
+    const regenerate = JSON.stringify(inputs) === lastRefineInputs.current;
+    lastRefineInputs.current = JSON.stringify(inputs);
     refinePromptMutate({
       promptStyles: [
         "SIMPLE",
@@ -127,11 +159,7 @@ const PromptBrew = () => {
         "FEW_SHOT_CHAIN_OF_THOUGHT",
         "ASSUMED_EXPERTISE",
       ],
-      inputs: {
-        prompt: selectPrompt,
-        dimensions: dimensions,
-        input_variables: translateInputVariables(inputVariables),
-      },
+      inputs: { ...inputs, bypass_cache: regenerate },
     });
   };
 
@@ -191,7 +219,7 @@ const PromptBrew = () => {
                 <Button
                   type="primary"
                   htmlType="submit"
-                  disabled={!canGeneratePrompts}
+                  disabled={!canGeneratePrompts || generateDimensionsPending}
                   onClick={() => {
                     collapseBothPanels();
                     handleGenerateRefinedPrompt();
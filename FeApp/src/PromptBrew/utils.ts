@@ -41,7 +41,7 @@
  */
 import _ from "lodash";
 
-import { GenerateRefinedPromptPayload } from "src/api/apis";
+import { GenerateRefinedPromptPayload, PromptStyleType } from "src/api/apis";
 import { Variable } from "./types";
 
 export const translateInputVariables = (
@@ -58,3 +58,6 @@ export const translateInputVariables = (
   );
   return apiVariables;
 };
+
+export const formatPromptStyle = (promptStyle: PromptStyleType): string =>
+  _.startCase(promptStyle.toLowerCase().replace(/_/g, " "));
@@ -58,16 +58,28 @@ export type PromptStyleType =
 export type FieldTypeTaskDescription = {
   taskDescription?: string;
 };
+export type GenerateDimensionsPayload = FieldTypeTaskDescription & {
+  bypassCache?: boolean;
+  onDimension?: (name: string, values: string[]) => void;
+};
+
 export type GenerateDimensionsResponse = {
   prompt: string;
   dimensions: { [key: string]: string[] };
 };
 
+type StreamedDimension = {
+  kind: "nominal" | "ordinal";
+  name: string;
+  values: string[];
+};
+
 export type GenerateRefinedPromptPayload = {
   prompt: string;
   dimensions: DimensionsType;
   input_variables: InputVariablesType;
   prompt_style?: PromptStyleType;
+  bypass_cache?: boolean;
 };
 
 export type GenerateRefinedPromptResponse = {
@@ -80,6 +92,7 @@ export type GenerateRefinedPromptResponse = {
 export type TestPromptPayload = {
   prompt: string;
   input_variables: InputVariablesType;
+  onPartialResponse?: (response: string) => void;
 };
 
 const promptBrewPath = "promptbrew";
@@ -92,15 +105,29 @@ const baseUrl: string = import.meta.env.DEV
   ? `http://localhost:8000/${promptBrewPath}`
   : `/${promptBrewPath}`;
 
-export const generateDimensionsMutationFn = async (
-  inputs: FieldTypeTaskDescription,
-): Promise<GenerateDimensionsResponse> => {
-  const response = await fetch(`${baseUrl}/generate-dimensions`, {
-    body: JSON.stringify({ prompt: inputs.taskDescription }),
+export const generateDimensionsMutationFn = async ({
+  bypassCache,
+  onDimension,
+  ...inputs
+}: GenerateDimensionsPayload): Promise<GenerateDimensionsResponse> => {
+  const response = await fetch(`${baseUrl}/generate-dimensions/stream`, {
+    body: JSON.stringify({
+      prompt: inputs.taskDescription,
+      bypass_cache: bypassCache ?? false,
+    }),
     method: "POST",
     headers: commonHeaders,
   });
-  return await response.json();
+  if (!response.ok || !response.body) {
+    throw new Error(`Failed to generate dimensions (${response.status})`);
+  }
+  const dimensions: { [key: string]: string[] } = {};
+  await readEventStream(response.body, (data) => {
+    const { name, values } = data as StreamedDimension;
+    dimensions[name] = values;
+    onDimension?.(name, values);
+  });
+  return { prompt: inputs.taskDescription ?? "", dimensions };
 };
 
 export const generateRefinedPrompt = async (
@@ -115,29 +142,119 @@ export const generateRefinedPrompt = async (
   return { ...res, key: uuidv4() };
 };
 
+type RefinedPromptResult = {
+  refined_prompt: string | null;
+  prompt_style: PromptStyleType;
+  elapsed_seconds: number;
+  error: string | null;
+};
+
+type GenerateRefinedPromptsResponse = {
+  input_variables: InputVariablesType;
+  refined_prompts: RefinedPromptResult[];
+};
+
+export type RefinedPromptFailure = {
+  prompt_style: PromptStyleType;
+  error: string;
+};
+
+export type GenerateRefinedPromptsResult = {
+  refinedPrompts: GenerateRefinedPromptResponse[];
+  failures: RefinedPromptFailure[];
+};
+
 export const generateRefinedPrompts = async ({
   inputs,
   promptStyles,
 }: {
   promptStyles: PromptStyleType[];
   inputs: GenerateRefinedPromptPayload;
-}): Promise<GenerateRefinedPromptResponse[]> => {
-  const promises = promptStyles.map((promptStyle) =>
-    generateRefinedPrompt({
-      ...inputs,
-      prompt_style: promptStyle,
-    }),
+}): Promise<GenerateRefinedPromptsResult> => {
+  const response = await fetch(`${baseUrl}/generate-refined-prompts`, {
+    body: JSON.stringify({ ...inputs, prompt_styles: promptStyles }),
+    method: "POST",
+    headers: commonHeaders,
+  });
+  if (!response.ok) {
+    throw new Error(`Failed to refine prompt (${response.status})`);
+  }
+  const res: GenerateRefinedPromptsResponse = await response.json();
+  const succeeded = res.refined_prompts.filter(
+    (result) => result.refined_prompt !== null,
   );
-  return await Promise.all(promises);
+  if (succeeded.length === 0 && res.refined_prompts.length > 0) {
+    throw new Error(res.refined_prompts[0].error ?? "Failed to refine prompt");
+  }
+  return {
+    refinedPrompts: succeeded.map((result) => ({
+      refined_prompt: result.refined_prompt as string,
+      input_variables: res.input_variables,
+      prompt_style: result.prompt_style,
+      key: uuidv4(),
+    })),
+    // shown to the user, rather than silently leaving out their cards
+    failures: res.refined_prompts
+      .filter((result) => result.refined_prompt === null)
+      .map((result) => ({
+        prompt_style: result.prompt_style,
+        error: result.error ?? "Failed to refine prompt",
+      })),
+  };
 };
 
-export const testPromptMutationFn = async (
-  inputs: TestPromptPayload,
-): Promise<string> => {
-  const response = await fetch(`${baseUrl}/test-prompt`, {
+const readEventStream = async (
+  body: ReadableStream<Uint8Array>,
+  onData: (data: unknown) => void,
+): Promise<void> => {
+  const reader = body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = "";
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) {
+      // e.g. a proxy cut the stream, so the result is incomplete
+      throw new Error("Response ended unexpectedly");
+    }
+    buffer += value;
+    const events = buffer.split("\n\n");
+    buffer = events.pop() ?? "";
+    for (const event of events) {
+      const lines = event.split("\n");
+      const type = lines
+        .find((line) => line.startsWith("event: "))
+        ?.slice("event: ".length);
+      const data = lines
+        .find((line) => line.startsWith("data: "))
+        ?.slice("data: ".length);
+      if (type === "done") {
+        return;
+      }
+      if (type === "error") {
+        throw new Error(data ? JSON.parse(data) : "Failed to read response");
+      }
+      if (data) {
+        onData(JSON.parse(data));
+      }
+    }
+  }
+};
+
+export const testPromptMutationFn = async ({
+  onPartialResponse,
+  ...inputs
+}: TestPromptPayload): Promise<string> => {
+  const response = await fetch(`${baseUrl}/test-prompt/stream`, {
     body: JSON.stringify(inputs),
     method: "POST",
     headers: commonHeaders,
   });
-  return await response.json();
+  if (!response.ok || !response.body) {
+    throw new Error(`Failed to run prompt (${response.status})`);
+  }
+  let result = "";
+  await readEventStream(response.body, (data) => {
+    result += data as string;
+    onPartialResponse?.(result);
+  });
+  return result;
 };
@@ -41,10 +41,10 @@
  */
 import { useMutation } from "@tanstack/react-query";
 import {
-  FieldTypeTaskDescription,
+  GenerateDimensionsPayload,
   GenerateDimensionsResponse,
   GenerateRefinedPromptPayload,
-  GenerateRefinedPromptResponse,
+  GenerateRefinedPromptsResult,
   PromptStyleType,
   QueryKeys,
   TestPromptPayload,
@@ -60,7 +60,7 @@ export const useGenerateDimensionsMutation = ({
   onSuccess:
     | ((
         data: GenerateDimensionsResponse,
-        variables: FieldTypeTaskDescription,
+        variables: GenerateDimensionsPayload,
         context: unknown,
       ) => unknown)
     | undefined;
@@ -79,7 +79,7 @@ export const useRefinePromptMutation = ({
   onError,
 }: {
   onSuccess?: (
-    data: GenerateRefinedPromptResponse[],
+    data: GenerateRefinedPromptsResult,
     variables: {
       promptStyles: PromptStyleType[];
       inputs: GenerateRefinedPromptPayload;
@@ -40,7 +40,6 @@
  * ***************************************************************************
  */
 import { MessageInstance } from "antd/es/message/interface";
-import { GenerateDimensionsResponse } from "./apis";
 
 export const onErrorHandler = (error: Error, messageApi: MessageInstance) => {
   messageApi.open({
@@ -49,11 +48,11 @@ export const onErrorHandler = (error: Error, messageApi: MessageInstance) => {
   });
 };
 
-export const transformSuggestedDimensions = (
-  result: GenerateDimensionsResponse,
-) =>
-  Object.entries(result.dimensions).map(([name, values]) => ({
-    name,
-    values,
-    selectedValue: "",
-  }));
+export const transformSuggestedDimension = (
+  name: string,
+  values: string[],
+) => ({
+  name,
+  values,
+  selectedValue: "",
+});
@@ -0,0 +1,180 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""Compare PromptBrew throughput on the threadpool and async LLM call paths.
+
+Starts a local mock OpenAI server, then serves ``/promptbrew/test-prompt`` two ways,
+each in its own server process:
+
+* ``threadpool``: a sync route that blocks a worker thread on
+  :func:`~prompt_brew.routers.autoprompt.open_ai.call_open_ai`, as every route did
+  before the async engine.
+* ``async``: the real PromptBrew router, which awaits the LLM on the event loop.
+
+Run from the repository root with ``python -m benchmarks.load_test``.
+
+"""
+
+import argparse
+import asyncio
+import contextlib
+import statistics
+import time
+from collections.abc import AsyncIterator
+
+import httpx
+from fastapi import FastAPI
+
+from .mock_openai import ServerProcess
+
+
+def build_threadpool_app() -> FastAPI:
+    """Build an app that serves ``/test-prompt`` from FastAPI's threadpool."""
+    from prompt_brew.routers.autoprompt import TestPromptRequest
+    from prompt_brew.routers.autoprompt.open_ai import call_open_ai
+
+    app = FastAPI()
+
+    @app.post("/promptbrew/test-prompt")
+    def test_prompt(request: TestPromptRequest) -> str:
+        return call_open_ai(
+            messages=[{"role": "user", "content": request.prompt}],
+            temperature=0.3,
+        )
+
+    return app
+
+
+def build_async_app() -> FastAPI:
+    """Build an app that serves the PromptBrew router."""
+    from prompt_brew.routers import autoprompt
+    from prompt_brew.routers.autoprompt.clients import clients
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+        await clients.aopen()
+        yield
+        await clients.aclose()
+
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(autoprompt.router)
+    return app
+
+
+async def drive(url: str, requests: int, concurrency: int) -> dict[str, float]:
+    """Send `requests` test-prompt calls to `url`, `concurrency` at a time.
+
+    Parameters
+    ----------
+    url : str
+        Base URL of the PromptBrew server.
+    requests : int greater than 0
+        Total number of requests to send.
+    concurrency : int greater than 0
+        Maximum number of requests in flight at once.
+
+    Returns
+    -------
+    dict of str to float
+        Throughput and latency summary.
+
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=None) as client:
+
+        async def send(index: int) -> None:
+            # a distinct prompt per request, so that no two calls are coalesced
+            prompt = f"Write LinkedIn post #{index}"
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(
+                    "/promptbrew/test-prompt",
+                    json={"prompt": prompt, "input_variables": {}},
+                )
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*map(send, range(requests)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests_per_second": requests / elapsed,
+        "p50_seconds": statistics.median(latencies),
+        "p95_seconds": latencies[int(0.95 * (len(latencies) - 1))],
+    }
+
+
+def main() -> None:
+    """Run the load test from the command line and print a summary."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=2.0)
+    args = parser.parse_args()
+
+    mock_env = {"MOCK_OPENAI_LATENCY": str(args.latency)}
+    with ServerProcess("benchmarks.mock_openai:create_app", env=mock_env) as mock:
+        app_env = {
+            "OPENAI_BASE_URL": f"{mock.url}/v1",
+            "OPENAI_API_KEY": "mock",
+            "AZURE_OPENAI_ENDPOINT": "",
+            # not to leave a history database behind in the working directory
+            "HISTORY_BACKEND": "none",
+        }
+        for name, factory in (
+            ("threadpool", "benchmarks.load_test:build_threadpool_app"),
+            ("async", "benchmarks.load_test:build_async_app"),
+        ):
+            with ServerProcess(factory, env=app_env) as server:
+                summary = asyncio.run(
+                    drive(server.url, args.requests, args.concurrency),
+                )
+            print(
+                f"{name:>10}: {summary['requests_per_second']:7.1f} req/s, "
+                f"p50 {summary['p50_seconds']:.2f}s, p95 {summary['p95_seconds']:.2f}s",
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,437 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""Local OpenAI-compatible mock server for load testing PromptBrew.
+
+Run standalone with ``python -m benchmarks.mock_openai --latency 0.5`` and point
+PromptBrew at it with ``OPENAI_BASE_URL=http://127.0.0.1:8900/v1``. The mock's
+behaviour can also be configured through ``MOCK_OPENAI_*`` environment variables,
+for use with ``uvicorn --factory``. Given a seed, the mock draws the same latencies
+and errors, in order of arrival, on every run. Like OpenAI, the mock reports how
+many prompt tokens were served from its prompt prefix cache.
+
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from collections.abc import AsyncIterator
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+NOMINAL_RESPONSE = {
+    "Tone": ["Formal", "Casual", "Humorous", "Inspirational", "Neutral"],
+    "Audience": ["Executives", "Engineers", "Students", "Recruiters", "General"],
+    "Format": ["List", "Story", "Question", "Announcement", "Opinion"],
+    "Length": ["Tweet", "Short", "Medium", "Long", "Essay"],
+    "Perspective": ["First person", "Second person", "Third person", "Team", "Brand"],
+}
+ORDINAL_RESPONSE = {
+    "Engaging": ["least", "less", "neutral", "more", "most"],
+    "Technical": ["least", "less", "neutral", "more", "most"],
+    "Concise": ["least", "less", "neutral", "more", "most"],
+    "Optimistic": ["least", "less", "neutral", "more", "most"],
+    "Personal": ["least", "less", "neutral", "more", "most"],
+}
+REFINED_PROMPT_RESPONSE = (
+    '"Write an engaging LinkedIn post about {{topic}} for {{audience}}.\nPost: "'
+)
+TEST_PROMPT_RESPONSE = "Excited to share what our team has been building this quarter!"
+
+
+def create_app(
+    latency: float | None = None,
+    token_interval: float | None = None,
+    error_rate: float | None = None,
+    slow_rate: float | None = None,
+    slow_latency: float | None = None,
+    latency_sigma: float | None = None,
+    seed: int | None = None,
+) -> FastAPI:
+    """Build a mock of the OpenAI chat completions API.
+
+    Parameters
+    ----------
+    latency : float greater than or equal to 0, optional
+        Median seconds to wait before the first chunk of each completion. Defaults
+        to the ``MOCK_OPENAI_LATENCY`` environment variable, or 0.5.
+    token_interval : float greater than or equal to 0, optional
+        Seconds to generate each chunk of a few characters, between the chunks of a
+        streamed completion or before answering an unstreamed one. Defaults to the
+        ``MOCK_OPENAI_TOKEN_INTERVAL`` environment variable, or 0.02.
+    error_rate : float between 0 and 1, optional
+        Fraction of requests to fail with a 429, 500, or 503 error, to exercise
+        retries and circuit breaking. Defaults to the ``MOCK_OPENAI_ERROR_RATE``
+        environment variable, or 0.
+    slow_rate : float between 0 and 1, optional
+        Fraction of requests to answer after `slow_latency` instead of `latency`,
+        to exercise hedged requests. Defaults to the ``MOCK_OPENAI_SLOW_RATE``
+        environment variable, or 0.
+    slow_latency : float greater than or equal to 0, optional
+        Seconds to wait before answering a slow request. Defaults to the
+        ``MOCK_OPENAI_SLOW_LATENCY`` environment variable, or 10.
+    latency_sigma : float greater than or equal to 0, optional
+        Shape of the log-normal distribution that latencies are drawn from, with a
+        median of `latency`; 0 makes every latency `latency`, and 0.5 gives a p99 of
+        about three times the median. Defaults to the ``MOCK_OPENAI_LATENCY_SIGMA``
+        environment variable, or 0.
+    seed : int, optional
+        Seed for drawing latencies and errors. Defaults to the ``MOCK_OPENAI_SEED``
+        environment variable, or a random seed.
+
+    Returns
+    -------
+    :class:`fastapi.FastAPI`
+        Mock server application.
+
+    """
+    if latency is None:
+        latency = float(os.environ.get("MOCK_OPENAI_LATENCY", 0.5))
+    if token_interval is None:
+        token_interval = float(os.environ.get("MOCK_OPENAI_TOKEN_INTERVAL", 0.02))
+    if error_rate is None:
+        error_rate = float(os.environ.get("MOCK_OPENAI_ERROR_RATE", 0))
+    if slow_rate is None:
+        slow_rate = float(os.environ.get("MOCK_OPENAI_SLOW_RATE", 0))
+    if slow_latency is None:
+        slow_latency = float(os.environ.get("MOCK_OPENAI_SLOW_LATENCY", 10))
+    if latency_sigma is None:
+        latency_sigma = float(os.environ.get("MOCK_OPENAI_LATENCY_SIGMA", 0))
+    if seed is None and "MOCK_OPENAI_SEED" in os.environ:
+        seed = int(os.environ["MOCK_OPENAI_SEED"])
+    rng = random.Random(seed)
+    prompt_cache = PromptCache()
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions", response_model=None)
+    @app.post(
+        "/openai/deployments/{deployment}/chat/completions",
+        response_model=None,
+    )
+    async def chat_completions(
+        request: Request,
+    ) -> dict | JSONResponse | StreamingResponse:
+        body = await request.json()
+        # drawn up front, so that the sequence does not depend on request timing
+        failed = rng.random() < error_rate
+        slow = rng.random() < slow_rate
+        delay = latency * rng.lognormvariate(0, latency_sigma)
+        error_status = rng.choice([429, 500, 503])
+        if failed:
+            return _error_response(error_status)
+        await asyncio.sleep(slow_latency if slow else delay)
+        content = _respond_to(body["messages"][-1]["content"])
+        usage = _usage(
+            body["messages"],
+            content,
+            prompt_cache.lookup(json.dumps(body["messages"])),
+        )
+        if body.get("stream"):
+            return StreamingResponse(
+                _stream_chunks(
+                    content,
+                    body.get("model", "mock"),
+                    token_interval,
+                    (
+                        usage
+                        if body.get("stream_options", {}).get("include_usage")
+                        else None
+                    ),
+                ),
+                media_type="text/event-stream",
+            )
+        await asyncio.sleep(token_interval * (len(_split_chunks(content)) - 1))
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                },
+            ],
+            "usage": usage,
+        }
+
+    return app
+
+
+async def _stream_chunks(
+    content: str,
+    model: str,
+    token_interval: float,
+    usage: dict[str, object] | None = None,
+) -> AsyncIterator[str]:
+    """Yield `content` as chat completion chunk events, a few characters at a time.
+
+    If `usage` is given, it follows in a last chunk without choices, as OpenAI sends
+    it when asked to with ``stream_options``.
+
+    """
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    pieces = _split_chunks(content)
+    for index, piece in enumerate(pieces):
+        if index:
+            await asyncio.sleep(token_interval)
+        last = index == len(pieces) - 1
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": {"content": piece},
+                    "finish_reason": "stop" if last else None,
+                },
+            ],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+    if usage is not None:
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [],
+            "usage": usage,
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def _split_chunks(content: str) -> list[str]:
+    """Split `content` into the pieces that a streamed completion sends."""
+    return [content[i : i + 4] for i in range(0, len(content), 4)]
+
+
+class PromptCache:
+    """Simulated cache of prompt prefixes, like OpenAI's.
+
+    Prompts of at least 1024 tokens are cached in increments of 128 tokens, and the
+    longest cached prefix of a later prompt counts as its cached tokens. Tokens are
+    counted as four characters each, as elsewhere in the mock.
+
+    """
+
+    MIN_TOKENS = 1024
+    INCREMENT_TOKENS = 128
+
+    def __init__(self):
+        self._prefixes: set[bytes] = set()
+
+    def lookup(self, prompt: str) -> int:
+        """Return how many tokens of `prompt` were cached, and cache its prefixes."""
+        cached_tokens = 0
+        for tokens in range(
+            self.MIN_TOKENS, len(prompt) // 4 + 1, self.INCREMENT_TOKENS
+        ):
+            prefix = hashlib.sha256(prompt[: tokens * 4].encode()).digest()
+            if prefix in self._prefixes:
+                cached_tokens = tokens
+            else:
+                self._prefixes.add(prefix)
+        return cached_tokens
+
+
+def _usage(
+    messages: list[dict[str, str]],
+    content: str,
+    cached_tokens: int = 0,
+) -> dict[str, object]:
+    """Return rough token counts for a completion, at four characters per token."""
+    prompt_tokens = len(json.dumps(messages)) // 4
+    completion_tokens = len(content) // 4
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached_tokens},
+    }
+
+
+def _error_response(status_code: int) -> JSONResponse:
+    """Return a transient error like those of the OpenAI API."""
+    return JSONResponse(
+        {
+            "error": {
+                "message": f"Injected mock error {status_code}",
+                "type": "rate_limit_error" if status_code == 429 else "server_error",
+                "code": None,
+            },
+        },
+        status_code=status_code,
+        headers={"Retry-After": "0"} if status_code == 429 else None,
+    )
+
+
+def _respond_to(prompt: str) -> str:
+    """Pick a canned completion that matches the PromptBrew request `prompt`."""
+    if "nominal dimensions" in prompt:
+        return json.dumps(NOMINAL_RESPONSE)
+    if "ordinal dimensions" in prompt:
+        return json.dumps(ORDINAL_RESPONSE)
+    if "Refined prompt with instructions:" in prompt:
+        return REFINED_PROMPT_RESPONSE
+    return TEST_PROMPT_RESPONSE
+
+
+class ServerProcess:
+    """Serve an app factory with uvicorn in a child process.
+
+    Parameters
+    ----------
+    factory : str
+        Import string of a function that returns an ASGI app, e.g.
+        ``"benchmarks.mock_openai:create_app"``.
+    env : dict of str to str, optional
+        Environment variables to set for the child process, on top of this one's.
+    cwd : str, optional
+        Directory to run the child process in, instead of this one's.
+
+    """
+
+    def __init__(
+        self,
+        factory: str,
+        env: dict[str, str] | None = None,
+        cwd: str | None = None,
+    ):
+        self.factory = factory
+        self.env = os.environ | (env or {})
+        self.cwd = cwd
+        self.port = free_port()
+        self.process = None
+
+    @property
+    def url(self) -> str:
+        """Base URL of the running server."""
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> "ServerProcess":
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "--factory",
+                self.factory,
+                "--port",
+                str(self.port),
+                "--log-level",
+                "warning",
+                # outlive the load driver's idle connections, so they are never
+                # closed by the server just as the driver reuses them
+                "--timeout-keep-alive",
+                "120",
+            ],
+            env=self.env,
+            cwd=self.cwd,
+            stdout=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"{self.factory} exited during startup")
+            try:
+                httpx.get(self.url, timeout=1)
+                return self
+            except httpx.TransportError:
+                time.sleep(0.1)
+        self.process.terminate()
+        raise TimeoutError(f"{self.factory} did not start listening on {self.url}")
+
+    def __exit__(self, *exc_info) -> None:
+        self.process.terminate()
+        self.process.wait()
+
+
+def free_port() -> int:
+    """Return a port that is currently free on ``127.0.0.1``."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def main() -> None:
+    """Serve the mock OpenAI API from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--latency-sigma", type=float, default=0.0)
+    parser.add_argument("--token-interval", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--slow-rate", type=float, default=0.0)
+    parser.add_argument("--slow-latency", type=float, default=10.0)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+    uvicorn.run(
+        create_app(
+            latency=args.latency,
+            token_interval=args.token_interval,
+            error_rate=args.error_rate,
+            slow_rate=args.slow_rate,
+            slow_latency=args.slow_latency,
+            latency_sigma=args.latency_sigma,
+            seed=args.seed,
+        ),
+        host="127.0.0.1",
+        port=args.port,
+    )
+
+
+if __name__ == "__main__":
+    main()
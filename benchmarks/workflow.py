@@ -0,0 +1,483 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""Benchmark the PromptBrew workflow that the web UI drives, against a mock LLM.
+
+Each simulated user streams dimensions for a task, refines it in every prompt style,
+then streams a test of the first refined prompt, as the web UI does. The full
+PromptBrew app is served from its own process, against a local
+:mod:`~benchmarks.mock_openai` server with a seeded, configurable latency
+distribution, token rate, and error rate. The latency percentiles of each step,
+throughput, the app's memory use, and the share of prompt tokens served from the
+mock's prompt prefix cache are saved as JSON, and can be checked against those of an
+earlier run to catch regressions before a release.
+
+Run from the repository root with ``python -m benchmarks.workflow``, e.g.::
+
+    python -m benchmarks.workflow --output baseline.json
+    python -m benchmarks.workflow --baseline baseline.json
+
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+from fastapi import FastAPI
+from prometheus_client.parser import text_string_to_metric_families
+
+from .mock_openai import ServerProcess
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+STEPS = ("dimensions", "refine", "test")
+# combined so that no two sessions' tasks have the same content words, and so no
+# session is served dimensions from the similarity cache, if it is enabled
+TASK_FORMATS = (
+    "Write a LinkedIn post announcing {}",
+    "Draft a customer newsletter about {}",
+    "Summarize the internal meeting notes on {}",
+    "Create an FAQ for the support team covering {}",
+    "Compose a press release for {}",
+)
+TASK_SUBJECTS = (
+    "the launch of our analytics dashboard",
+    "a new office opening in Lisbon",
+    "quarterly revenue growth in retail",
+    "changes to the parental leave policy",
+    "a partnership with a logistics startup",
+    "the end of support for version 2 of the mobile app",
+    "a data center migration next month",
+)
+
+
+def create_app() -> FastAPI:
+    """Return the PromptBrew app, for a server started in the ``prompt_brew`` directory."""
+    from prompt_brew.main import app
+
+    return app
+
+
+class Session:
+    """One simulated user's pass through the workflow.
+
+    Parameters
+    ----------
+    client : :class:`httpx.AsyncClient`
+        Client for the PromptBrew server.
+    task : str
+        Task description the user starts from.
+
+    """
+
+    def __init__(self, client: httpx.AsyncClient, task: str):
+        self.client = client
+        self.task = task
+        self.latencies: dict[str, float] = {}
+
+    async def run(self) -> None:
+        """Run every step of the workflow, stopping at the first that fails."""
+        dimensions = await self.generate_dimensions()
+        refined_prompt = await self.refine(dimensions)
+        await self.test(refined_prompt)
+
+    async def generate_dimensions(self) -> dict[str, list[str]]:
+        """Stream dimensions for the task, as the web UI does on submitting it."""
+        dimensions = {}
+        async for dimension in self._stream_events(
+            "dimensions",
+            "/promptbrew/generate-dimensions/stream",
+            {"prompt": self.task},
+        ):
+            dimensions[dimension["name"]] = dimension["values"]
+        return dimensions
+
+    async def refine(self, dimensions: dict[str, list[str]]) -> str:
+        """Refine the task in every prompt style, with the first value of each dimension."""
+        start = time.perf_counter()
+        response = await self.client.post(
+            "/promptbrew/generate-refined-prompts",
+            json={
+                "prompt": self.task,
+                "dimensions": {name: values[0] for name, values in dimensions.items()},
+                "prompt_styles": "all",
+            },
+        )
+        response.raise_for_status()
+        self.latencies["refine"] = time.perf_counter() - start
+        for result in response.json()["refined_prompts"]:
+            if result["refined_prompt"] is not None:
+                return result["refined_prompt"]
+        raise RuntimeError("no prompt style was refined")
+
+    async def test(self, refined_prompt: str) -> None:
+        """Stream a response to the refined prompt, as the web UI does to test it."""
+        async for _ in self._stream_events(
+            "test",
+            "/promptbrew/test-prompt/stream",
+            {"prompt": refined_prompt, "input_variables": {}},
+        ):
+            pass
+
+    async def _stream_events(self, step: str, path: str, payload: dict):
+        """Yield the data of each Server-Sent Event from `path`, timing `step`."""
+        start = time.perf_counter()
+        async with self.client.stream("POST", path, json=payload) as response:
+            response.raise_for_status()
+            event = None
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[len("event: ") :]
+                elif line.startswith("data: "):
+                    if event == "error":
+                        raise RuntimeError(json.loads(line[len("data: ") :]))
+                    if event == "done":
+                        break
+                    if f"{step}_first" not in self.latencies:
+                        self.latencies[f"{step}_first"] = time.perf_counter() - start
+                    yield json.loads(line[len("data: ") :])
+                else:
+                    event = None
+        self.latencies[step] = time.perf_counter() - start
+
+
+async def drive(
+    url: str,
+    sessions: int,
+    concurrency: int,
+    warmup: int = 1,
+) -> dict[str, object]:
+    """Run `sessions` simulated users against `url`, `concurrency` at a time.
+
+    Parameters
+    ----------
+    url : str
+        Base URL of the PromptBrew server.
+    sessions : int greater than 0
+        Number of sessions to measure.
+    concurrency : int greater than 0
+        Maximum number of sessions in progress at once.
+    warmup : int greater than or equal to 0, default 1
+        Number of sessions to run one at a time first, without measuring them.
+
+    Returns
+    -------
+    dict of str to object
+        Throughput, error counts, and latency percentiles of each step.
+
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: dict[str, list[float]] = {}
+    errors: dict[str, int] = {}
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=None) as client:
+
+        async def run_session(index: int, measure: bool = True) -> None:
+            task_format = TASK_FORMATS[index % len(TASK_FORMATS)]
+            subject = TASK_SUBJECTS[index // len(TASK_FORMATS) % len(TASK_SUBJECTS)]
+            session = Session(client, f"{task_format.format(subject)} (#{index})")
+            async with semaphore:
+                try:
+                    await session.run()
+                except (httpx.HTTPError, RuntimeError) as e:
+                    if measure:
+                        # the step that failed is the first one without a latency
+                        step = next(s for s in STEPS if s not in session.latencies)
+                        errors[step] = errors.get(step, 0) + 1
+                    print(f"Session {index} failed: {e!r}", file=sys.stderr)
+            if measure:
+                for step, latency in session.latencies.items():
+                    latencies.setdefault(step, []).append(latency)
+
+        for index in range(warmup):
+            await run_session(-1 - index, measure=False)
+        start = time.perf_counter()
+        await asyncio.gather(*(run_session(index) for index in range(sessions)))
+        elapsed = time.perf_counter() - start
+
+    completed = len(latencies.get(STEPS[-1], []))
+    requests = sum(len(latencies.get(step, [])) for step in STEPS)
+    return {
+        "elapsed_seconds": elapsed,
+        "sessions_per_second": completed / elapsed,
+        "requests_per_second": requests / elapsed,
+        "completed_sessions": completed,
+        "errors": errors,
+        "latency_seconds": {
+            step: summarize(values) for step, values in sorted(latencies.items())
+        },
+    }
+
+
+def summarize(latencies: list[float]) -> dict[str, float]:
+    """Return the mean and p50, p95, and p99 of `latencies`."""
+    if len(latencies) == 1:
+        cut_points = latencies * 99
+    else:
+        cut_points = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "count": len(latencies),
+        "mean": statistics.fmean(latencies),
+        "p50": cut_points[49],
+        "p95": cut_points[94],
+        "p99": cut_points[98],
+        "max": max(latencies),
+    }
+
+
+def memory_usage(pid: int) -> dict[str, float] | None:
+    """Return the current and peak resident memory of process `pid` in MiB, if known.
+
+    Only Linux reports the memory of other processes through ``/proc``.
+
+    """
+    try:
+        status = Path(f"/proc/{pid}/status").read_text()
+    except OSError:
+        return None
+    fields = dict(line.split(":", 1) for line in status.splitlines() if ":" in line)
+    return {
+        # reported in kB
+        "rss_mib": int(fields["VmRSS"].split()[0]) / 1024,
+        "peak_rss_mib": int(fields["VmHWM"].split()[0]) / 1024,
+    }
+
+
+def token_usage(url: str) -> dict[str, float]:
+    """Return the LLM tokens counted by the PromptBrew server at `url`, by kind.
+
+    Besides the totals of each kind, the result includes the fraction of prompt
+    tokens that were served from the provider's prompt cache.
+
+    """
+    response = httpx.get(f"{url}/metrics")
+    response.raise_for_status()
+    tokens = {}
+    for family in text_string_to_metric_families(response.text):
+        if family.name != "promptbrew_llm_tokens":
+            continue
+        for sample in family.samples:
+            if sample.name.endswith("_total"):
+                kind = sample.labels["kind"]
+                tokens[kind] = tokens.get(kind, 0) + sample.value
+    prompt_tokens = tokens.get("prompt", 0)
+    tokens["cached_prompt_fraction"] = (
+        tokens.get("cached_prompt", 0) / prompt_tokens if prompt_tokens else 0.0
+    )
+    return tokens
+
+
+def find_regressions(
+    results: dict[str, object],
+    baseline: dict[str, object],
+    tolerance: float,
+) -> list[str]:
+    """Describe each way that `results` are more than `tolerance` worse than `baseline`.
+
+    Parameters
+    ----------
+    results, baseline : dict of str to object
+        Benchmark results, as saved by :func:`main`.
+    tolerance : float greater than or equal to 0
+        Fraction by which a latency percentile, memory use, or error count may rise,
+        or throughput or the cached fraction of prompt tokens may fall, without
+        counting as a regression.
+
+    Returns
+    -------
+    list of str
+        Descriptions of regressions, if any.
+
+    """
+    regressions = []
+
+    def check(name: str, value: float, baseline_value: float, higher_is_worse: bool):
+        limit = baseline_value * (1 + tolerance if higher_is_worse else 1 - tolerance)
+        if value > limit if higher_is_worse else value < limit:
+            regressions.append(f"{name}: {value:.3f}, was {baseline_value:.3f}")
+
+    for step, summary in baseline["latency_seconds"].items():
+        if step not in results["latency_seconds"]:
+            regressions.append(f"{step}: no longer measured")
+            continue
+        for percentile in ("p50", "p95", "p99"):
+            check(
+                f"{step} {percentile} latency (s)",
+                results["latency_seconds"][step][percentile],
+                summary[percentile],
+                higher_is_worse=True,
+            )
+    check(
+        "sessions per second",
+        results["sessions_per_second"],
+        baseline["sessions_per_second"],
+        higher_is_worse=False,
+    )
+    error_count = sum(results["errors"].values())
+    baseline_error_count = sum(baseline["errors"].values())
+    if error_count > baseline_error_count * (1 + tolerance):
+        regressions.append(f"errors: {error_count}, was {baseline_error_count}")
+    if results["server_memory"] and baseline["server_memory"]:
+        check(
+            "peak server memory (MiB)",
+            results["server_memory"]["peak_rss_mib"],
+            baseline["server_memory"]["peak_rss_mib"],
+            higher_is_worse=True,
+        )
+    if "llm_tokens" in results and "llm_tokens" in baseline:
+        check(
+            "cached fraction of prompt tokens",
+            results["llm_tokens"]["cached_prompt_fraction"],
+            baseline["llm_tokens"]["cached_prompt_fraction"],
+            higher_is_worse=False,
+        )
+    return regressions
+
+
+def main() -> None:
+    """Run the benchmark from the command line and save or print its results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--latency-sigma", type=float, default=0.5)
+    parser.add_argument("--token-interval", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="file to save results to")
+    parser.add_argument(
+        "--baseline",
+        type=Path,
+        help="results of an earlier run to check for regressions against",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    mock_env = {
+        "MOCK_OPENAI_LATENCY": str(args.latency),
+        "MOCK_OPENAI_LATENCY_SIGMA": str(args.latency_sigma),
+        "MOCK_OPENAI_TOKEN_INTERVAL": str(args.token_interval),
+        "MOCK_OPENAI_ERROR_RATE": str(args.error_rate),
+        "MOCK_OPENAI_SEED": str(args.seed),
+    }
+    with (
+        ServerProcess("benchmarks.mock_openai:create_app", env=mock_env) as mock,
+        tempfile.TemporaryDirectory() as state_dir,
+    ):
+        app_env = {
+            "OPENAI_BASE_URL": f"{mock.url}/v1",
+            "OPENAI_API_KEY": "mock",
+            "AZURE_OPENAI_ENDPOINT": "",
+            "PYTHONPATH": str(REPO_ROOT),
+            # not the app's own files in prompt_brew, to neither leave nor load state
+            "CACHE_PATH": os.path.join(state_dir, "cache.sqlite3"),
+            "HISTORY_PATH": os.path.join(state_dir, "history.sqlite3"),
+            "WARMUP_SNAPSHOT_PATH": os.path.join(state_dir, "warmup.json"),
+        }
+        with ServerProcess(
+            "benchmarks.workflow:create_app",
+            env=app_env,
+            cwd=str(REPO_ROOT / "prompt_brew"),
+        ) as server:
+            results = asyncio.run(
+                drive(server.url, args.sessions, args.concurrency, args.warmup),
+            )
+            results["server_memory"] = memory_usage(server.process.pid)
+            results["llm_tokens"] = token_usage(server.url)
+
+    results = {
+        "config": {
+            name: str(value) if isinstance(value, Path) else value
+            for name, value in vars(args).items()
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "commit": _git_commit(),
+        },
+        **results,
+    }
+    report = json.dumps(results, indent=2)
+    if args.output is None:
+        print(report)
+    else:
+        args.output.write_text(report + "\n")
+
+    if args.baseline is not None:
+        baseline = json.loads(args.baseline.read_text())
+        for name in ("sessions", "concurrency", "latency", "latency_sigma", "seed"):
+            if baseline["config"][name] != results["config"][name]:
+                print(
+                    f"Warning: baseline was run with a different --{name}",
+                    file=sys.stderr,
+                )
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression in {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+def _git_commit() -> str | None:
+    """Return the commit that the repository is checked out at, if known."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    main()
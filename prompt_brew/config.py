@@ -46,11 +46,19 @@ simply the field name in all capital letters.
 
 """
 
-from typing import Optional
+from typing import Literal, Optional
 
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 
 
+class RateLimit(BaseModel):
+    """Requests- and tokens-per-minute budget of an OpenAI model."""
+
+    rpm: Optional[int] = None  # requests per minute, unlimited if not set
+    tpm: Optional[int] = None  # tokens per minute, unlimited if not set
+
+
 class OpenAISettings(BaseSettings, str_strip_whitespace=True):
     """OpenAI configuration for use by PromptBrew."""
 
@@ -59,11 +67,143 @@ class OpenAISettings(BaseSettings, str_strip_whitespace=True):
     openai_api_key: str
     openai_model: str = "gpt-3.5-turbo"
 
+    # connection pool shared by every OpenAI call in this process
+    openai_max_connections: int = 1000
+    openai_max_keepalive_connections: int = 100
+    openai_keepalive_expiry: float = 30.0  # seconds
+    openai_http2: bool = False  # requires the h2 package
+    openai_timeout: float = 600.0  # seconds
+    openai_connect_timeout: float = 5.0  # seconds
+    openai_shutdown_grace_period: float = 30.0  # seconds to drain in-flight calls
+
+    # client-side budgets by model name, with "*" matching any other model, e.g.
+    # OPENAI_RATE_LIMITS='{"gpt-3.5-turbo": {"rpm": 3500, "tpm": 90000}}'
+    openai_rate_limits: dict[str, RateLimit] = {}
+    # SQLite file to keep budgets in, so that worker processes share them
+    openai_rate_limit_path: Optional[str] = None
+    openai_completion_token_estimate: int = 512  # tokens reserved per completion
+
+    # models by task, overriding openai_model; a task is "dimensions:nominal",
+    # "dimensions:ordinal", "refine:<prompt style>", or "test", and its part before
+    # the colon matches all of its kind, e.g.
+    # OPENAI_TASK_MODELS='{"dimensions": "gpt-4o-mini", "refine": "gpt-4o"}'
+    openai_task_models: dict[str, str] = {}
+    # models to fall back on, in order, when a model is slow, rate-limited, or
+    # failing, e.g. OPENAI_FALLBACK_MODELS='{"gpt-4o": ["gpt-4o-mini"]}'
+    openai_fallback_models: dict[str, list[str]] = {}
+
+    def models_for(self, task: str) -> list[str]:
+        """Return the model to call for `task`, followed by any to fall back on."""
+        model = self.openai_task_models.get(task) or self.openai_task_models.get(
+            task.split(":")[0],
+            self.openai_model,
+        )
+        fallbacks = self.openai_fallback_models.get(model, [])
+        return list(dict.fromkeys([model, *fallbacks]))
+
+
+class ResilienceSettings(BaseSettings, str_strip_whitespace=True):
+    """Retry, hedging, and circuit breaking configuration for OpenAI calls."""
+
+    retry_max_attempts: int = 4  # including the first
+    retry_backoff_base: float = 0.5  # seconds, doubled after each failed attempt
+    retry_backoff_max: float = 8.0  # seconds
+    hedge_requests: bool = False  # send a second attempt when the first is slow
+    hedge_percentile: float = 0.95  # of recent latencies, after which to hedge
+    hedge_min_samples: int = 20  # latencies to observe before hedging
+    circuit_failure_threshold: int = 5  # consecutive failures that open the circuit
+    circuit_reset_timeout: float = 30.0  # seconds before retrying an open circuit
+    fallback_timeout: Optional[float] = None  # seconds before trying a fallback model
+
+
+class CacheSettings(BaseSettings, str_strip_whitespace=True):
+    """LLM response cache configuration for use by PromptBrew."""
+
+    cache_backend: Literal["none", "memory", "sqlite"] = "memory"
+    cache_max_entries: int = 1024
+    cache_ttl: float = 24 * 60 * 60  # seconds
+    cache_path: str = "prompt_brew_cache.sqlite3"  # only used by sqlite backend
+    # similarity of normalized task text (0 to 1), e.g. 0.95, at which dimensions
+    # suggested for one task are reused for another with the same content words,
+    # up to spelling variants, e.g. "summarize" and "summarise";
+    # unset to only reuse them for identical tasks
+    cache_similarity_threshold: Optional[float] = None
+
+
+class TemplateSettings(BaseSettings, str_strip_whitespace=True):
+    """Prompt template rendering configuration for use by PromptBrew."""
+
+    template_cache_size: int = 256  # compiled templates to keep
+    template_render_timeout: float = 1.0  # seconds
+    template_max_output_chars: int = 1_000_000
+
+
+class TracingSettings(BaseSettings, str_strip_whitespace=True):
+    """OpenTelemetry tracing configuration for use by PromptBrew."""
+
+    tracing_exporter: Literal["none", "otlp", "file"] = "none"
+    # defaults to OTEL_EXPORTER_OTLP_TRACES_ENDPOINT or a collector on localhost
+    tracing_otlp_endpoint: Optional[str] = None
+    tracing_file_path: str = "prompt_brew_traces.jsonl"  # only used by file exporter
+    tracing_service_name: str = "prompt-brew"
+
+
+class HistorySettings(BaseSettings, str_strip_whitespace=True):
+    """Prompt run history configuration for use by PromptBrew."""
+
+    history_backend: Literal["none", "sqlite"] = "none"
+    history_path: str = "prompt_brew_history.sqlite3"
+    history_batch_size: int = 100  # runs to write per transaction
+    history_flush_interval: float = 1.0  # seconds a run may wait to be written
+    history_max_runs: Optional[int] = 10_000  # oldest runs are deleted beyond this
+    history_ttl: Optional[float] = 30 * 24 * 60 * 60  # seconds to keep each run
+
+
+class WarmupSettings(BaseSettings, str_strip_whitespace=True):
+    """Warm-up configuration for the suggested tasks of the web UI."""
+
+    # as in FeApp/src/PromptBrew/TaskDescription/SuggestedTasksButtons.tsx
+    warmup_tasks: list[str] = [
+        "Write a LinkedIn post from a blog article",
+        "Create product announcements from PRDs",
+        "Create an email from a set of notes",
+    ]
+    warmup_snapshot_path: str = "prompt_brew_warmup.json"  # loaded at startup
+    warmup_at_startup: bool = False  # make a missing or stale snapshot at startup
+    warmup_refine: bool = True  # also refine each task in every prompt style
+
+
+class StaticSettings(BaseSettings, str_strip_whitespace=True):
+    """Web app file serving configuration for use by PromptBrew."""
+
+    # files named with a content hash by the Vite build, relative to FeApp/dist,
+    # which browsers may keep for good; any other file is revalidated by its ETag
+    static_immutable_pattern: str = r"^assets/.+-[\w-]{8}\.\w+$"
+    static_max_age: int = 365 * 24 * 60 * 60  # seconds, for immutable files
+    static_memory_file_size: int = 256 * 1024  # bytes, of the largest file held
+    static_memory_max_bytes: int = 32 * 1024 * 1024  # held in memory in total
+
 
 class Settings(BaseSettings):
     """PromptBrew configuration."""
 
     openai: OpenAISettings = OpenAISettings()
+    resilience: ResilienceSettings = ResilienceSettings()
+    cache: CacheSettings = CacheSettings()
+    templates: TemplateSettings = TemplateSettings()
+    tracing: TracingSettings = TracingSettings()
+    history: HistorySettings = HistorySettings()
+    warmup: WarmupSettings = WarmupSettings()
+    static: StaticSettings = StaticSettings()
+
+    dimensions_timeout: Optional[float] = 60.0  # seconds
+    dimensions_json_mode: bool = False  # requires a model with JSON mode support
+    refine_timeout: Optional[float] = 120.0  # seconds
+    test_prompt_timeout: Optional[float] = 120.0  # seconds
+    workers: int = 1  # server processes, when started with prompt_brew.serve
+    batch_concurrency: int = 8  # rows of a prompt batch to run at once
+    batch_max_rows: int = 10_000
+    batch_max_upload_bytes: int = 50 * 1024 * 1024  # of sample data files
 
 
 settings = Settings()
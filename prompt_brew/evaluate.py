@@ -0,0 +1,586 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""
+Offline comparison of prompt styles across tasks and a dataset of input variables.
+
+Every task is refined with every prompt style, and each refined prompt is tested
+with every row of the dataset. Run from the repository root, e.g. as a CML job (see
+``tasks/evaluate_prompt_styles.py``)::
+
+    python -m prompt_brew.evaluate --tasks tasks.txt --variables rows.csv --output results.csv
+
+Tasks are read one per line, or from JSON Lines with a ``task`` and optional
+``dimensions`` and ``input_variables`` (names to descriptions) per line, and default
+to the suggested tasks of the web UI. Variables are read from CSV or JSON Lines, as
+for a prompt batch. Results are saved with one row per task, prompt style, and
+dataset row, as CSV (the default, to ``prompt_brew_evaluation.csv``) or Parquet, by
+the output file's extension. Parquet requires the ``pyarrow`` package, which is not
+among the server's requirements; install it separately to save results as Parquet.
+
+Completed refinements and cells are appended to a checkpoint file as they finish,
+so a run that is interrupted can be started again with the same arguments to pick
+up where it left off; cells that failed are retried. The checkpoint is removed once
+every cell has succeeded.
+
+"""
+
+import argparse
+import asyncio
+import csv
+import dataclasses
+import hashlib
+import json
+import logging
+import sys
+import time
+from collections.abc import Awaitable, Callable, Iterable
+from pathlib import Path
+from typing import TypeVar
+
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # only needed to save results as Parquet
+    pyarrow = None
+
+from .config import settings
+from .routers.autoprompt.batch import parse_rows
+from .routers.autoprompt.clients import clients
+from .routers.autoprompt.history import history
+from .routers.autoprompt.open_ai import get_refined_prompts, run_prompt
+from .routers.autoprompt.prompts import PromptStyle
+from .routers.autoprompt.rate_limit import Priority
+from .routers.autoprompt.rendering import prompt_renderer
+from .routers.autoprompt.resilience import deadline
+
+# not __name__, which is "__main__" when run with -m
+logger = logging.getLogger("prompt_brew.evaluate")
+
+DEFAULT_OUTPUT_PATH = "prompt_brew_evaluation.csv"
+
+T = TypeVar("T")
+
+RESULT_COLUMNS = (
+    "task_index",
+    "task",
+    "prompt_style",
+    "refined_prompt",
+    "row",
+    "input_variables",  # JSON object of the row's variables
+    "output",
+    "error",
+    "elapsed_seconds",
+)
+
+
+@dataclasses.dataclass
+class EvaluationTask:
+    """A task to refine with every prompt style."""
+
+    task: str
+    dimensions: dict[str, str] = dataclasses.field(default_factory=dict)
+    input_variables: dict[str, str] = dataclasses.field(default_factory=dict)
+
+
+def load_tasks(path: Path) -> list[EvaluationTask]:
+    """Read tasks from a text file, one per line, or from JSON Lines.
+
+    Parameters
+    ----------
+    path : :class:`pathlib.Path`
+        File of tasks. Files ending in ``.jsonl`` or ``.ndjson`` are parsed as
+        JSON Lines, with a ``task`` and optional ``dimensions`` and
+        ``input_variables`` objects per line, and anything else as text.
+
+    Returns
+    -------
+    list of :class:`EvaluationTask`
+        Tasks, in the order of the file.
+
+    Raises
+    ------
+    ValueError
+        If a line of JSON Lines is not an object with a ``task``.
+
+    """
+    lines = path.read_text(encoding="utf-8-sig").splitlines()
+    if not path.name.lower().endswith((".jsonl", ".ndjson")):
+        return [EvaluationTask(line.strip()) for line in lines if line.strip()]
+    tasks = []
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        task = json.loads(line)
+        if not isinstance(task, dict) or "task" not in task:
+            raise ValueError(f"line {line_number} is not a JSON object with a task")
+        tasks.append(
+            EvaluationTask(
+                task["task"],
+                task.get("dimensions", {}),
+                task.get("input_variables", {}),
+            ),
+        )
+    return tasks
+
+
+class Checkpoint:
+    """Append-only log of an evaluation's refinements and cells, to resume it from.
+
+    Parameters
+    ----------
+    path : :class:`pathlib.Path`
+        JSON Lines file to log to, created if it does not exist.
+    fingerprint : str
+        Digest of the evaluation's inputs, from :func:`fingerprint`.
+
+    Raises
+    ------
+    ValueError
+        If the checkpoint exists but was logged for different inputs.
+
+    """
+
+    def __init__(self, path: Path, fingerprint: str):
+        self.path = path
+        # the latest record of each refinement and cell, including failures
+        self.refinements: dict[tuple[int, str], dict] = {}
+        self.cells: dict[tuple[int, str, int], dict] = {}
+        exists = path.exists()
+        if exists:
+            self._load(fingerprint)
+        self._file = path.open("a", encoding="utf-8")
+        if not exists:
+            self._append({"type": "header", "fingerprint": fingerprint})
+
+    def refined_prompt(self, task_index: int, style: PromptStyle) -> str | None:
+        """Return the successful refinement of a task with `style`, if any."""
+        record = self.refinements.get((task_index, style.value))
+        return None if record is None else record["refined_prompt"]
+
+    def is_done(self, task_index: int, style: PromptStyle, row: int) -> bool:
+        """Return whether a cell has succeeded."""
+        record = self.cells.get((task_index, style.value, row))
+        return record is not None and record["error"] is None
+
+    def add_refinement(self, record: dict) -> None:
+        """Log the refinement of a task with a style."""
+        self.refinements[record["task_index"], record["prompt_style"]] = record
+        self._append({"type": "refinement", **record})
+
+    def add_cell(self, record: dict) -> None:
+        """Log the result of a cell, with the columns of :data:`RESULT_COLUMNS`."""
+        self.cells[record["task_index"], record["prompt_style"], record["row"]] = record
+        self._append({"type": "cell", **record})
+
+    def close(self) -> None:
+        """Close the log file."""
+        self._file.close()
+
+    def _load(self, fingerprint: str) -> None:
+        """Read the records logged so far."""
+        with self.path.open(encoding="utf-8") as file:
+            lines = file.read().splitlines()
+        for line_number, line in enumerate(lines, start=1):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # the last line may have been cut off by the interruption
+                logger.warning("Skipping incomplete line %d of checkpoint", line_number)
+                continue
+            kind = record.pop("type")
+            if kind == "header" and record["fingerprint"] != fingerprint:
+                raise ValueError(
+                    f"checkpoint {self.path} is of a run with different inputs; "
+                    "delete it or pass --restart",
+                )
+            if kind == "refinement" and record["refined_prompt"] is not None:
+                self.refinements[record["task_index"], record["prompt_style"]] = record
+            elif kind == "cell":
+                self.cells[
+                    record["task_index"], record["prompt_style"], record["row"]
+                ] = record
+
+    def _append(self, record: dict) -> None:
+        """Write `record` as a line, flushed so that it survives an interruption."""
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+
+def fingerprint(
+    tasks: list[EvaluationTask],
+    rows: list[dict[str, str]],
+    styles: list[PromptStyle],
+) -> str:
+    """Return a digest of an evaluation's inputs, to tell whether a checkpoint is of them."""
+    payload = json.dumps(
+        [
+            [dataclasses.asdict(task) for task in tasks],
+            rows,
+            [style.value for style in styles],
+        ],
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+async def evaluate(
+    tasks: list[EvaluationTask],
+    rows: list[dict[str, str]],
+    styles: list[PromptStyle],
+    checkpoint: Checkpoint,
+    concurrency: int,
+) -> None:
+    """Refine every task with every style, then run each refined prompt on every row.
+
+    Refinements and cells already completed in `checkpoint` are skipped, and new
+    ones are logged to it as they finish.
+
+    Parameters
+    ----------
+    tasks : list of :class:`EvaluationTask`
+        Tasks to refine.
+    rows : list of dict of str to str
+        Input variables to render each refined prompt with.
+    styles : list of :class:`~prompt_brew.routers.autoprompt.prompts.PromptStyle`
+        Prompt styles to refine each task with.
+    checkpoint : :class:`Checkpoint`
+        Log of completed refinements and cells.
+    concurrency : int greater than 0
+        Largest number of LLM calls to make at once.
+
+    """
+
+    async def refine(task_index: int) -> None:
+        task = tasks[task_index]
+        missing_styles = [
+            style
+            for style in styles
+            if checkpoint.refined_prompt(task_index, style) is None
+        ]
+        with deadline(settings.refine_timeout):
+            results = await get_refined_prompts(
+                prompt=task.task,
+                requirements=task.dimensions,
+                input_variables=task.input_variables,
+                prompt_styles=missing_styles,
+            )
+        for result in results:
+            checkpoint.add_refinement(
+                {
+                    "task_index": task_index,
+                    "prompt_style": result.prompt_style.value,
+                    "refined_prompt": result.refined_prompt,
+                    "error": None if result.error is None else str(result.error),
+                },
+            )
+
+    pending_tasks = [
+        task_index
+        for task_index in range(len(tasks))
+        if any(checkpoint.refined_prompt(task_index, style) is None for style in styles)
+    ]
+    logger.info("Refining %d tasks", len(pending_tasks))
+    # each task is refined with all of its styles at once
+    await _run_pool(pending_tasks, refine, max(1, concurrency // len(styles)))
+
+    pending_cells = [
+        (task_index, style, row)
+        for task_index in range(len(tasks))
+        for style in styles
+        for row in range(len(rows))
+        if not checkpoint.is_done(task_index, style, row)
+    ]
+    completed = 0
+
+    async def run_cell(cell: tuple[int, PromptStyle, int]) -> None:
+        nonlocal completed
+        task_index, style, row = cell
+        refined_prompt = checkpoint.refined_prompt(task_index, style)
+        start = time.perf_counter()
+        output = error = None
+        if refined_prompt is None:
+            refinement = checkpoint.refinements.get((task_index, style.value))
+            error = "refinement failed: " + (
+                refinement["error"] if refinement is not None else "not attempted"
+            )
+        else:
+            try:
+                rendered = await run_in_threadpool(
+                    prompt_renderer.render,
+                    refined_prompt,
+                    rows[row],
+                )
+                with deadline(settings.test_prompt_timeout):
+                    output = await run_prompt(
+                        rendered,
+                        template=refined_prompt,
+                        input_variables=rows[row],
+                        priority=Priority.BATCH,
+                    )
+            except Exception as e:
+                logger.warning(
+                    "Task %d with style %s failed on row %d: %r",
+                    task_index,
+                    style.value,
+                    row,
+                    e,
+                )
+                error = str(e) or type(e).__name__
+        checkpoint.add_cell(
+            _result(
+                tasks,
+                rows,
+                task_index,
+                style,
+                refined_prompt,
+                row,
+                output,
+                error,
+                time.perf_counter() - start,
+            ),
+        )
+        completed += 1
+        if completed % max(1, len(pending_cells) // 20) == 0:
+            logger.info("Completed %d of %d cells", completed, len(pending_cells))
+
+    logger.info("Running %d cells", len(pending_cells))
+    await _run_pool(pending_cells, run_cell, concurrency)
+
+
+async def _run_pool(
+    items: Iterable[T],
+    work: Callable[[T], Awaitable[None]],
+    concurrency: int,
+) -> None:
+    """Call `work` on each of `items`, with at most `concurrency` calls at once."""
+    pending = iter(items)
+
+    async def worker() -> None:
+        for item in pending:
+            await work(item)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+def _result(
+    tasks: list[EvaluationTask],
+    rows: list[dict[str, str]],
+    task_index: int,
+    style: PromptStyle,
+    refined_prompt: str | None,
+    row: int,
+    output: str | None,
+    error: str | None,
+    elapsed_seconds: float,
+) -> dict:
+    """Return the result of a cell, with the columns of :data:`RESULT_COLUMNS`."""
+    return {
+        "task_index": task_index,
+        "task": tasks[task_index].task,
+        "prompt_style": style.value,
+        "refined_prompt": refined_prompt,
+        "row": row,
+        "input_variables": json.dumps(rows[row], ensure_ascii=False),
+        "output": output,
+        "error": error,
+        "elapsed_seconds": elapsed_seconds,
+    }
+
+
+def write_results(results: list[dict], path: Path) -> None:
+    """Save results as Parquet or CSV, by the extension of `path`.
+
+    Parameters
+    ----------
+    results : list of dict
+        Results of each cell, with the columns of :data:`RESULT_COLUMNS`.
+    path : :class:`pathlib.Path`
+        File to save to, ending in ``.parquet`` or ``.csv``.
+
+    Raises
+    ------
+    ImportError
+        If saving as Parquet and the ``pyarrow`` package is not installed.
+    ValueError
+        If `path` has another extension.
+
+    """
+    _check_output_path(path)
+    if path.suffix.lower() == ".csv":
+        with path.open("w", encoding="utf-8", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=RESULT_COLUMNS)
+            writer.writeheader()
+            writer.writerows(results)
+        return
+    schema = pyarrow.schema(
+        [
+            ("task_index", pyarrow.int32()),
+            ("task", pyarrow.string()),
+            ("prompt_style", pyarrow.dictionary(pyarrow.int8(), pyarrow.string())),
+            ("refined_prompt", pyarrow.string()),
+            ("row", pyarrow.int32()),
+            ("input_variables", pyarrow.string()),
+            ("output", pyarrow.string()),
+            ("error", pyarrow.string()),
+            ("elapsed_seconds", pyarrow.float64()),
+        ],
+    )
+    table = pyarrow.Table.from_pylist(results, schema=schema)
+    pyarrow.parquet.write_table(table, path)
+
+
+def _check_output_path(path: Path) -> None:
+    """Raise if results cannot be saved to `path`; see :func:`write_results`."""
+    suffix = path.suffix.lower()
+    if suffix == ".parquet" and pyarrow is None:
+        raise ImportError(
+            "saving results as Parquet requires the pyarrow package; install it or "
+            "save results as .csv",
+        )
+    if suffix not in (".parquet", ".csv"):
+        raise ValueError(f"results must be saved as .parquet or .csv, not {path}")
+
+
+async def _main(args: argparse.Namespace) -> int:
+    """Run an evaluation as configured by command-line `args`; return the exit code."""
+    _check_output_path(args.output)
+    if args.tasks is None:
+        tasks = [EvaluationTask(task) for task in settings.warmup.warmup_tasks]
+    else:
+        tasks = load_tasks(args.tasks)
+    rows = [{}]
+    if args.variables is not None:
+        with args.variables.open("rb") as file:
+            rows = list(parse_rows(file, args.variables.name, sys.maxsize))
+    styles = list(args.styles)
+    checkpoint_path = args.checkpoint or args.output.with_name(
+        args.output.name + ".checkpoint.jsonl",
+    )
+    if args.restart:
+        checkpoint_path.unlink(missing_ok=True)
+    checkpoint = Checkpoint(checkpoint_path, fingerprint(tasks, rows, styles))
+    try:
+        await evaluate(tasks, rows, styles, checkpoint, args.concurrency)
+    finally:
+        checkpoint.close()
+        await clients.aclose()
+
+    results = sorted(
+        checkpoint.cells.values(),
+        key=lambda result: (
+            result["task_index"],
+            styles.index(PromptStyle(result["prompt_style"])),
+            result["row"],
+        ),
+    )
+    write_results(results, args.output)
+    failed = sum(result["error"] is not None for result in results)
+    logger.info("Saved %d results to %s", len(results), args.output)
+    if failed:
+        logger.warning(
+            "%d cells failed; run again with the same arguments to retry them",
+            failed,
+        )
+        return 1
+    checkpoint_path.unlink()
+    return 0
+
+
+def main() -> None:
+    """Run an evaluation from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--tasks",
+        type=Path,
+        help="text file of tasks, one per line, or JSON Lines (default: the "
+        "WARMUP_TASKS setting, i.e. the suggested tasks of the web UI)",
+    )
+    parser.add_argument(
+        "--variables",
+        type=Path,
+        help="CSV or JSON Lines of input variables to test each prompt with",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=Path(DEFAULT_OUTPUT_PATH),
+        help="file to save results to, ending in .csv or .parquet "
+        f"(default: {DEFAULT_OUTPUT_PATH})",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        type=Path,
+        help="file to log progress to (default: the output file + .checkpoint.jsonl)",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="discard any checkpoint and start over",
+    )
+    parser.add_argument(
+        "--styles",
+        type=PromptStyle,
+        nargs="+",
+        default=list(PromptStyle),
+        help="prompt styles to compare (default: all)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=settings.batch_concurrency,
+        help="LLM calls to make at once (default: the BATCH_CONCURRENCY setting)",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    history.open()
+    try:
+        exit_code = asyncio.run(_main(args))
+    finally:
+        history.close()
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -40,13 +40,43 @@
 
 """Entrypoint for PromptBrew FastAPI server."""
 
+import contextlib
+from collections.abc import AsyncIterator
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 
+from .config import settings
+from .metrics import MetricsMiddleware, mark_process_dead, metrics
 from .routers import autoprompt
+from .routers.autoprompt.cache import response_cache
+from .routers.autoprompt.clients import clients
+from .routers.autoprompt.history import history
+from .routers.autoprompt.rate_limit import rate_limiters
+from .static import PrecompressedStaticFiles
+from .tracing import TracingMiddleware, tracing
+from .warmup import start_warmup
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """Open shared resources at startup and release them at shutdown."""
+    tracing.start()
+    history.open()
+    await clients.aopen()
+    warmup = start_warmup(settings.warmup)
+    yield
+    if warmup is not None:
+        warmup.cancel()
+    await clients.aclose()
+    response_cache.close()
+    history.close()
+    rate_limiters.close()
+    tracing.close()
+    mark_process_dead()
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -54,5 +84,12 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(TracingMiddleware)
 app.include_router(autoprompt.router)
-app.mount("/", StaticFiles(directory="../FeApp/dist", html=True), name="webapp")
+app.add_api_route("/metrics", metrics, include_in_schema=False)
+app.mount(
+    "/",
+    PrecompressedStaticFiles(settings.static, directory="../FeApp/dist", html=True),
+    name="webapp",
+)
@@ -0,0 +1,204 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""
+Prometheus metrics for PromptBrew.
+
+When the server runs several worker processes, the launcher sets
+``PROMETHEUS_MULTIPROC_DIR`` so that :func:`metrics` reports the sum over all of
+them, and each worker calls :func:`mark_process_dead` as it exits.
+
+"""
+
+import contextlib
+import os
+import time
+from collections.abc import Iterator
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .tracing import Span, tracing
+
+# LLM calls take seconds, so extend the default buckets well beyond 10 seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160)
+
+ROUTE_DURATION = Histogram(
+    "promptbrew_request_duration_seconds",
+    "Time to serve an HTTP request, until its response body is complete.",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+STAGE_DURATION = Histogram(
+    "promptbrew_stage_duration_seconds",
+    "Time spent in each stage of serving a request.",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "promptbrew_llm_tokens",
+    "Tokens used by LLM calls, as reported by the model; cached_prompt tokens are "
+    "the part of prompt tokens that the provider served from its prompt cache.",
+    ["model", "task", "kind"],
+)
+LLM_FINISH_REASONS = Counter(
+    "promptbrew_llm_finish_reasons",
+    "Completed LLM calls by why the model stopped generating.",
+    ["model", "task", "finish_reason"],
+)
+CACHE_LOOKUPS = Counter(
+    "promptbrew_cache_lookups",
+    "LLM response cache lookups by whether they were hits.",
+    ["task", "result"],
+)
+LLM_RETRIES = Counter(
+    "promptbrew_llm_retries",
+    "LLM call attempts that failed and were retried.",
+    ["model"],
+)
+LLM_HEDGES = Counter(
+    "promptbrew_llm_hedges",
+    "LLM call attempts that were hedged with a second attempt.",
+    ["model"],
+)
+LLM_FALLBACKS = Counter(
+    "promptbrew_llm_fallbacks",
+    "LLM calls that gave up on a model and called a fallback model instead.",
+    ["model", "fallback"],
+)
+LLM_SHORT_CIRCUITS = Counter(
+    "promptbrew_llm_short_circuits",
+    "LLM calls that failed fast because the model's circuit was open.",
+    ["model"],
+)
+
+
+@contextlib.contextmanager
+def observe_stage(
+    stage: str,
+    attributes: dict[str, object] | None = None,
+    client: bool = False,
+) -> Iterator[Span]:
+    """Time a stage of serving a request, and trace it as a span if tracing is on.
+
+    Parameters
+    ----------
+    stage : str
+        Name of the stage, e.g. ``"assembly"`` or ``"llm_call"``.
+    attributes : dict of str to object, optional
+        Attributes to start the stage's span with.
+    client : bool, default False
+        Whether the stage is a call to another service, e.g. OpenAI.
+
+    Yields
+    ------
+    :class:`opentelemetry.trace.Span`
+        Span of the stage, as yielded by :meth:`~prompt_brew.tracing.Tracing.span`.
+
+    """
+    with tracing.span(stage, attributes, client=client) as span:
+        with STAGE_DURATION.labels(stage).time():
+            yield span
+
+
+class MetricsMiddleware:
+    """ASGI middleware that records the duration of each HTTP request by route.
+
+    Durations include streaming the response body, so that streamed responses are
+    timed until their last chunk.
+
+    Parameters
+    ----------
+    app : ASGI application
+        Application to time requests to.
+
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_and_observe(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_observe)
+        finally:
+            # the matched route's path template, e.g. not the path of a static file
+            route = getattr(scope.get("route"), "path", None) or "other"
+            ROUTE_DURATION.labels(scope["method"], route, str(status)).observe(
+                time.perf_counter() - start,
+            )
+
+
+def mark_process_dead() -> None:
+    """Stop reporting live metrics of this worker process, as it exits."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(os.getpid())
+
+
+async def metrics(request: Request) -> Response:
+    """Return all metrics in the Prometheus text format."""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,139 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""
+Precompression of the built web app into gzip and brotli variants.
+
+The variants are served to browsers that accept them (see :mod:`prompt_brew.static`).
+
+Run from the repository root after building the web app, as the ``Refresh project``
+CML job does::
+
+    python -m prompt_brew.precompress FeApp/dist
+
+Brotli variants are only written if the ``brotli`` package is installed.
+
+"""
+
+import argparse
+import gzip
+import logging
+import os
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:  # gzip variants only
+    brotli = None
+
+# not __name__, which is "__main__" when run with -m
+logger = logging.getLogger("prompt_brew.precompress")
+
+COMPRESSIBLE_SUFFIXES = frozenset(
+    {".css", ".html", ".ico", ".js", ".json", ".map", ".mjs", ".svg", ".txt", ".xml"}
+)
+MIN_SIZE = 1024  # bytes, below which compression saves too little to matter
+
+# suffix of each variant's file name, by content coding
+VARIANT_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    """Compress `data` as much as `encoding` allows."""
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def precompress(directory: str | Path) -> int:
+    """Write compressed variants of the compressible files in `directory`.
+
+    A variant is only kept if it is smaller than its file, and is given its file's
+    modification time, so that a variant left behind by an earlier build is not
+    served in place of a newer file.
+
+    Parameters
+    ----------
+    directory : str or :class:`~pathlib.Path`
+        Built web app, e.g. ``FeApp/dist``.
+
+    Returns
+    -------
+    int
+        Number of variants written.
+
+    """
+    encodings = ["gzip"] if brotli is None else ["br", "gzip"]
+    if brotli is None:
+        logger.warning("brotli is not installed, so only writing gzip variants")
+
+    written = 0
+    for path in sorted(Path(directory).rglob("*")):
+        if path.suffix not in COMPRESSIBLE_SUFFIXES or not path.is_file():
+            continue
+        stat_result = path.stat()
+        if stat_result.st_size < MIN_SIZE:
+            continue
+        data = path.read_bytes()
+        for encoding in encodings:
+            variant = path.with_name(path.name + VARIANT_SUFFIXES[encoding])
+            compressed = compress(data, encoding)
+            if len(compressed) >= len(data):
+                variant.unlink(missing_ok=True)
+                continue
+            variant.write_bytes(compressed)
+            os.utime(variant, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns))
+            written += 1
+    return written
+
+
+def main() -> None:
+    """Precompress a directory from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("directory", type=Path, help="built web app, e.g. FeApp/dist")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    written = precompress(args.directory)
+    logger.info("Wrote %d compressed variants in %s", written, args.directory)
+
+
+if __name__ == "__main__":
+    main()
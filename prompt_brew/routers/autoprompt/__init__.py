@@ -40,16 +40,39 @@
 
 """PromptBrew API routes."""
 
+import asyncio
+import itertools
 import logging
+from collections.abc import Iterable
+from typing import Literal, Optional
 
+import openai
 import requests
-from fastapi import APIRouter, HTTPException
-from jinja2 import Template
+from fastapi import APIRouter, File, Form, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
+from jinja2 import TemplateError
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
-from .dimensions import get_dimensions
-from .open_ai import call_open_ai, get_refined_prompt, run_prompt
+from ...config import settings
+from .batch import ROWS_PER_READ, open_upload, read_rows, run_prompt_batch
+from .cache import response_cache
+from .dimension_parser import InvalidDimensionsError
+from .dimensions import get_dimensions, stream_dimensions
+from .history import PromptRun, RunKind, history, parse_cursor
+from .history import task_hash as hash_task
+from .open_ai import (
+    get_refined_prompt,
+    get_refined_prompts,
+    run_prompt,
+    stream_prompt,
+    stream_refined_prompt,
+)
 from .prompts import PromptStyle
+from .rate_limit import rate_limiters
+from .resilience import CircuitOpenError, deadline
+from .rendering import prompt_renderer
+from .streaming import open_event_stream, open_ndjson_stream
 
 logger = logging.getLogger(__name__)
 
@@ -64,6 +87,8 @@ class AutopromptGenerateDimensionsRequest(BaseModel):
     """Request schema for /generate-dimensions."""
 
     prompt: str
+    allow_partial: bool = False
+    bypass_cache: bool = False
 
 
 class AutopromptGenerateDimensionsResponse(BaseModel):
@@ -77,13 +102,18 @@ class AutopromptGenerateDimensionsResponse(BaseModel):
     "/generate-dimensions",
     summary="Generate prompt dimensions",
 )
-def generate_dimensions(
+async def generate_dimensions(
     request: AutopromptGenerateDimensionsRequest,
 ) -> AutopromptGenerateDimensionsResponse:
     """Given a prompt, generate and return suggested nominal and ordinal dimensions."""
     logger.info("Running /generate-dimensions")
     try:
-        out = get_dimensions(request.prompt)
+        out = await get_dimensions(
+            request.prompt,
+            timeout=settings.dimensions_timeout,
+            allow_partial=request.allow_partial,
+            use_cache=not request.bypass_cache,
+        )
         return AutopromptGenerateDimensionsResponse(
             prompt=request.prompt,
             dimensions=out,
@@ -91,6 +121,30 @@ def generate_dimensions(
     except HTTPException as e:
         logger.exception("Encountered error")
         raise e
+    except asyncio.TimeoutError as e:
+        logger.exception("Timed out")
+        raise HTTPException(
+            status_code=504,
+            detail=str(e),
+        ) from e
+    except InvalidDimensionsError as e:
+        logger.exception("Encountered invalid dimensions from OpenAI")
+        raise HTTPException(
+            status_code=502,
+            detail=str(e),
+        ) from e
+    except CircuitOpenError as e:
+        logger.exception("OpenAI is unavailable")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+        ) from e
+    except openai.APIStatusError as e:
+        logger.exception("Encountered OpenAI error")
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.message,
+        ) from e
     except requests.exceptions.HTTPError as e:
         logger.exception("Encountered HTTP error")
         raise HTTPException(
@@ -105,6 +159,67 @@ def generate_dimensions(
         ) from e
 
 
+@router.post(
+    "/generate-dimensions/stream",
+    summary="Stream prompt dimensions",
+    response_class=StreamingResponse,
+)
+async def stream_dimensions_route(
+    request: AutopromptGenerateDimensionsRequest,
+) -> StreamingResponse:
+    """
+    Given a prompt, stream suggested nominal and ordinal dimensions as Server-Sent
+    Events, each as soon as it is generated.
+
+    Each event holds a JSON object with the dimension's ``kind`` (``"nominal"`` or
+    ``"ordinal"``), ``name``, and ``values``.
+
+    """
+    logger.info("Running /generate-dimensions/stream")
+    try:
+        return await open_event_stream(
+            stream_dimensions(
+                request.prompt,
+                allow_partial=request.allow_partial,
+                use_cache=not request.bypass_cache,
+            ),
+            timeout=settings.dimensions_timeout,
+        )
+    except HTTPException as e:
+        logger.exception("Encountered error")
+        raise e
+    except asyncio.TimeoutError as e:
+        logger.exception("Timed out")
+        raise HTTPException(
+            status_code=504,
+            detail=str(e),
+        ) from e
+    except InvalidDimensionsError as e:
+        logger.exception("Encountered invalid dimensions from OpenAI")
+        raise HTTPException(
+            status_code=502,
+            detail=str(e),
+        ) from e
+    except CircuitOpenError as e:
+        logger.exception("OpenAI is unavailable")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+        ) from e
+    except openai.APIStatusError as e:
+        logger.exception("Encountered OpenAI error")
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.message,
+        ) from e
+    except Exception as e:
+        logger.exception("Encountered internal error")
+        raise HTTPException(
+            status_code=500,
+            detail=str(e),
+        ) from e
+
+
 class AutopromptGenerateRefinedPromptRequest(BaseModel):
     """Request schema for /generate-refined-prompt."""
 
@@ -112,6 +227,7 @@ class AutopromptGenerateRefinedPromptRequest(BaseModel):
     dimensions: dict[str, str] = {}
     input_variables: dict[str, str] = {}
     prompt_style: PromptStyle = PromptStyle.SIMPLE
+    bypass_cache: bool = False
 
 
 class AutopromptGenerateRefinedPromptResponse(BaseModel):
@@ -126,7 +242,7 @@ class AutopromptGenerateRefinedPromptResponse(BaseModel):
     "/generate-refined-prompt",
     summary="Generate refined prompt",
 )
-def generate_refined_prompt(
+async def generate_refined_prompt(
     request: AutopromptGenerateRefinedPromptRequest,
 ) -> AutopromptGenerateRefinedPromptResponse:
     """
@@ -135,12 +251,14 @@ def generate_refined_prompt(
     """
     logger.info("Running /generate-refined-prompt")
     try:
-        out = get_refined_prompt(
-            prompt=request.prompt,
-            requirements=request.dimensions,
-            input_variables=request.input_variables,
-            prompt_style=request.prompt_style,
-        )
+        with deadline(settings.refine_timeout):
+            out = await get_refined_prompt(
+                prompt=request.prompt,
+                requirements=request.dimensions,
+                input_variables=request.input_variables,
+                prompt_style=request.prompt_style,
+                use_cache=not request.bypass_cache,
+            )
         return AutopromptGenerateRefinedPromptResponse(
             refined_prompt=out,
             input_variables=request.input_variables,
@@ -149,6 +267,24 @@ def generate_refined_prompt(
     except HTTPException as e:
         logger.exception("Encountered error")
         raise e
+    except asyncio.TimeoutError as e:
+        logger.exception("Timed out")
+        raise HTTPException(
+            status_code=504,
+            detail=str(e),
+        ) from e
+    except CircuitOpenError as e:
+        logger.exception("OpenAI is unavailable")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+        ) from e
+    except openai.APIStatusError as e:
+        logger.exception("Encountered OpenAI error")
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.message,
+        ) from e
     except requests.exceptions.HTTPError as e:
         logger.exception("Encountered HTTP error")
         raise HTTPException(
@@ -163,6 +299,137 @@ def generate_refined_prompt(
         ) from e
 
 
+@router.post(
+    "/generate-refined-prompt/stream",
+    summary="Stream refined prompt",
+    response_class=StreamingResponse,
+)
+async def stream_refined_prompt_route(
+    request: AutopromptGenerateRefinedPromptRequest,
+) -> StreamingResponse:
+    """
+    Given a prompt, dimensions, and variables, stream a refined prompt as Server-Sent
+    Events while it is generated.
+
+    """
+    logger.info("Running /generate-refined-prompt/stream")
+    try:
+        return await open_event_stream(
+            stream_refined_prompt(
+                prompt=request.prompt,
+                requirements=request.dimensions,
+                input_variables=request.input_variables,
+                prompt_style=request.prompt_style,
+            ),
+            timeout=settings.refine_timeout,
+        )
+    except HTTPException as e:
+        logger.exception("Encountered error")
+        raise e
+    except asyncio.TimeoutError as e:
+        logger.exception("Timed out")
+        raise HTTPException(
+            status_code=504,
+            detail=str(e),
+        ) from e
+    except CircuitOpenError as e:
+        logger.exception("OpenAI is unavailable")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+        ) from e
+    except openai.APIStatusError as e:
+        logger.exception("Encountered OpenAI error")
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.message,
+        ) from e
+    except Exception as e:
+        logger.exception("Encountered internal error")
+        raise HTTPException(
+            status_code=500,
+            detail=str(e),
+        ) from e
+
+
+class AutopromptGenerateRefinedPromptsRequest(BaseModel):
+    """Request schema for /generate-refined-prompts."""
+
+    prompt: str
+    dimensions: dict[str, str] = {}
+    input_variables: dict[str, str] = {}
+    prompt_styles: list[PromptStyle] | Literal["all"] = "all"
+    bypass_cache: bool = False
+
+
+class AutopromptRefinedPromptResult(BaseModel):
+    """Refined prompt, or error, for one style in /generate-refined-prompts."""
+
+    refined_prompt: Optional[str] = None
+    prompt_style: PromptStyle
+    elapsed_seconds: float
+    error: Optional[str] = None
+
+
+class AutopromptGenerateRefinedPromptsResponse(BaseModel):
+    """Response schema for /generate-refined-prompts."""
+
+    input_variables: dict[str, str] = {}
+    refined_prompts: list[AutopromptRefinedPromptResult]
+
+
+@router.post(
+    "/generate-refined-prompts",
+    summary="Generate refined prompts in several styles",
+)
+async def generate_refined_prompts(
+    request: AutopromptGenerateRefinedPromptsRequest,
+) -> AutopromptGenerateRefinedPromptsResponse:
+    """
+    Given a prompt, dimensions, and variables, generate and return a refined prompt
+    for each requested style.
+
+    Styles are refined concurrently. A style that fails is reported with its error
+    instead of failing the whole request.
+
+    """
+    logger.info("Running /generate-refined-prompts")
+    try:
+        with deadline(settings.refine_timeout):
+            out = await get_refined_prompts(
+                prompt=request.prompt,
+                requirements=request.dimensions,
+                input_variables=request.input_variables,
+                prompt_styles=(
+                    PromptStyle
+                    if request.prompt_styles == "all"
+                    else request.prompt_styles
+                ),
+                use_cache=not request.bypass_cache,
+            )
+        return AutopromptGenerateRefinedPromptsResponse(
+            input_variables=request.input_variables,
+            refined_prompts=[
+                AutopromptRefinedPromptResult(
+                    refined_prompt=result.refined_prompt,
+                    prompt_style=result.prompt_style,
+                    elapsed_seconds=result.elapsed_seconds,
+                    error=None if result.error is None else str(result.error),
+                )
+                for result in out
+            ],
+        )
+    except HTTPException as e:
+        logger.exception("Encountered error")
+        raise e
+    except Exception as e:
+        logger.exception("Encountered internal error")
+        raise HTTPException(
+            status_code=500,
+            detail=str(e),
+        ) from e
+
+
 class TestPromptRequest(BaseModel):
     """Request schema for /test-prompt."""
 
@@ -174,16 +441,48 @@ class TestPromptRequest(BaseModel):
     "/test-prompt",
     summary="Test a prompt against an LLM",
 )
-def test_prompt(request: TestPromptRequest) -> str:
+async def test_prompt(request: TestPromptRequest) -> str:
     """Given a prompt and variables, generate an LLM response."""
     logger.info("Running /test-prompt")
     try:
-        template = Template(request.prompt)
-        prompt = template.render(request.input_variables)
-        return run_prompt(prompt)
+        prompt = await run_in_threadpool(
+            prompt_renderer.render,
+            request.prompt,
+            request.input_variables,
+        )
+        with deadline(settings.test_prompt_timeout):
+            return await run_prompt(
+                prompt,
+                template=request.prompt,
+                input_variables=request.input_variables,
+            )
     except HTTPException as e:
         logger.exception("Encountered error")
         raise e
+    except TemplateError as e:
+        logger.exception("Encountered invalid prompt template")
+        raise HTTPException(
+            status_code=400,
+            detail=str(e),
+        ) from e
+    except asyncio.TimeoutError as e:
+        logger.exception("Timed out")
+        raise HTTPException(
+            status_code=504,
+            detail=str(e),
+        ) from e
+    except CircuitOpenError as e:
+        logger.exception("OpenAI is unavailable")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+        ) from e
+    except openai.APIStatusError as e:
+        logger.exception("Encountered OpenAI error")
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.message,
+        ) from e
     except requests.exceptions.HTTPError as e:
         logger.exception("Encountered HTTP error")
         raise HTTPException(
@@ -196,3 +495,328 @@ def test_prompt(request: TestPromptRequest) -> str:
             status_code=500,
             detail=str(e),
         ) from e
+
+
+@router.post(
+    "/test-prompt/stream",
+    summary="Stream a prompt's LLM response",
+    response_class=StreamingResponse,
+)
+async def stream_test_prompt(request: TestPromptRequest) -> StreamingResponse:
+    """Given a prompt and variables, stream an LLM response as Server-Sent Events."""
+    logger.info("Running /test-prompt/stream")
+    try:
+        prompt = await run_in_threadpool(
+            prompt_renderer.render,
+            request.prompt,
+            request.input_variables,
+        )
+        return await open_event_stream(
+            stream_prompt(
+                prompt,
+                template=request.prompt,
+                input_variables=request.input_variables,
+            ),
+            timeout=settings.test_prompt_timeout,
+        )
+    except HTTPException as e:
+        logger.exception("Encountered error")
+        raise e
+    except asyncio.TimeoutError as e:
+        logger.exception("Timed out")
+        raise HTTPException(
+            status_code=504,
+            detail=str(e),
+        ) from e
+    except TemplateError as e:
+        logger.exception("Encountered invalid prompt template")
+        raise HTTPException(
+            status_code=400,
+            detail=str(e),
+        ) from e
+    except CircuitOpenError as e:
+        logger.exception("OpenAI is unavailable")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+        ) from e
+    except openai.APIStatusError as e:
+        logger.exception("Encountered OpenAI error")
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.message,
+        ) from e
+    except Exception as e:
+        logger.exception("Encountered internal error")
+        raise HTTPException(
+            status_code=500,
+            detail=str(e),
+        ) from e
+
+
+class TestPromptBatchRequest(BaseModel):
+    """Request schema for /test-prompt/batch."""
+
+    prompt: str
+    rows: list[dict[str, str]]
+
+
+@router.post(
+    "/test-prompt/batch",
+    summary="Test a prompt against an LLM with many rows of variables",
+    response_class=StreamingResponse,
+)
+async def test_prompt_batch(request: TestPromptBatchRequest) -> StreamingResponse:
+    """
+    Given a prompt and rows of variables, stream an LLM response for each row as
+    newline-delimited JSON, in order of completion.
+
+    """
+    logger.info("Running /test-prompt/batch")
+    if len(request.rows) > settings.batch_max_rows:
+        raise HTTPException(
+            status_code=400,
+            detail=f"batch has more than {settings.batch_max_rows} rows",
+        )
+    return await _open_prompt_batch(request.prompt, request.rows)
+
+
+@router.post(
+    "/test-prompt/batch/upload",
+    summary="Test a prompt against an LLM with uploaded sample data",
+    response_class=StreamingResponse,
+)
+async def test_prompt_batch_upload(
+    prompt: str = Form(),
+    file: UploadFile = File(
+        description="CSV with a header row, or JSON Lines (.jsonl/.ndjson)",
+    ),
+) -> StreamingResponse:
+    """
+    Given a prompt and a file of sample data, stream an LLM response for each row as
+    newline-delimited JSON, in order of completion.
+
+    Rows are parsed as they are needed. A row that cannot be parsed is reported as
+    the last result, unless it is among the first rows, which fail the request.
+
+    """
+    logger.info("Running /test-prompt/batch/upload")
+    if file.size is not None and file.size > settings.batch_max_upload_bytes:
+        raise HTTPException(
+            status_code=413,
+            detail=f"sample data is larger than {settings.batch_max_upload_bytes}"
+            " bytes",
+        )
+    rows = await run_in_threadpool(
+        open_upload,
+        file.file,
+        file.filename,
+        settings.batch_max_rows,
+    )
+    # read the first rows up front, so that a file in the wrong format fails the
+    # request
+    first_rows, error = await run_in_threadpool(read_rows, rows, ROWS_PER_READ)
+    if error is not None:
+        logger.error("Encountered invalid sample data: %r", error)
+        raise HTTPException(
+            status_code=400,
+            detail=str(error),
+        ) from error
+    return await _open_prompt_batch(prompt, itertools.chain(first_rows, rows))
+
+
+async def _open_prompt_batch(
+    prompt: str,
+    rows: Iterable[dict[str, str]],
+) -> StreamingResponse:
+    """Validate a prompt batch, then start streaming its results."""
+    try:
+        # compile once up front, so an invalid template fails the request
+        await run_in_threadpool(prompt_renderer.get_template, prompt)
+    except TemplateError as e:
+        logger.exception("Encountered invalid prompt template")
+        raise HTTPException(
+            status_code=400,
+            detail=str(e),
+        ) from e
+    return open_ndjson_stream(
+        run_prompt_batch(
+            prompt,
+            rows,
+            concurrency=settings.batch_concurrency,
+        ),
+    )
+
+
+class CacheStatsResponse(BaseModel):
+    """Response schema for /cache-stats."""
+
+    backend: str
+    entries: int
+    hits: int
+    misses: int
+    hit_rate: float
+
+
+@router.get(
+    "/cache-stats",
+    summary="Report LLM response cache statistics",
+)
+async def cache_stats() -> CacheStatsResponse:
+    """
+    Return hit and miss counts of the LLM response cache since startup, or, with the
+    SQLite backend, since its database was created.
+
+    """
+    stats = await run_in_threadpool(lambda: response_cache.stats)
+    return CacheStatsResponse(
+        backend=settings.cache.cache_backend,
+        entries=await run_in_threadpool(len, response_cache),
+        hits=stats.hits,
+        misses=stats.misses,
+        hit_rate=stats.hit_rate,
+    )
+
+
+class RateLimitStats(BaseModel):
+    """Queueing statistics of one model's rate limit."""
+
+    model: str
+    queue_depth: int
+    admitted: int
+    delayed: int
+    mean_wait_seconds: float
+    max_wait_seconds: float
+
+
+class RateLimitStatsResponse(BaseModel):
+    """Response schema for /rate-limit-stats."""
+
+    models: list[RateLimitStats]
+
+
+@router.get(
+    "/rate-limit-stats",
+    summary="Report client-side OpenAI rate limit queueing statistics",
+)
+async def rate_limit_stats() -> RateLimitStatsResponse:
+    """Return queue depths and wait times of each rate-limited model since startup."""
+    return RateLimitStatsResponse(
+        models=[
+            RateLimitStats(
+                model=limiter.model,
+                queue_depth=limiter.queue_depth,
+                admitted=limiter.stats.admitted,
+                delayed=limiter.stats.delayed,
+                mean_wait_seconds=(
+                    limiter.stats.total_wait_seconds / limiter.stats.admitted
+                    if limiter.stats.admitted
+                    else 0.0
+                ),
+                max_wait_seconds=limiter.stats.max_wait_seconds,
+            )
+            for limiter in rate_limiters
+        ],
+    )
+
+
+class PromptRunResponse(BaseModel):
+    """A recorded refinement or test of a prompt."""
+
+    id: int
+    kind: RunKind
+    task_hash: str
+    prompt: str
+    prompt_style: Optional[PromptStyle]
+    requirements: dict[str, str]
+    input_variables: dict[str, str]
+    model: Optional[str]
+    response: Optional[str]
+    error: Optional[str]
+    cached: bool
+    prompt_tokens: int
+    completion_tokens: int
+    latency_seconds: float
+    created_at: float
+
+
+class HistoryResponse(BaseModel):
+    """Response schema for /history."""
+
+    runs: list[PromptRunResponse]
+    next_cursor: Optional[str]
+
+
+@router.get(
+    "/history",
+    summary="List recorded prompt refinements and tests",
+)
+async def list_history(
+    task: Optional[str] = Query(None, description="prompt to list runs of"),
+    task_hash: Optional[str] = Query(None, description="hash of the prompt instead"),
+    prompt_style: Optional[PromptStyle] = None,
+    kind: Optional[RunKind] = None,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = Query(None, description="next_cursor of the last page"),
+) -> HistoryResponse:
+    """
+    Return recorded refinements and tests of prompts, newest first, a page at a
+    time. Runs are recorded in the background, so the newest may take a moment to
+    appear.
+
+    """
+    try:
+        before = None if cursor is None else parse_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=400,
+            detail=f"invalid cursor: {cursor}",
+        ) from e
+    runs = await run_in_threadpool(
+        history.list_runs,
+        task_hash=hash_task(task) if task is not None else task_hash,
+        style=None if prompt_style is None else prompt_style.value,
+        kind=kind,
+        before=before,
+        limit=limit,
+    )
+    return HistoryResponse(
+        runs=[_to_prompt_run_response(run) for run in runs],
+        next_cursor=runs[-1].cursor if len(runs) == limit else None,
+    )
+
+
+@router.get(
+    "/history/{run_id}",
+    summary="Get a recorded prompt refinement or test",
+)
+async def get_history_run(run_id: int) -> PromptRunResponse:
+    """Return the recorded refinement or test of a prompt with ID `run_id`."""
+    run = await run_in_threadpool(history.get_run, run_id)
+    if run is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f"no run with ID {run_id}",
+        )
+    return _to_prompt_run_response(run)
+
+
+def _to_prompt_run_response(run: PromptRun) -> PromptRunResponse:
+    """Return the response schema of a recorded run."""
+    return PromptRunResponse(
+        id=run.id,
+        kind=run.kind,
+        task_hash=run.task_hash,
+        prompt=run.prompt,
+        prompt_style=run.style,
+        requirements=run.requirements,
+        input_variables=run.input_variables,
+        model=run.model,
+        response=run.response,
+        error=run.error,
+        cached=run.cached,
+        prompt_tokens=run.prompt_tokens,
+        completion_tokens=run.completion_tokens,
+        latency_seconds=run.latency_seconds,
+        created_at=run.created_at,
+    )
@@ -0,0 +1,235 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""Precompiled metaprompt templates.
+
+Metaprompt templates are large f-str templates whose bulk, such as the style
+examples in :const:`~prompt_brew.routers.autoprompt.prompts.GEN_EXAMPLES`, never
+changes between requests. Each template is split into literal text and fields once,
+and binding the fields that are fixed for a style or dimension count yields a
+template whose static prefix is byte-identical across requests, so that assembling
+a request only concatenates its few variable parts.
+
+The static prefix also leads each request, ahead of any user input, so that
+providers that cache prompt prefixes, such as OpenAI for prompts of 1024 tokens or
+more, can reuse their work on it across requests in the same style.
+
+"""
+
+import functools
+import logging
+import string
+
+from .prompts import (
+    GEN_EXAMPLES,
+    NOM_GEN_PROMPT,
+    ORD_GEN_PROMPT,
+    PROMPT_GEN_PROMPT_TEMPLATE,
+    PromptStyle,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class PromptTemplate:
+    """An f-str template, pre-split into literal text and named fields.
+
+    Parameters
+    ----------
+    template : f-str
+        Template with ``{name}`` fields, as accepted by :meth:`str.format`. Format
+        specs, conversions, and positional fields are not supported.
+
+    """
+
+    def __init__(self, template: str):
+        segments = []
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            if spec or conversion or field == "" or field and not field.isidentifier():
+                raise ValueError(f"unsupported field in prompt template: {field!r}")
+            segments.append(literal)
+            if field is not None:
+                segments.append(_Field(field))
+        self._segments = _merge_literals(segments)
+
+    @property
+    def fields(self) -> frozenset[str]:
+        """Names of the fields that remain to be filled in."""
+        return frozenset(
+            segment.name for segment in self._segments if isinstance(segment, _Field)
+        )
+
+    @property
+    def static_prefix(self) -> str:
+        """Literal text before the first field that remains to be filled in."""
+        first = self._segments[0] if self._segments else ""
+        return first if isinstance(first, str) else ""
+
+    def partial(self, **values: object) -> "PromptTemplate":
+        """Return a copy of this template with some fields filled in.
+
+        Parameters
+        ----------
+        **values
+            Values for fields to fill in, converted with :class:`str`.
+
+        Returns
+        -------
+        :class:`PromptTemplate`
+            Template with the remaining fields.
+
+        """
+        bound = PromptTemplate("")
+        bound._segments = _merge_literals(
+            (
+                str(values[segment.name])
+                if isinstance(segment, _Field) and segment.name in values
+                else segment
+            )
+            for segment in self._segments
+        )
+        return bound
+
+    def render(self, **values: object) -> str:
+        """Fill in every remaining field and return the resulting text.
+
+        Parameters
+        ----------
+        **values
+            Values for the remaining fields, converted with :class:`str`.
+
+        Returns
+        -------
+        str
+            Rendered template, as :meth:`str.format` would produce it.
+
+        Raises
+        ------
+        KeyError
+            If a remaining field has no value.
+
+        """
+        return "".join(
+            str(values[segment.name]) if isinstance(segment, _Field) else segment
+            for segment in self._segments
+        )
+
+
+class _Field:
+    """Named field of a :class:`PromptTemplate`."""
+
+    __slots__ = ("name",)
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+def _merge_literals(segments) -> list:
+    """Join adjacent literal segments, and drop empty ones."""
+    merged = []
+    for segment in segments:
+        if isinstance(segment, str) and merged and isinstance(merged[-1], str):
+            merged[-1] += segment
+        elif segment != "":
+            merged.append(segment)
+    return merged
+
+
+@functools.lru_cache(maxsize=32)
+def compile_template(template: str) -> PromptTemplate:
+    """Return a :class:`PromptTemplate` for `template`, compiling it only once."""
+    return PromptTemplate(template)
+
+
+@functools.lru_cache(maxsize=64)
+def refinement_template(
+    prompt_style: PromptStyle,
+    metaprompt_template: str = PROMPT_GEN_PROMPT_TEMPLATE,
+) -> PromptTemplate:
+    """Return `metaprompt_template` with the examples for `prompt_style` filled in.
+
+    The result's remaining fields are ``prompt``, ``requirements``, and
+    ``input_variables``.
+
+    """
+    template = compile_template(metaprompt_template).partial(
+        examples=GEN_EXAMPLES[prompt_style],
+    )
+    if GEN_EXAMPLES[prompt_style] not in template.static_prefix:
+        logger.warning(
+            "Metaprompt template has fields before its examples for style %s, so "
+            "its examples will not be in the prompt prefix that providers cache",
+            prompt_style.value,
+        )
+    return template
+
+
+@functools.lru_cache(maxsize=64)
+def nominal_dimensions_template(
+    cat_num: int,
+    val_num: int,
+    metaprompt: str = NOM_GEN_PROMPT,
+) -> PromptTemplate:
+    """Return `metaprompt` with the nominal dimension counts filled in.
+
+    The result's remaining field is ``prompt``.
+
+    """
+    return compile_template(metaprompt).partial(cat_num=cat_num, val_num=val_num)
+
+
+@functools.lru_cache(maxsize=64)
+def ordinal_dimensions_template(
+    cat_num: int,
+    metaprompt: str = ORD_GEN_PROMPT,
+) -> PromptTemplate:
+    """Return `metaprompt` with the ordinal dimension count filled in.
+
+    The result's remaining field is ``prompt``.
+
+    """
+    return compile_template(metaprompt).partial(cat_num=cat_num)
+
+
+# compile the default templates at import, rather than on the first request
+for _prompt_style in PromptStyle:
+    refinement_template(_prompt_style)
+nominal_dimensions_template(5, 5)
+ordinal_dimensions_template(5)
@@ -0,0 +1,275 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""Helpers for testing a prompt against many rows of input variables."""
+
+import asyncio
+import collections
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+import time
+from collections.abc import AsyncGenerator, Iterable, Iterator
+from typing import BinaryIO, NamedTuple
+
+from starlette.concurrency import run_in_threadpool
+
+from .open_ai import run_prompt
+from .rate_limit import Priority
+from .rendering import prompt_renderer
+
+logger = logging.getLogger(__name__)
+
+ROWS_PER_READ = 100  # rows of sample data to parse at a time
+
+
+class BatchRowResult(NamedTuple):
+    """Outcome of testing a prompt with one row of input variables."""
+
+    row: int
+    output: str | None
+    error: str | None
+    elapsed_seconds: float
+
+
+def parse_rows(
+    file: BinaryIO,
+    filename: str | None,
+    max_rows: int,
+) -> Iterator[dict[str, str]]:
+    """Parse sample data into rows of input variables as it is read.
+
+    Parameters
+    ----------
+    file : binary file
+        UTF-8 encoded CSV, whose header names the variables, or JSON Lines, with
+        one object of variable names to values per line.
+    filename : str, optional
+        Name of the file. Files ending in ``.jsonl`` or ``.ndjson`` are parsed as
+        JSON Lines, and anything else as CSV.
+    max_rows : int greater than 0
+        Largest number of rows to accept.
+
+    Yields
+    ------
+    dict of str to str
+        Input variables for the next row.
+
+    Raises
+    ------
+    ValueError
+        Once a row cannot be parsed, or once there are more than `max_rows` rows.
+
+    """
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    try:
+        if filename and filename.lower().endswith((".jsonl", ".ndjson")):
+            rows = _parse_json_lines(text)
+        else:
+            rows = (
+                {k: v or "" for k, v in row.items() if k is not None}
+                for row in csv.DictReader(text)
+            )
+        for row_number, row in enumerate(rows, start=1):
+            if row_number > max_rows:
+                raise ValueError(f"sample data has more than {max_rows} rows")
+            yield row
+    finally:
+        # leave `file` open for its owner to close
+        text.detach()
+
+
+def open_upload(
+    file: BinaryIO,
+    filename: str | None,
+    max_rows: int,
+) -> Iterator[dict[str, str]]:
+    """Parse an uploaded file into rows of input variables as they are needed.
+
+    The server closes uploaded files once the route returns, so the rows are read
+    from a duplicate of the file, which is closed once every row has been read.
+    See :func:`parse_rows` for parameters.
+
+    """
+    duplicate = os.fdopen(os.dup(file.fileno()), "rb")
+    duplicate.seek(0)
+    return _parse_and_close(duplicate, filename, max_rows)
+
+
+def _parse_and_close(
+    file: BinaryIO,
+    filename: str | None,
+    max_rows: int,
+) -> Iterator[dict[str, str]]:
+    """Yield the rows parsed from `file`, then close it."""
+    with file:
+        yield from parse_rows(file, filename, max_rows)
+
+
+def _parse_json_lines(lines: Iterable[str]) -> Iterator[dict[str, str]]:
+    """Yield the input variables of each nonblank line of JSON Lines."""
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"line {line_number} is not valid JSON: {e}") from e
+        if not isinstance(row, dict):
+            raise ValueError(f"line {line_number} is not a JSON object")
+        yield {str(k): "" if v is None else str(v) for k, v in row.items()}
+
+
+def read_rows(
+    rows: Iterator[dict[str, str]],
+    count: int,
+) -> tuple[list[dict[str, str]], Exception | None]:
+    """Return up to `count` more of `rows`, and the error that stopped them, if any."""
+    batch = []
+    try:
+        batch.extend(itertools.islice(rows, count))
+    except Exception as e:
+        return batch, e
+    return batch, None
+
+
+async def run_prompt_batch(
+    prompt: str,
+    rows: Iterable[dict[str, str]],
+    concurrency: int,
+) -> AsyncGenerator[BatchRowResult, None]:
+    """Render and run a prompt template for each row, yielding results as they finish.
+
+    At most `concurrency` rows are rendered or awaiting the LLM at a time. A row
+    that fails does not stop the others; its error is reported in its result.
+    Closing the generator cancels the rows still in progress.
+
+    Rows are read :data:`ROWS_PER_READ` at a time in a worker thread, as they are
+    needed, so that `rows` may parse a large file lazily. If reading a row raises,
+    e.g. :class:`ValueError` from :func:`parse_rows`, its error is reported in its
+    result and no further rows are read.
+
+    Parameters
+    ----------
+    prompt : str
+        Jinja template of the prompt to test.
+    rows : iterable of dict of str to str
+        Input variables for each row.
+    concurrency : int greater than 0
+        Largest number of rows to process at once.
+
+    Yields
+    ------
+    :class:`BatchRowResult`
+        Result of each row, in order of completion.
+
+    """
+    unread_rows = iter(rows)
+    pending_rows: collections.deque[tuple[int, dict[str, str] | Exception]] = (
+        collections.deque()
+    )
+    read_lock = asyncio.Lock()
+    rows_read = 0
+    all_read = False
+    results: asyncio.Queue[BatchRowResult | None] = asyncio.Queue()
+
+    async def next_row() -> tuple[int, dict[str, str] | Exception] | None:
+        nonlocal rows_read, all_read
+        async with read_lock:
+            if not pending_rows and not all_read:
+                batch, error = await run_in_threadpool(
+                    read_rows,
+                    unread_rows,
+                    ROWS_PER_READ,
+                )
+                pending_rows.extend(enumerate(batch, start=rows_read))
+                rows_read += len(batch)
+                if error is not None:
+                    pending_rows.append((rows_read, error))
+                all_read = error is not None or len(batch) < ROWS_PER_READ
+            return pending_rows.popleft() if pending_rows else None
+
+    async def work() -> None:
+        while (pending_row := await next_row()) is not None:
+            index, input_variables = pending_row
+            if isinstance(input_variables, Exception):
+                logger.warning("Stopped reading prompt batch: %r", input_variables)
+                await results.put(
+                    BatchRowResult(index, None, str(input_variables), 0.0),
+                )
+                continue
+            start = time.perf_counter()
+            try:
+                rendered = await run_in_threadpool(
+                    prompt_renderer.render,
+                    prompt,
+                    input_variables,
+                )
+                output = await run_prompt(
+                    rendered,
+                    template=prompt,
+                    input_variables=input_variables,
+                    priority=Priority.BATCH,
+                )
+            except Exception as e:
+                logger.warning("Row %d of prompt batch failed: %r", index, e)
+                result = BatchRowResult(index, None, str(e), 0.0)
+            else:
+                result = BatchRowResult(index, output, None, 0.0)
+            await results.put(
+                result._replace(elapsed_seconds=time.perf_counter() - start),
+            )
+        await results.put(None)
+
+    workers = [asyncio.ensure_future(work()) for _ in range(concurrency)]
+    try:
+        finished_workers = 0
+        while finished_workers < len(workers):
+            result = await results.get()
+            if result is None:
+                finished_workers += 1
+            else:
+                yield result
+    finally:
+        for worker in workers:
+            worker.cancel()
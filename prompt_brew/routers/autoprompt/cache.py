@@ -0,0 +1,422 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""Response cache for LLM calls whose inputs repeat, e.g. suggested tasks."""
+
+import abc
+import collections
+import dataclasses
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from starlette.concurrency import run_in_threadpool
+
+from ...config import CacheSettings, settings
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class CacheStats:
+    """Hit and miss counts of a :class:`ResponseCache`."""
+
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups that were hits, or 0 if there were none."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class ResponseCache(abc.ABC):
+    """Cache of LLM responses that expire after a time-to-live.
+
+    Parameters
+    ----------
+    max_entries : int greater than 0
+        Number of responses to keep; the least recently used are evicted first.
+    ttl : float greater than 0
+        Seconds after which a cached response expires.
+
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._stats = CacheStats()
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> CacheStats:
+        """Hit and miss counts since startup."""
+        return self._stats
+
+    def get(self, key: str) -> str | None:
+        """Return the cached response for `key`, or ``None`` if there isn't one.
+
+        Parameters
+        ----------
+        key : str
+            Cache key, from :func:`cache_key`.
+
+        Returns
+        -------
+        str or None
+            Cached response.
+
+        """
+        with self._lock:
+            value = self._get(key, time.time())
+            self._count(hit=value is not None)
+        return value
+
+    async def aget(self, key: str) -> str | None:
+        """Like :meth:`get`, without blocking the event loop on disk I/O."""
+        return self.get(key)
+
+    def set(self, key: str, value: str) -> None:
+        """Cache `value` as the response for `key`.
+
+        Parameters
+        ----------
+        key : str
+            Cache key, from :func:`cache_key`.
+        value : str
+            Response to cache.
+
+        """
+        with self._lock:
+            self._set(key, value, time.time())
+
+    async def aset(self, key: str, value: str) -> None:
+        """Like :meth:`set`, without blocking the event loop on disk I/O."""
+        self.set(key, value)
+
+    def close(self) -> None:
+        """Release any resources held by the cache."""
+
+    def _count(self, hit: bool) -> None:
+        """Count a lookup as a hit or a miss."""
+        if hit:
+            self._stats.hits += 1
+        else:
+            self._stats.misses += 1
+
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        """Return the number of cached responses, including expired ones."""
+
+    @abc.abstractmethod
+    def _get(self, key: str, now: float) -> str | None:
+        """Return the unexpired response for `key` as of `now`, if any."""
+
+    @abc.abstractmethod
+    def _set(self, key: str, value: str, now: float) -> None:
+        """Store `value` for `key` as of `now`, and evict to stay within limits."""
+
+
+class NullCache(ResponseCache):
+    """Cache that never stores anything, for when caching is disabled."""
+
+    def __len__(self) -> int:
+        return 0
+
+    def _get(self, key: str, now: float) -> str | None:
+        return None
+
+    def _set(self, key: str, value: str, now: float) -> None:
+        pass
+
+
+class MemoryCache(ResponseCache):
+    """In-process LRU cache of LLM responses.
+
+    Parameters
+    ----------
+    max_entries : int greater than 0
+        Number of responses to keep; the least recently used are evicted first.
+    ttl : float greater than 0
+        Seconds after which a cached response expires.
+
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        super().__init__(max_entries, ttl)
+        self._entries: collections.OrderedDict[str, tuple[str, float]] = (
+            collections.OrderedDict()
+        )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _get(self, key: str, now: float) -> str | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, created_at = entry
+        if created_at + self.ttl < now:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set(self, key: str, value: str, now: float) -> None:
+        self._entries[key] = (value, now)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class SQLiteCache(ResponseCache):
+    """On-disk LRU cache of LLM responses, which survives restarts.
+
+    The database can be shared by several worker processes, which then also share
+    responses and hit and miss counts. So that lookups do not contend for the
+    database's write lock, hit and miss counts and the recency of hits are kept in
+    memory and written at most every `flush_interval` seconds, or with the next
+    response cached.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database file, created if it does not exist.
+    max_entries : int greater than 0
+        Number of responses to keep; the least recently used are evicted first.
+    ttl : float greater than 0
+        Seconds after which a cached response expires.
+    flush_interval : float greater than 0, default 5
+        Seconds that lookups may go uncounted in the database.
+
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_entries: int,
+        ttl: float,
+        flush_interval: float = 5.0,
+    ):
+        super().__init__(max_entries, ttl)
+        self.path = path
+        self.flush_interval = flush_interval
+        # lookups not yet written to the database
+        self._pending = CacheStats()
+        self._accessed: dict[str, float] = {}
+        self._flushed_at = time.monotonic()
+        # access is serialized by self._lock
+        self._connection = sqlite3.connect(
+            path,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._connection.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            PRAGMA busy_timeout = 5000;
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS responses_created_at
+                ON responses (created_at);
+            CREATE INDEX IF NOT EXISTS responses_accessed_at
+                ON responses (accessed_at);
+            CREATE TABLE IF NOT EXISTS stats (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0);
+            """)
+
+    @property
+    def stats(self) -> CacheStats:
+        """Hit and miss counts since the database was created, across processes."""
+        with self._lock:
+            counts = dict(
+                self._connection.execute("SELECT name, value FROM stats").fetchall()
+            )
+            return CacheStats(
+                hits=counts["hits"] + self._pending.hits,
+                misses=counts["misses"] + self._pending.misses,
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM responses"
+            ).fetchone()[0]
+
+    async def aget(self, key: str) -> str | None:
+        return await run_in_threadpool(self.get, key)
+
+    async def aset(self, key: str, value: str) -> None:
+        await run_in_threadpool(self.set, key, value)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._pending.hits or self._pending.misses or self._accessed:
+                with self._connection:
+                    self._connection.execute("BEGIN")
+                    self._flush()
+            self._connection.close()
+
+    def _count(self, hit: bool) -> None:
+        if hit:
+            self._pending.hits += 1
+        else:
+            self._pending.misses += 1
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            with self._connection:
+                self._connection.execute("BEGIN")
+                self._flush()
+
+    def _get(self, key: str, now: float) -> str | None:
+        row = self._connection.execute(
+            "SELECT value FROM responses WHERE key = ? AND created_at >= ?",
+            (key, now - self.ttl),
+        ).fetchone()
+        if row is None:
+            return None
+        self._accessed[key] = now
+        return row[0]
+
+    def _set(self, key: str, value: str, now: float) -> None:
+        with self._connection:
+            self._connection.execute("BEGIN")
+            self._flush()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._connection.execute(
+                "DELETE FROM responses WHERE created_at < ?",
+                (now - self.ttl,),
+            )
+            self._connection.execute(
+                "DELETE FROM responses WHERE key IN ("
+                " SELECT key FROM responses ORDER BY accessed_at DESC"
+                " LIMIT -1 OFFSET ?"
+                ")",
+                (self.max_entries,),
+            )
+
+    def _flush(self) -> None:
+        """Write pending lookups within the transaction in progress."""
+        self._connection.executemany(
+            "UPDATE stats SET value = value + ? WHERE name = ?",
+            [(self._pending.hits, "hits"), (self._pending.misses, "misses")],
+        )
+        self._connection.executemany(
+            "UPDATE responses SET accessed_at = MAX(accessed_at, ?) WHERE key = ?",
+            [(accessed_at, key) for key, accessed_at in self._accessed.items()],
+        )
+        self._pending = CacheStats()
+        self._accessed.clear()
+        self._flushed_at = time.monotonic()
+
+
+def cache_key(
+    model: str,
+    messages: list[dict[str, str]],
+    temperature: float,
+    tag: str,
+) -> str:
+    """Return a cache key identifying an LLM call.
+
+    Parameters
+    ----------
+    model : str
+        Name of the model called.
+    messages : list of dict of str to str
+        Conversation messages sent to the model.
+    temperature : float between 0 and 2
+        Sampling temperature of the call.
+    tag : str
+        What the call is for, e.g. its prompt style, so that calls for different
+        purposes never share responses.
+
+    Returns
+    -------
+    str
+        Hex digest of the call's inputs.
+
+    """
+    payload = json.dumps(
+        [model, messages, temperature, tag],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def build_cache(cache_settings: CacheSettings) -> ResponseCache:
+    """Instantiate and return the response cache selected by `cache_settings`.
+
+    Parameters
+    ----------
+    cache_settings : :class:`~prompt_brew.config.CacheSettings`
+        Cache backend and limits.
+
+    Returns
+    -------
+    :class:`ResponseCache`
+        Response cache.
+
+    """
+    if cache_settings.cache_backend == "memory":
+        return MemoryCache(cache_settings.cache_max_entries, cache_settings.cache_ttl)
+    if cache_settings.cache_backend == "sqlite":
+        return SQLiteCache(
+            cache_settings.cache_path,
+            cache_settings.cache_max_entries,
+            cache_settings.cache_ttl,
+        )
+    return NullCache(cache_settings.cache_max_entries, cache_settings.cache_ttl)
+
+
+response_cache = build_cache(settings.cache)
@@ -0,0 +1,222 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""Process-wide registry of pooled OpenAI clients."""
+
+import asyncio
+import contextlib
+import logging
+import time
+from collections.abc import AsyncIterator
+
+import httpx
+from openai import (
+    AsyncAzureOpenAI,
+    AsyncOpenAI,
+    AzureOpenAI,
+    DefaultAsyncHttpxClient,
+    DefaultHttpxClient,
+    OpenAI,
+)
+
+from ...config import OpenAISettings, settings
+
+logger = logging.getLogger(__name__)
+
+
+class OpenAIClients:
+    """Lazily built OpenAI clients that share one connection pool each.
+
+    Building a client per call opens a fresh connection pool, so every completion
+    pays for a new TCP and TLS handshake. This registry instead builds one sync and
+    one async client, on first use or at application startup via :meth:`aopen`, and
+    hands them out to every caller until :meth:`aclose` is called at shutdown.
+
+    The clients do not retry failed calls themselves; callers retry through
+    :mod:`~prompt_brew.routers.autoprompt.resilience` instead.
+
+    Parameters
+    ----------
+    openai_settings : :class:`~prompt_brew.config.OpenAISettings`
+        Credentials, pool limits, and timeouts to build clients with.
+
+    """
+
+    def __init__(self, openai_settings: OpenAISettings):
+        self.openai_settings = openai_settings
+        self._client: AzureOpenAI | OpenAI | None = None
+        self._async_client: AsyncAzureOpenAI | AsyncOpenAI | None = None
+        self._async_client_loop: asyncio.AbstractEventLoop | None = None
+        self._in_flight = 0
+
+    def get_client(self) -> AzureOpenAI | OpenAI:
+        """Return the shared sync OpenAI client, building it if needed.
+
+        Returns
+        -------
+        :class:`openai.AzureOpenAI` or :class:`openai.OpenAI`
+            OpenAI client.
+
+        """
+        if self._client is None:
+            self._client = self._build_client()
+        return self._client
+
+    def get_async_client(self) -> AsyncAzureOpenAI | AsyncOpenAI:
+        """Return the shared async OpenAI client, building it if needed.
+
+        An async client's connections belong to the event loop that opened them, so
+        a new client is built if the running loop has changed, e.g. across calls to
+        :func:`asyncio.run` in scripts.
+
+        Returns
+        -------
+        :class:`openai.AsyncAzureOpenAI` or :class:`openai.AsyncOpenAI`
+            Async OpenAI client.
+
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_client is None or self._async_client_loop is not loop:
+            self._async_client = self._build_async_client()
+            self._async_client_loop = loop
+        return self._async_client
+
+    async def aopen(self) -> None:
+        """Build both clients ahead of the first call."""
+        self.get_client()
+        self.get_async_client()
+
+    @contextlib.asynccontextmanager
+    async def track(self) -> AsyncIterator[None]:
+        """Mark an async call as in flight, so that :meth:`aclose` waits for it."""
+        self._in_flight += 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+
+    async def aclose(self) -> None:
+        """Drain in-flight async calls, then close both clients' connection pools.
+
+        Calls still running after
+        :attr:`~prompt_brew.config.OpenAISettings.openai_shutdown_grace_period`
+        seconds are cut off when their connections are closed.
+
+        """
+        if self._in_flight:
+            logger.info("Waiting for %d in-flight OpenAI calls", self._in_flight)
+            deadline = (
+                time.monotonic() + self.openai_settings.openai_shutdown_grace_period
+            )
+            while self._in_flight and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+            if self._in_flight:
+                logger.warning(
+                    "Closing OpenAI clients with %d calls still in flight",
+                    self._in_flight,
+                )
+
+        if self._async_client is not None:
+            await self._async_client.close()
+            self._async_client = None
+            self._async_client_loop = None
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    def _client_options(self) -> dict:
+        """Return HTTP options shared by the sync and async clients."""
+        return {
+            "limits": httpx.Limits(
+                max_connections=self.openai_settings.openai_max_connections,
+                max_keepalive_connections=self.openai_settings.openai_max_keepalive_connections,
+                keepalive_expiry=self.openai_settings.openai_keepalive_expiry,
+            ),
+            "timeout": httpx.Timeout(
+                self.openai_settings.openai_timeout,
+                connect=self.openai_settings.openai_connect_timeout,
+            ),
+            "http2": self.openai_settings.openai_http2,
+        }
+
+    def _build_client(self) -> AzureOpenAI | OpenAI:
+        """Instantiate and return an OpenAI client.
+
+        Returns
+        -------
+        :class:`openai.AzureOpenAI` or :class:`openai.OpenAI`
+            OpenAI client.
+
+        """
+        http_client = DefaultHttpxClient(**self._client_options())
+        if self.openai_settings.azure_openai_endpoint:
+            client = AzureOpenAI(
+                api_key=self.openai_settings.openai_api_key,
+                api_version=self.openai_settings.api_version,
+                http_client=http_client,
+                max_retries=0,
+            )
+        else:
+            client = OpenAI(http_client=http_client, max_retries=0)
+        return client
+
+    def _build_async_client(self) -> AsyncAzureOpenAI | AsyncOpenAI:
+        """Instantiate and return an async OpenAI client.
+
+        Returns
+        -------
+        :class:`openai.AsyncAzureOpenAI` or :class:`openai.AsyncOpenAI`
+            Async OpenAI client.
+
+        """
+        http_client = DefaultAsyncHttpxClient(**self._client_options())
+        if self.openai_settings.azure_openai_endpoint:
+            client = AsyncAzureOpenAI(
+                api_key=self.openai_settings.openai_api_key,
+                api_version=self.openai_settings.api_version,
+                http_client=http_client,
+                max_retries=0,
+            )
+        else:
+            client = AsyncOpenAI(http_client=http_client, max_retries=0)
+        return client
+
+
+clients = OpenAIClients(settings.openai)
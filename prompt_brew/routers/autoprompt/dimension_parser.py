@@ -0,0 +1,275 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""Tolerant, incremental parsing of LLM responses that list prompt dimensions."""
+
+import json
+import logging
+import re
+
+from ...metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+_OPENING_QUOTES = {'"': '"', "“": "”"}  # models sometimes copy curly quotes
+_TRAILING_COMMA = re.compile(r",\s*\]")
+
+# parser states
+_START = "start"  # before the object
+_KEY = "key"  # before a dimension name, or the end of the object
+_IN_KEY = "in_key"
+_COLON = "colon"
+_VALUE = "value"  # before a dimension's list of values
+_IN_VALUE = "in_value"
+_END = "end"
+
+
+class InvalidDimensionsError(ValueError):
+    """Raised when an LLM response does not list the requested dimensions."""
+
+
+class DimensionsParser:
+    """Extract dimensions from a JSON object of lists as the response arrives.
+
+    Each dimension is returned by :meth:`feed` as soon as its list of values is
+    complete, so that it can be shown before the rest of the response is generated.
+    Prose or code fences around the object, curly quotes around names, trailing
+    commas, and an object nested under a single wrapper key are all tolerated, as
+    are a response cut off after some dimensions and dimensions with too few or too
+    many values.
+
+    Parameters
+    ----------
+    cat_num : int greater than 0
+        Number of dimensions to expect. Any further dimensions are ignored.
+    val_num : int greater than 0
+        Number of values to expect for each dimension. Any further values are
+        dropped, and dimensions without any values are ignored.
+
+    """
+
+    def __init__(self, cat_num: int, val_num: int):
+        self.cat_num = cat_num
+        self.val_num = val_num
+        self.dimensions: dict[str, list[str]] = {}
+        self._state = _START
+        self._token: list[str] = []
+        self._key = ""
+        self._closing_quote = '"'
+        self._in_string = False
+        self._escaped = False
+        self._depth = 0
+
+    @property
+    def has_surplus(self) -> bool:
+        """Whether the response has begun to list more than `cat_num` dimensions."""
+        return len(self.dimensions) >= self.cat_num and self._state in (
+            _IN_KEY,
+            _COLON,
+            _VALUE,
+            _IN_VALUE,
+        )
+
+    def feed(self, text: str) -> list[tuple[str, list[str]]]:
+        """Parse the next piece of the response.
+
+        Parameters
+        ----------
+        text : str
+            Next piece of the response.
+
+        Returns
+        -------
+        list of tuple of str and list of str
+            Names and values of the dimensions completed by `text`.
+
+        """
+        completed = []
+        for char in text:
+            dimension = self._feed_char(char)
+            if dimension is not None and len(self.dimensions) < self.cat_num:
+                dimension = self._fit(*dimension)
+                if dimension is not None:
+                    self.dimensions[dimension[0]] = dimension[1]
+                    completed.append(dimension)
+        return completed
+
+    def close(self) -> dict[str, list[str]]:
+        """Finish parsing once the whole response has been fed.
+
+        Returns
+        -------
+        dict of str to list of str
+            Mapping of dimension names to possible values.
+
+        Raises
+        ------
+        InvalidDimensionsError
+            If the response did not list any dimensions.
+
+        """
+        if not self.dimensions:
+            raise InvalidDimensionsError(
+                f"expected {self.cat_num} dimensions but the model listed none"
+            )
+        if len(self.dimensions) < self.cat_num:
+            logger.warning(
+                "Expected %d dimensions but the model listed %d",
+                self.cat_num,
+                len(self.dimensions),
+            )
+        return self.dimensions
+
+    def _feed_char(self, char: str) -> tuple[str, list[str]] | None:
+        """Advance the parser by one character, returning a completed dimension."""
+        if self._state == _START:
+            if char == "{":
+                self._state = _KEY
+        elif self._state == _KEY:
+            if char in _OPENING_QUOTES:
+                self._closing_quote = _OPENING_QUOTES[char]
+                self._token = []
+                self._state = _IN_KEY
+            elif char == "}":
+                self._state = _END
+        elif self._state == _IN_KEY:
+            if self._escaped:
+                self._escaped = False
+            elif char == "\\":
+                self._escaped = True
+            elif char == self._closing_quote:
+                self._key = _decode_string("".join(self._token))
+                self._state = _COLON
+                return None
+            self._token.append(char)
+        elif self._state == _COLON:
+            if char == ":":
+                self._state = _VALUE
+        elif self._state == _VALUE:
+            if char == "[":
+                self._token = [char]
+                self._depth = 1
+                self._state = _IN_VALUE
+            elif char == "{":
+                # e.g. {"dimensions": {...}}; parse the inner object instead
+                self._state = _KEY
+        elif self._state == _IN_VALUE:
+            self._token.append(char)
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == self._closing_quote:
+                    self._in_string = False
+            elif char in _OPENING_QUOTES:
+                self._closing_quote = _OPENING_QUOTES[char]
+                self._in_string = True
+            elif char == "[":
+                self._depth += 1
+            elif char == "]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._state = _KEY
+                    return self._key, _decode_values("".join(self._token))
+        return None
+
+    def _fit(self, name: str, values: list[str]) -> tuple[str, list[str]] | None:
+        """Return dimension `name` with at most `val_num` values, or None if empty."""
+        values = [value for value in values if value.strip()]
+        if len(values) != self.val_num:
+            logger.debug(
+                'Expected %d values for dimension "%s" but the model listed %d',
+                self.val_num,
+                name,
+                len(values),
+            )
+        if not name.strip() or not values:
+            return None
+        return name, values[: self.val_num]
+
+
+def parse_dimensions(response: str, cat_num: int, val_num: int) -> dict[str, list[str]]:
+    """Extract and validate the dimensions listed in a complete LLM response.
+
+    Parameters
+    ----------
+    response : str
+        LLM response containing a JSON object of dimension names to lists of values.
+    cat_num : int greater than 0
+        Number of dimensions to expect. Any further dimensions are dropped.
+    val_num : int greater than 0
+        Number of values to expect for each dimension. Any further values are
+        dropped.
+
+    Returns
+    -------
+    dict of str to list of str
+        Mapping of dimension names to possible values.
+
+    Raises
+    ------
+    InvalidDimensionsError
+        If `response` does not list any dimensions.
+
+    """
+    with observe_stage("json_parse"):
+        parser = DimensionsParser(cat_num, val_num)
+        parser.feed(response)
+        return parser.close()
+
+
+def _decode_string(raw: str) -> str:
+    """Decode the contents of a JSON string literal, leniently."""
+    try:
+        return json.loads(f'"{raw}"')
+    except ValueError:
+        return raw
+
+
+def _decode_values(raw: str) -> list[str]:
+    """Decode a JSON list of values, leniently, as strings."""
+    try:
+        values = json.loads(_TRAILING_COMMA.sub("]", raw))
+    except ValueError:
+        # e.g. single or curly quotes; split on commas instead
+        values = [value.strip(" \t\r\n\"'“”") for value in raw[1:-1].split(",")]
+        values = [value for value in values if value]
+    return [value if isinstance(value, str) else json.dumps(value) for value in values]
@@ -40,23 +40,49 @@
 
 """Helper functions for generating prompt dimensions."""
 
-import json
+import asyncio
+import contextlib
 import logging
+from collections.abc import AsyncGenerator
+from typing import Literal, NamedTuple
 
-from .open_ai import call_open_ai
+from ...config import settings
+from ...metrics import CACHE_LOOKUPS, observe_stage
+from ...tracing import Span, tracing
+from .assembly import nominal_dimensions_template, ordinal_dimensions_template
+from .dimension_parser import (
+    DimensionsParser,
+    InvalidDimensionsError,
+    parse_dimensions,
+)
+from .open_ai import acall_open_ai, astream_open_ai
 from .prompts import NOM_GEN_PROMPT, ORD_GEN_PROMPT
+from .similarity import similar_dimensions
+from .snapshot import snapshot
 
 logger = logging.getLogger(__name__)
 
+ORDINAL_VALUE_COUNT = 5  # least, less, neutral, more, most
+GENERATION_ATTEMPTS = 2  # per kind of dimension, if a response lists none
 
-def get_dimensions(
+
+async def get_dimensions(
     prompt: str,
     cat_num_nominal: int = 5,
     val_num_nominal: int = 5,
     cat_num_ordinal: int = 5,
+    timeout: float | None = None,
+    allow_partial: bool = False,
+    use_cache: bool = True,
 ) -> dict[str, list[str]]:
     """Given a prompt, generate and return suggested nominal and ordinal dimensions.
 
+    Nominal and ordinal dimensions are generated concurrently. By default, if either
+    generation fails or times out, the other is cancelled and the error is raised.
+    Dimensions generated for a near-duplicate of `prompt`, e.g. one that differs
+    only in case or filler words, are returned from the similarity cache instead,
+    and those of suggested tasks from the warm-up snapshot, if any.
+
     Parameters
     ----------
     prompt : str
@@ -67,31 +93,225 @@ def get_dimensions(
         Number of possible values to generate for each nominal dimension.
     cat_num_ordinal : int greater than 0, default 5
         Number of ordinal dimensions to generate.
+    timeout : float greater than 0, optional
+        Seconds to wait for both generations to finish.
+    allow_partial : bool, default False
+        Whether to return the dimensions of whichever generation succeeded, instead
+        of raising, when the other one fails or times out.
+    use_cache : bool, default True
+        Whether to return cached dimensions for an identical or near-duplicate
+        earlier request, if any, instead of generating new ones.
 
     Returns
     -------
     dict of str to list of str
         Mapping of dimension names to possible values.
 
+    Raises
+    ------
+    asyncio.TimeoutError
+        If a generation did not finish within `timeout` seconds (and, with
+        `allow_partial`, neither did the other).
+
     """
-    nominal_dimensions = get_nomimal_dimensions(
-        prompt=prompt,
-        cat_num=cat_num_nominal,
-        val_num=val_num_nominal,
-    )
-    ordinal_dimensions = get_ordinal_dimensions(
-        prompt=prompt,
-        cat_num=cat_num_ordinal,
-    )
-    return dict(nominal_dimensions | ordinal_dimensions)
+    with tracing.span(
+        "get_dimensions",
+        {
+            "prompt_brew.cat_num_nominal": cat_num_nominal,
+            "prompt_brew.val_num_nominal": val_num_nominal,
+            "prompt_brew.cat_num_ordinal": cat_num_ordinal,
+            "prompt_brew.use_cache": use_cache,
+        },
+    ) as span:
+        scope = (cat_num_nominal, val_num_nominal, cat_num_ordinal)
+        if use_cache:
+            similar = _get_cached_dimensions(prompt, scope, span)
+            if similar is not None:
+                nominal, ordinal = similar
+                return nominal | ordinal
+        tasks = {
+            "nominal": asyncio.ensure_future(
+                get_nomimal_dimensions(
+                    prompt=prompt,
+                    cat_num=cat_num_nominal,
+                    val_num=val_num_nominal,
+                    use_cache=use_cache,
+                ),
+            ),
+            "ordinal": asyncio.ensure_future(
+                get_ordinal_dimensions(
+                    prompt=prompt,
+                    cat_num=cat_num_ordinal,
+                    use_cache=use_cache,
+                ),
+            ),
+        }
+        try:
+            done, pending = await asyncio.wait(
+                tasks.values(),
+                timeout=timeout,
+                return_when=(
+                    asyncio.ALL_COMPLETED if allow_partial else asyncio.FIRST_EXCEPTION
+                ),
+            )
+        finally:
+            # also reached if this coroutine is cancelled, e.g. on client disconnect
+            for task in tasks.values():
+                task.cancel()
+
+        dimensions = {}
+        errors = {}
+        for kind, task in tasks.items():
+            if task not in done:
+                errors[kind] = asyncio.TimeoutError(
+                    f"{kind} dimensions were not generated within {timeout} seconds",
+                )
+            elif task.exception() is not None:
+                errors[kind] = task.exception()
+            else:
+                dimensions |= task.result()
+        if not errors:
+            _set_similar_dimensions(
+                prompt,
+                scope,
+                tasks["nominal"].result(),
+                tasks["ordinal"].result(),
+            )
+
+        if errors and not allow_partial:
+            # prefer a generation's own error over the timeout of its cancelled sibling
+            raise min(
+                errors.values(),
+                key=lambda error: isinstance(error, asyncio.TimeoutError),
+            )
+        if len(errors) == len(tasks):
+            raise next(iter(errors.values()))
+        for kind, error in errors.items():
+            logger.warning("Omitting %s dimensions: %r", kind, error)
+        return dimensions
+
+
+class Dimension(NamedTuple):
+    """One dimension streamed by :func:`stream_dimensions`."""
+
+    kind: Literal["nominal", "ordinal"]
+    name: str
+    values: list[str]
 
 
-def get_nomimal_dimensions(
+async def stream_dimensions(
+    prompt: str,
+    cat_num_nominal: int = 5,
+    val_num_nominal: int = 5,
+    cat_num_ordinal: int = 5,
+    allow_partial: bool = False,
+    use_cache: bool = True,
+) -> AsyncGenerator[Dimension, None]:
+    """Like :func:`get_dimensions`, but yield each dimension as soon as it is generated.
+
+    Nominal and ordinal dimensions are generated concurrently, and their dimensions
+    are interleaved in the order they complete. Dimensions from the similarity cache
+    or warm-up snapshot are yielded all at once.
+
+    Parameters
+    ----------
+    prompt : str
+        User prompt to generate dimensions for.
+    cat_num_nominal : int greater than 0, default 5
+        Number of nominal dimensions to generate.
+    val_num_nominal : int greater than 0, default 5
+        Number of possible values to generate for each nominal dimension.
+    cat_num_ordinal : int greater than 0, default 5
+        Number of ordinal dimensions to generate.
+    allow_partial : bool, default False
+        Whether to keep yielding the dimensions of one generation, instead of
+        raising, when the other one fails.
+    use_cache : bool, default True
+        Whether to yield cached dimensions for an identical or near-duplicate
+        earlier request, if any, instead of generating new ones.
+
+    Yields
+    ------
+    :class:`Dimension`
+        Next dimension.
+
+    """
+    scope = (cat_num_nominal, val_num_nominal, cat_num_ordinal)
+    if use_cache:
+        with tracing.span("get_cached_dimensions") as span:
+            similar = _get_cached_dimensions(prompt, scope, span)
+        if similar is not None:
+            for kind, dimensions in zip(("nominal", "ordinal"), similar):
+                for name, values in dimensions.items():
+                    yield Dimension(kind, name, values)
+            return
+
+    streams = {
+        "nominal": stream_nominal_dimensions(
+            prompt=prompt,
+            cat_num=cat_num_nominal,
+            val_num=val_num_nominal,
+            use_cache=use_cache,
+        ),
+        "ordinal": stream_ordinal_dimensions(
+            prompt=prompt,
+            cat_num=cat_num_ordinal,
+            use_cache=use_cache,
+        ),
+    }
+    # each generation puts its dimensions, then None or the error it raised
+    results: asyncio.Queue[Dimension | Exception | None] = asyncio.Queue()
+    generated: dict[str, dict[str, list[str]]] = {kind: {} for kind in streams}
+
+    async def generate(
+        kind: str,
+        dimensions: AsyncGenerator[tuple[str, list[str]], None],
+    ) -> None:
+        try:
+            async with contextlib.aclosing(dimensions):
+                async for name, values in dimensions:
+                    generated[kind][name] = values
+                    await results.put(Dimension(kind, name, values))
+        except Exception as e:
+            await results.put(e)
+        else:
+            await results.put(None)
+
+    tasks = [
+        asyncio.ensure_future(generate(kind, dimensions))
+        for kind, dimensions in streams.items()
+    ]
+    errors = []
+    try:
+        for _ in tasks:
+            while (result := await results.get()) is not None:
+                if isinstance(result, Exception):
+                    if not allow_partial or errors:
+                        raise result
+                    logger.warning("Omitting dimensions: %r", result)
+                    errors.append(result)
+                    break
+                yield result
+        if not errors:
+            _set_similar_dimensions(
+                prompt,
+                scope,
+                generated["nominal"],
+                generated["ordinal"],
+            )
+    finally:
+        # also reached if the client disconnects mid-stream
+        for task in tasks:
+            task.cancel()
+
+
+async def get_nomimal_dimensions(
     prompt: str,
     cat_num: int = 5,
     val_num: int = 5,
     temperature: float = 0.3,
     metaprompt: str = NOM_GEN_PROMPT,
+    use_cache: bool = True,
 ) -> dict[str, list[str]]:
     """Given a prompt, generate and return suggested nominal dimensions.
 
@@ -110,46 +330,45 @@ def get_nomimal_dimensions(
         How much randomness the LLM should employ when generating its response.
     metaprompt : f-str, default :const:`~prompt_brew.routers.autoprompt.prompts.NOM_GEN_PROMPT`
         Prompt to send to the LLM to generate dimensions for `prompt`.
+    use_cache : bool, default True
+        Whether to return cached dimensions for an identical earlier request, if
+        any, instead of generating new ones.
 
     Returns
     -------
     dict of str to list of str
         Mapping of dimension names to possible values.
 
+    Raises
+    ------
+    :class:`~prompt_brew.routers.autoprompt.dimension_parser.InvalidDimensionsError`
+        If the LLM did not list any dimensions, even when asked again.
+
     """
     logger.debug("Getting nominal dimensions")
-    nom_messages = [
-        {
-            "role": "user",
-            "content": metaprompt.format(
-                cat_num=cat_num,
-                val_num=val_num,
-                prompt=prompt,
-            ),
-        },
-    ]
+    nom_messages = _nominal_messages(prompt, cat_num, val_num, metaprompt)
 
     logger.debug(
         "Calling OpenAI for nominal dimensions: %s",
         nom_messages,
     )
-    nom_response = call_open_ai(
-        messages=nom_messages,
-        temperature=temperature,
-    )
-    logger.debug(
-        "OpenAI response with nominal dimensions: %s",
-        nom_response,
+    nominal_dimensions = await _get_dimensions(
+        nom_messages,
+        temperature,
+        cat_num,
+        val_num,
+        "dimensions:nominal",
+        use_cache,
     )
-    nominal_dimensions = json.loads(nom_response)
     return nominal_dimensions
 
 
-def get_ordinal_dimensions(
+async def get_ordinal_dimensions(
     prompt: str,
     cat_num: int = 5,
     temperature: float = 0.3,
     metaprompt: str = ORD_GEN_PROMPT,
+    use_cache: bool = True,
 ) -> dict[str, list[str]]:
     """Given a prompt, generate and return suggested ordinal dimensions.
 
@@ -167,34 +386,262 @@ def get_ordinal_dimensions(
         How much randomness the LLM should employ when generating its response.
     metaprompt : f-str, default :const:`~prompt_brew.routers.autoprompt.prompts.ORD_GEN_PROMPT`
         Prompt to send to the LLM to generate dimensions for `prompt`.
+    use_cache : bool, default True
+        Whether to return cached dimensions for an identical earlier request, if
+        any, instead of generating new ones.
 
     Returns
     -------
     dict of str to list of str
         Mapping of dimension names to possible values (e.g. ``"Most"``, ``"Least"``).
 
+    Raises
+    ------
+    :class:`~prompt_brew.routers.autoprompt.dimension_parser.InvalidDimensionsError`
+        If the LLM did not list any dimensions, even when asked again.
+
     """
     logger.debug("Getting ordinal dimensions")
-    ord_messages = [
-        {
-            "role": "user",
-            "content": metaprompt.format(
-                cat_num=cat_num,
-                prompt=prompt,
-            ),
-        },
-    ]
+    ord_messages = _ordinal_messages(prompt, cat_num, metaprompt)
     logger.debug(
         "Calling OpenAI for ordinal dimensions: %s",
         ord_messages,
     )
-    ord_response = call_open_ai(
-        messages=ord_messages,
-        temperature=temperature,
-    )
-    logger.debug(
-        "OpenAI response with ordinal dimensions: %s",
-        ord_response,
+    ordinal_dimensions = await _get_dimensions(
+        ord_messages,
+        temperature,
+        cat_num,
+        ORDINAL_VALUE_COUNT,
+        "dimensions:ordinal",
+        use_cache,
     )
-    ordinal_dimensions = json.loads(ord_response)
     return ordinal_dimensions
+
+
+async def stream_nominal_dimensions(
+    prompt: str,
+    cat_num: int = 5,
+    val_num: int = 5,
+    temperature: float = 0.3,
+    metaprompt: str = NOM_GEN_PROMPT,
+    use_cache: bool = True,
+) -> AsyncGenerator[tuple[str, list[str]], None]:
+    """Like :func:`get_nomimal_dimensions`, but yield each dimension once generated.
+
+    See :func:`get_nomimal_dimensions` for parameters.
+
+    Yields
+    ------
+    tuple of str and list of str
+        Name and possible values of the next dimension.
+
+    Raises
+    ------
+    :class:`~prompt_brew.routers.autoprompt.dimension_parser.InvalidDimensionsError`
+        If the LLM did not list any dimensions, even when asked again.
+
+    """
+    logger.debug("Streaming nominal dimensions")
+    async for dimension in _stream_dimensions(
+        _nominal_messages(prompt, cat_num, val_num, metaprompt),
+        temperature,
+        cat_num,
+        val_num,
+        "dimensions:nominal",
+        use_cache,
+    ):
+        yield dimension
+
+
+async def stream_ordinal_dimensions(
+    prompt: str,
+    cat_num: int = 5,
+    temperature: float = 0.3,
+    metaprompt: str = ORD_GEN_PROMPT,
+    use_cache: bool = True,
+) -> AsyncGenerator[tuple[str, list[str]], None]:
+    """Like :func:`get_ordinal_dimensions`, but yield each dimension once generated.
+
+    See :func:`get_ordinal_dimensions` for parameters.
+
+    Yields
+    ------
+    tuple of str and list of str
+        Name and possible values of the next dimension.
+
+    Raises
+    ------
+    :class:`~prompt_brew.routers.autoprompt.dimension_parser.InvalidDimensionsError`
+        If the LLM did not list any dimensions, even when asked again.
+
+    """
+    logger.debug("Streaming ordinal dimensions")
+    async for dimension in _stream_dimensions(
+        _ordinal_messages(prompt, cat_num, metaprompt),
+        temperature,
+        cat_num,
+        ORDINAL_VALUE_COUNT,
+        "dimensions:ordinal",
+        use_cache,
+    ):
+        yield dimension
+
+
+async def _get_dimensions(
+    messages: list[dict[str, str]],
+    temperature: float,
+    cat_num: int,
+    val_num: int,
+    task: str,
+    use_cache: bool,
+) -> dict[str, list[str]]:
+    """Return the dimensions in the LLM response, asking again if it lists none."""
+    for attempt in range(1, GENERATION_ATTEMPTS + 1):
+        try:
+            response = await acall_open_ai(
+                messages=messages,
+                temperature=temperature,
+                cache_tag=task if use_cache else None,
+                task=task,
+                validate=lambda response: parse_dimensions(response, cat_num, val_num),
+                response_format=_response_format(),
+            )
+        except InvalidDimensionsError as e:
+            if attempt == GENERATION_ATTEMPTS:
+                raise
+            logger.warning("Asking again for %s: %s", task, e)
+        else:
+            logger.debug("OpenAI response with %s: %s", task, response)
+            return parse_dimensions(response, cat_num, val_num)
+
+
+async def _stream_dimensions(
+    messages: list[dict[str, str]],
+    temperature: float,
+    cat_num: int,
+    val_num: int,
+    task: str,
+    use_cache: bool,
+) -> AsyncGenerator[tuple[str, list[str]], None]:
+    """Yield each dimension completed in the streamed LLM response.
+
+    If the response lists no dimensions, the LLM is asked again.
+
+    """
+    for attempt in range(1, GENERATION_ATTEMPTS + 1):
+        parser = DimensionsParser(cat_num, val_num)
+        try:
+            async with contextlib.aclosing(
+                astream_open_ai(
+                    messages=messages,
+                    temperature=temperature,
+                    cache_tag=task if use_cache else None,
+                    task=task,
+                    validate=lambda response: parse_dimensions(
+                        response,
+                        cat_num,
+                        val_num,
+                    ),
+                    response_format=_response_format(),
+                ),
+            ) as chunks:
+                async for chunk in chunks:
+                    for dimension in parser.feed(chunk):
+                        yield dimension
+                    if parser.has_surplus:
+                        # stop paying for dimensions beyond those requested
+                        break
+            parser.close()
+            return
+        except InvalidDimensionsError as e:
+            # dimensions already yielded cannot be taken back
+            if parser.dimensions or attempt == GENERATION_ATTEMPTS:
+                raise
+            logger.warning("Asking again for %s: %s", task, e)
+
+
+def _get_cached_dimensions(
+    prompt: str,
+    scope: tuple[int, int, int],
+    span: Span,
+) -> tuple[dict[str, list[str]], dict[str, list[str]]] | None:
+    """Return copies of the nominal and ordinal dimensions of a similar prompt, if any.
+
+    Dimensions are looked up in the warm-up snapshot, then the similarity cache.
+    `scope` is the number of nominal dimensions, their values, and ordinal
+    dimensions requested, which the cached dimensions must match.
+
+    """
+    if len(snapshot):
+        dimensions = snapshot.dimensions(prompt, scope)
+        hit = dimensions is not None
+        CACHE_LOOKUPS.labels("dimensions:snapshot", "hit" if hit else "miss").inc()
+        span.set_attribute("prompt_brew.snapshot_hit", hit)
+        if hit:
+            return dimensions
+    if similar_dimensions is None:
+        return None
+    match = similar_dimensions.get(prompt, scope)
+    CACHE_LOOKUPS.labels("dimensions:similar", "miss" if match is None else "hit").inc()
+    span.set_attribute("prompt_brew.similar_cache_hit", match is not None)
+    if match is None:
+        return None
+    logger.debug("Using dimensions of a prompt %.2f similar", match.similarity)
+    span.set_attribute("prompt_brew.similarity", match.similarity)
+    return tuple(
+        {name: list(values) for name, values in dimensions.items()}
+        for dimensions in match.value
+    )
+
+
+def _set_similar_dimensions(
+    prompt: str,
+    scope: tuple[int, int, int],
+    nominal: dict[str, list[str]],
+    ordinal: dict[str, list[str]],
+) -> None:
+    """Cache the dimensions generated for `prompt`, for similar prompts to reuse."""
+    if similar_dimensions is not None:
+        similar_dimensions.set(
+            prompt,
+            (
+                {name: list(values) for name, values in nominal.items()},
+                {name: list(values) for name, values in ordinal.items()},
+            ),
+            scope,
+        )
+
+
+def _nominal_messages(
+    prompt: str,
+    cat_num: int,
+    val_num: int,
+    metaprompt: str,
+) -> list[dict[str, str]]:
+    """Return the chat messages that ask an LLM for nominal dimensions of `prompt`."""
+    with observe_stage("assembly"):
+        content = nominal_dimensions_template(
+            cat_num,
+            val_num,
+            metaprompt,
+        ).render(prompt=prompt)
+    return [{"role": "user", "content": content}]
+
+
+def _ordinal_messages(
+    prompt: str,
+    cat_num: int,
+    metaprompt: str,
+) -> list[dict[str, str]]:
+    """Return the chat messages that ask an LLM for ordinal dimensions of `prompt`."""
+    with observe_stage("assembly"):
+        content = ordinal_dimensions_template(
+            cat_num,
+            metaprompt,
+        ).render(prompt=prompt)
+    return [{"role": "user", "content": content}]
+
+
+def _response_format() -> dict[str, str] | None:
+    """Return the response format to request dimensions in, if any."""
+    return {"type": "json_object"} if settings.dimensions_json_mode else None
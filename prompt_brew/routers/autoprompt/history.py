@@ -0,0 +1,489 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""History of prompt refinements and tests, kept in SQLite.
+
+Each refinement and test of a prompt is recorded with its inputs, prompt style,
+model, response, latency, and token usage, so that users can compare prompts
+without paying to generate them again. Runs are written by a background thread in
+batches, so recording one never waits on the database; a run becomes visible to
+:meth:`HistoryStore.list_runs` within the flush interval. The oldest runs are
+deleted once there are more than the configured maximum, or once they expire.
+
+"""
+
+import dataclasses
+import hashlib
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Literal, Optional
+
+from openai.types import CompletionUsage
+
+from ...config import HistorySettings, settings
+
+logger = logging.getLogger(__name__)
+
+RunKind = Literal["refine", "test"]
+
+
+def task_hash(prompt: str) -> str:
+    """Return the hash that identifies runs of `prompt` in the history."""
+    return hashlib.sha256(prompt.encode()).hexdigest()[:16]
+
+
+@dataclasses.dataclass
+class PromptRun:
+    """One refinement or test of a prompt, as recorded in a :class:`HistoryStore`."""
+
+    kind: RunKind
+    prompt: str
+    style: Optional[str] = None  # prompt style, for refinements
+    requirements: dict[str, str] = dataclasses.field(default_factory=dict)
+    input_variables: dict[str, str] = dataclasses.field(default_factory=dict)
+    model: Optional[str] = None
+    response: Optional[str] = None
+    error: Optional[str] = None
+    cached: bool = False
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    latency_seconds: float = 0.0
+    created_at: float = dataclasses.field(default_factory=time.time)
+    id: Optional[int] = None  # assigned once written
+
+    @property
+    def task_hash(self) -> str:
+        """Hash of the prompt, to look up other runs of it by."""
+        return task_hash(self.prompt)
+
+    @property
+    def cursor(self) -> str:
+        """Position just after this run, to list the runs that precede it."""
+        return f"{self.created_at!r}:{self.id}"
+
+    def note_completion(self, model: str, usage: CompletionUsage | None) -> None:
+        """Note the model that responded and the tokens it used."""
+        self.model = model
+        if usage is not None:
+            self.prompt_tokens += usage.prompt_tokens
+            self.completion_tokens += usage.completion_tokens
+
+    def note_cached(self, model: str) -> None:
+        """Note that the response was cached from an earlier call to `model`."""
+        self.model = model
+        self.cached = True
+
+
+def parse_cursor(cursor: str) -> tuple[float, int]:
+    """Return the creation time and ID of the run that `cursor` points after.
+
+    Raises
+    ------
+    ValueError
+        If `cursor` was not made by :attr:`PromptRun.cursor`.
+
+    """
+    created_at, _, run_id = cursor.partition(":")
+    return float(created_at), int(run_id)
+
+
+_COLUMNS = (
+    "kind",
+    "task_hash",
+    "prompt",
+    "style",
+    "requirements",
+    "input_variables",
+    "model",
+    "response",
+    "error",
+    "cached",
+    "prompt_tokens",
+    "completion_tokens",
+    "latency_seconds",
+    "created_at",
+)
+
+
+class HistoryStore:
+    """Store of :class:`PromptRun` records in a SQLite database.
+
+    The database is opened by :meth:`open`, in WAL mode, so that worker processes
+    can write to it and read from it at once. Until then, nothing is recorded.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path of the SQLite database file, created if it does not exist. If not
+        given, nothing is recorded.
+    batch_size : int greater than 0, default 100
+        Largest number of runs to write in one transaction.
+    flush_interval : float greater than 0, default 1.0
+        Seconds that a run may wait for others to be written along with it.
+    max_runs : int greater than 0, optional
+        Largest number of runs to keep, beyond which the oldest are deleted.
+    ttl : float greater than 0, optional
+        Seconds to keep each run for.
+
+    """
+
+    def __init__(
+        self,
+        path: str | None,
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        max_runs: int | None = None,
+        ttl: float | None = None,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_runs = max_runs
+        self.ttl = ttl
+        self._queue: queue.SimpleQueue[PromptRun | None] = queue.SimpleQueue()
+        self._writer: threading.Thread | None = None
+        self._closed = False
+        self._lock = threading.Lock()
+        # reads are serialized by self._lock; the writer thread has its own
+        # connection
+        self._connection: sqlite3.Connection | None = None
+
+    def open(self) -> None:
+        """Open the database, creating it if it does not exist, if a path is given."""
+        if self.path is None or self._connection is not None:
+            return
+        self._connection = self._connect()
+        self._connection.executescript("""
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                task_hash TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                style TEXT,
+                requirements TEXT NOT NULL,
+                input_variables TEXT NOT NULL,
+                model TEXT,
+                response TEXT,
+                error TEXT,
+                cached INTEGER NOT NULL,
+                prompt_tokens INTEGER NOT NULL,
+                completion_tokens INTEGER NOT NULL,
+                latency_seconds REAL NOT NULL,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS runs_created_at ON runs (created_at);
+            CREATE INDEX IF NOT EXISTS runs_task_hash ON runs (task_hash, created_at);
+            CREATE INDEX IF NOT EXISTS runs_style ON runs (style, created_at);
+            """)
+
+    @property
+    def enabled(self) -> bool:
+        """Whether runs are recorded."""
+        return self._connection is not None
+
+    def record(self, run: PromptRun) -> None:
+        """Queue `run` to be written, without waiting for it to be.
+
+        Parameters
+        ----------
+        run : :class:`PromptRun`
+            Completed run, which must not be changed afterward.
+
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._closed:
+                logger.warning(
+                    "Not recording %s run after history was closed", run.kind
+                )
+                return
+            if self._writer is None:
+                self._writer = threading.Thread(
+                    target=self._write_batches,
+                    name="prompt-history-writer",
+                    daemon=True,
+                )
+                self._writer.start()
+        self._queue.put(run)
+
+    @contextmanager
+    def recording(self, run: PromptRun) -> Iterator[PromptRun]:
+        """Time the enclosed block as `run`, and record it when the block exits.
+
+        The block should set the run's response, and pass the run to the LLM calls
+        it makes to note their model and token usage. An exception raised in the
+        block is recorded as the run's error and propagates.
+
+        Parameters
+        ----------
+        run : :class:`PromptRun`
+            Run to record.
+
+        Yields
+        ------
+        :class:`PromptRun`
+            `run`.
+
+        """
+        start = time.perf_counter()
+        try:
+            yield run
+        except Exception as e:
+            run.error = str(e) or type(e).__name__
+            raise
+        except BaseException:
+            # e.g. the client disconnected from a stream
+            run.error = "cancelled"
+            raise
+        finally:
+            run.latency_seconds = time.perf_counter() - start
+            self.record(run)
+
+    def list_runs(
+        self,
+        task_hash: str | None = None,
+        style: str | None = None,
+        kind: RunKind | None = None,
+        before: tuple[float, int] | None = None,
+        limit: int = 50,
+    ) -> list[PromptRun]:
+        """Return recorded runs, newest first.
+
+        Parameters
+        ----------
+        task_hash : str, optional
+            Only return runs of the prompt with this hash, from :func:`task_hash`.
+        style : str, optional
+            Only return runs with this prompt style.
+        kind : {"refine", "test"}, optional
+            Only return runs of this kind.
+        before : tuple of (float, int), optional
+            Only return runs older than the one at this position, from
+            :func:`parse_cursor`, to list the next page.
+        limit : int greater than 0, default 50
+            Largest number of runs to return.
+
+        Returns
+        -------
+        list of :class:`PromptRun`
+            Matching runs.
+
+        """
+        if not self.enabled:
+            return []
+        conditions = []
+        parameters: list[object] = []
+        for column, value in (
+            ("task_hash", task_hash),
+            ("style", style),
+            ("kind", kind),
+        ):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                parameters.append(value)
+        if before is not None:
+            conditions.append("(created_at, id) < (?, ?)")
+            parameters.extend(before)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT id, {', '.join(_COLUMNS)} FROM runs {where}"
+                " ORDER BY created_at DESC, id DESC LIMIT ?",
+                (*parameters, limit),
+            ).fetchall()
+        return [_to_run(row) for row in rows]
+
+    def get_run(self, run_id: int) -> PromptRun | None:
+        """Return the run with ID `run_id`, or ``None`` if there isn't one."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT id, {', '.join(_COLUMNS)} FROM runs WHERE id = ?",
+                (run_id,),
+            ).fetchone()
+        return None if row is None else _to_run(row)
+
+    def close(self) -> None:
+        """Write any queued runs, then release the database."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._closed = True
+            writer = self._writer
+        if writer is not None:
+            self._queue.put(None)
+            writer.join()
+        with self._lock:
+            self._connection.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection to the database."""
+        connection = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        connection.executescript("""
+            PRAGMA synchronous = NORMAL;
+            PRAGMA busy_timeout = 5000;
+            """)
+        return connection
+
+    def _write_batches(self) -> None:
+        """Write queued runs in batches until :meth:`close` is called."""
+        connection = self._connect()
+        try:
+            stopping = False
+            while not stopping:
+                batch = [self._queue.get()]
+                flush_at = time.monotonic() + self.flush_interval
+                while len(batch) < self.batch_size and batch[-1] is not None:
+                    try:
+                        batch.append(
+                            self._queue.get(
+                                timeout=max(flush_at - time.monotonic(), 0)
+                            ),
+                        )
+                    except queue.Empty:
+                        break
+                stopping = batch[-1] is None
+                runs = [run for run in batch if run is not None]
+                if runs:
+                    self._write(connection, runs)
+        finally:
+            connection.close()
+
+    def _write(self, connection: sqlite3.Connection, runs: list[PromptRun]) -> None:
+        """Write `runs` in one transaction, logging rather than raising any error."""
+        try:
+            with connection:
+                connection.execute("BEGIN")
+                connection.executemany(
+                    f"INSERT INTO runs ({', '.join(_COLUMNS)})"
+                    f" VALUES ({', '.join('?' * len(_COLUMNS))})",
+                    [_to_row(run) for run in runs],
+                )
+                self._prune(connection)
+        except sqlite3.Error:
+            logger.exception("Failed to record %d prompt runs", len(runs))
+
+    def _prune(self, connection: sqlite3.Connection) -> None:
+        """Delete runs that have expired or are beyond the most to keep."""
+        if self.ttl is not None:
+            connection.execute(
+                "DELETE FROM runs WHERE created_at < ?",
+                (time.time() - self.ttl,),
+            )
+        if self.max_runs is not None:
+            connection.execute(
+                "DELETE FROM runs WHERE (created_at, id) <= ("
+                "SELECT created_at, id FROM runs"
+                " ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET ?)",
+                (self.max_runs,),
+            )
+
+
+def _to_row(run: PromptRun) -> tuple:
+    """Return the column values of `run`, in the order of ``_COLUMNS``."""
+    return (
+        run.kind,
+        run.task_hash,
+        run.prompt,
+        run.style,
+        json.dumps(run.requirements),
+        json.dumps(run.input_variables),
+        run.model,
+        run.response,
+        run.error,
+        run.cached,
+        run.prompt_tokens,
+        run.completion_tokens,
+        run.latency_seconds,
+        run.created_at,
+    )
+
+
+def _to_run(row: tuple) -> PromptRun:
+    """Return the run read from `row`, its ID followed by the ``_COLUMNS``."""
+    values = dict(zip(("id", *_COLUMNS), row))
+    del values["task_hash"]  # derived from the prompt
+    values["requirements"] = json.loads(values["requirements"])
+    values["input_variables"] = json.loads(values["input_variables"])
+    values["cached"] = bool(values["cached"])
+    return PromptRun(**values)
+
+
+def build_history(history_settings: HistorySettings) -> HistoryStore:
+    """Instantiate and return the history store configured by `history_settings`.
+
+    Parameters
+    ----------
+    history_settings : :class:`~prompt_brew.config.HistorySettings`
+        History backend, write batching, and retention.
+
+    Returns
+    -------
+    :class:`HistoryStore`
+        History store, which records nothing if the backend is ``"none"``.
+
+    """
+    return HistoryStore(
+        (
+            history_settings.history_path
+            if history_settings.history_backend == "sqlite"
+            else None
+        ),
+        batch_size=history_settings.history_batch_size,
+        flush_interval=history_settings.history_flush_interval,
+        max_runs=history_settings.history_max_runs,
+        ttl=history_settings.history_ttl,
+    )
+
+
+history = build_history(settings.history)
@@ -40,23 +40,48 @@
 
 """Helper functions for calling OpenAI."""
 
+import asyncio
 import logging
+import time
+from collections.abc import AsyncGenerator, Callable, Iterable
+from typing import NamedTuple
 
-from openai import AzureOpenAI, OpenAI
+from openai import NOT_GIVEN, AsyncStream
+from openai.types import CompletionUsage
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
 
 from ...config import settings
-from .prompts import GEN_EXAMPLES, PROMPT_GEN_PROMPT_TEMPLATE, PromptStyle
+from ...metrics import (
+    CACHE_LOOKUPS,
+    LLM_FINISH_REASONS,
+    LLM_TOKENS,
+    STAGE_DURATION,
+    observe_stage,
+)
+from ...tracing import Span, tracing
+from .assembly import refinement_template
+from .cache import cache_key, response_cache
+from .clients import clients
+from .history import PromptRun, history
+from .prompts import PROMPT_GEN_PROMPT_TEMPLATE, PromptStyle
+from .rate_limit import Priority, rate_limiters
+from .resilience import remaining_time, resilience
+from .singleflight import SingleFlight
+from .snapshot import REFINE_TEMPERATURE, snapshot
 
 logger = logging.getLogger(__name__)
 
+in_flight_calls = SingleFlight()
 
-def get_refined_prompt(
+
+async def get_refined_prompt(
     prompt: str,
     requirements: dict[str, str],
     input_variables: dict[str, str],
     temperature: float = 0.3,
     metaprompt_template: str = PROMPT_GEN_PROMPT_TEMPLATE,
     prompt_style: PromptStyle = PromptStyle.SIMPLE,
+    use_cache: bool = True,
 ) -> str:
     """Given a prompt, dimensions, and variables, generate and return a refined prompt.
 
@@ -74,59 +99,301 @@ def get_refined_prompt(
         Prompt to send to the LLM to refine `prompt`.
     prompt_style : :class:`~prompt_brew.routers.autoprompt.prompts.PromptStyle`, default ``PromptStyle.SIMPLE``
         What strategy to use for prompt refinement.
+    use_cache : bool, default True
+        Whether to return a cached response to an identical earlier request, if any,
+        instead of generating a new one.
 
     Returns
     -------
     str
         Refined `prompt`.
 
+    """
+    return await _refine_prompt(
+        prompt=prompt,
+        requirements=requirements,
+        input_variables=input_variables,
+        joined_requirements=_join_fields(requirements),
+        joined_input_variables=_join_fields(input_variables),
+        temperature=temperature,
+        metaprompt_template=metaprompt_template,
+        prompt_style=prompt_style,
+        use_cache=use_cache,
+    )
+
+
+class RefinedPromptResult(NamedTuple):
+    """Outcome of refining a prompt with one style, from :func:`get_refined_prompts`."""
+
+    prompt_style: PromptStyle
+    refined_prompt: str | None
+    error: Exception | None
+    elapsed_seconds: float
+
+
+async def get_refined_prompts(
+    prompt: str,
+    requirements: dict[str, str],
+    input_variables: dict[str, str],
+    prompt_styles: Iterable[PromptStyle] = PromptStyle,
+    temperature: float = 0.3,
+    metaprompt_template: str = PROMPT_GEN_PROMPT_TEMPLATE,
+    use_cache: bool = True,
+) -> list[RefinedPromptResult]:
+    """Concurrently refine a prompt with each of several styles.
+
+    A style that fails does not affect the others; its error is returned in its
+    result instead of being raised.
+
+    Parameters
+    ----------
+    prompt : str
+        User prompt to refine.
+    requirements : dict of str to str
+        User-selected dimensions and values for the LLM to augment `prompt`.
+    input_variables : dict or str to str
+        User-specified variable names and descriptions for the LLM to templatize into `prompt`.
+    prompt_styles : iterable of :class:`~prompt_brew.routers.autoprompt.prompts.PromptStyle`, default all styles
+        Strategies to use for prompt refinement.
+    temperature : float between 0 and 2, default 0.3
+        How much randomness the LLM should employ when generating its response.
+    metaprompt_template : f-str, default :const:`~prompt_brew.routers.autoprompt.prompts.PROMPT_GEN_PROMPT_TEMPLATE`
+        Prompt to send to the LLM to refine `prompt`.
+    use_cache : bool, default True
+        Whether to return a cached response to an identical earlier request, if any,
+        instead of generating a new one.
+
+    Returns
+    -------
+    list of :class:`RefinedPromptResult`
+        Refined `prompt` or error for each style, in the order of `prompt_styles`.
+
+    """
+    joined_requirements = _join_fields(requirements)
+    joined_input_variables = _join_fields(input_variables)
+
+    async def refine(prompt_style: PromptStyle) -> RefinedPromptResult:
+        start = time.perf_counter()
+        try:
+            refined_prompt = await _refine_prompt(
+                prompt=prompt,
+                requirements=requirements,
+                input_variables=input_variables,
+                joined_requirements=joined_requirements,
+                joined_input_variables=joined_input_variables,
+                temperature=temperature,
+                metaprompt_template=metaprompt_template,
+                prompt_style=prompt_style,
+                use_cache=use_cache,
+            )
+        except Exception as e:
+            logger.exception(
+                "Failed to generate refined prompt with style: %s", prompt_style
+            )
+            return RefinedPromptResult(
+                prompt_style, None, e, time.perf_counter() - start
+            )
+        return RefinedPromptResult(
+            prompt_style, refined_prompt, None, time.perf_counter() - start
+        )
+
+    return list(await asyncio.gather(*map(refine, prompt_styles)))
+
+
+async def _refine_prompt(
+    prompt: str,
+    requirements: dict[str, str],
+    input_variables: dict[str, str],
+    joined_requirements: str,
+    joined_input_variables: str,
+    temperature: float,
+    metaprompt_template: str,
+    prompt_style: PromptStyle,
+    use_cache: bool,
+) -> str:
+    """Generate and return a refined prompt from pre-rendered requirements and variables.
+
+    See :func:`get_refined_prompt` for parameters; `joined_requirements` and
+    `joined_input_variables` are the output of :func:`_join_fields`. The refinement
+    is recorded in the prompt run history. Refinements of suggested tasks with no
+    requirements or variables are taken from the warm-up snapshot, if any.
+
     """
     logger.info(
         "Generating refined prompt with style: %s",
         prompt_style,
     )
 
-    joined_requirements = "\n" + "\n".join(
-        [f"{k}: {v}" for k, v in requirements.items()],
+    run = PromptRun(
+        "refine",
+        prompt,
+        style=prompt_style.value,
+        requirements=requirements,
+        input_variables=input_variables,
     )
-    joined_input_variables = "\n" + "\n".join(
-        [f"{k}: {v}" for k, v in input_variables.items()],
+    with tracing.span(
+        "refine_prompt",
+        {"prompt_brew.style": prompt_style.value, "prompt_brew.use_cache": use_cache},
+    ), history.recording(run):
+        # the snapshot holds refinements as the web UI first requests them
+        if (
+            use_cache
+            and len(snapshot)
+            and not requirements
+            and not input_variables
+            and temperature == REFINE_TEMPERATURE
+            and metaprompt_template == PROMPT_GEN_PROMPT_TEMPLATE
+        ):
+            run.response = snapshot.refined_prompt(prompt, prompt_style)
+            hit = run.response is not None
+            CACHE_LOOKUPS.labels("refine:snapshot", "hit" if hit else "miss").inc()
+            if hit:
+                task = f"refine:{prompt_style.value}"
+                run.note_cached(settings.openai.models_for(task)[0])
+                return run.response
+        prompt_gen_messages = _build_refinement_messages(
+            prompt=prompt,
+            joined_requirements=joined_requirements,
+            joined_input_variables=joined_input_variables,
+            metaprompt_template=metaprompt_template,
+            prompt_style=prompt_style,
+        )
+
+        logger.debug(
+            "Calling OpenAI to generate refined prompt: %s",
+            prompt_gen_messages,
+        )
+        prompt_gen_response = await acall_open_ai(
+            messages=prompt_gen_messages,
+            temperature=temperature,
+            cache_tag=f"refine:{prompt_style.value}" if use_cache else None,
+            task=f"refine:{prompt_style.value}",
+            run=run,
+        )
+        logger.debug(
+            "OpenAI response with refined prompt: %s",
+            prompt_gen_response,
+        )
+        run.response = prompt_gen_response
+        return prompt_gen_response
+
+
+async def stream_refined_prompt(
+    prompt: str,
+    requirements: dict[str, str],
+    input_variables: dict[str, str],
+    temperature: float = 0.3,
+    metaprompt_template: str = PROMPT_GEN_PROMPT_TEMPLATE,
+    prompt_style: PromptStyle = PromptStyle.SIMPLE,
+) -> AsyncGenerator[str, None]:
+    """Like :func:`get_refined_prompt`, but yield the refined prompt as it is generated.
+
+    Parameters
+    ----------
+    prompt : str
+        User prompt to refine.
+    requirements : dict of str to str
+        User-selected dimensions and values for the LLM to augment `prompt`.
+    input_variables : dict or str to str
+        User-specified variable names and descriptions for the LLM to templatize into `prompt`.
+    temperature : float between 0 and 2, default 0.3
+        How much randomness the LLM should employ when generating its response.
+    metaprompt_template : f-str, default :const:`~prompt_brew.routers.autoprompt.prompts.PROMPT_GEN_PROMPT_TEMPLATE`
+        Prompt to send to the LLM to refine `prompt`.
+    prompt_style : :class:`~prompt_brew.routers.autoprompt.prompts.PromptStyle`, default ``PromptStyle.SIMPLE``
+        What strategy to use for prompt refinement.
+
+    Yields
+    ------
+    str
+        Next piece of the refined `prompt`.
+
+    """
+    logger.info(
+        "Streaming refined prompt with style: %s",
+        prompt_style,
+    )
+    run = PromptRun(
+        "refine",
+        prompt,
+        style=prompt_style.value,
+        requirements=requirements,
+        input_variables=input_variables,
     )
+    with history.recording(run):
+        prompt_gen_messages = _build_refinement_messages(
+            prompt=prompt,
+            joined_requirements=_join_fields(requirements),
+            joined_input_variables=_join_fields(input_variables),
+            metaprompt_template=metaprompt_template,
+            prompt_style=prompt_style,
+        )
+        response = []
+        async for chunk in astream_open_ai(
+            messages=prompt_gen_messages,
+            temperature=temperature,
+            task=f"refine:{prompt_style.value}",
+            run=run,
+        ):
+            response.append(chunk)
+            yield chunk
+        run.response = "".join(response)
+
+
+def _build_refinement_messages(
+    prompt: str,
+    joined_requirements: str,
+    joined_input_variables: str,
+    metaprompt_template: str,
+    prompt_style: PromptStyle,
+) -> list[dict[str, str]]:
+    """Return the chat messages that ask an LLM to refine `prompt`.
+
+    See :func:`_refine_prompt` for parameters.
+
+    """
     system_message = """You are an expert at creating instructional prompts for LLMs."""
-    prompt_gen_messages = [
+    with observe_stage("assembly"):
+        content = refinement_template(
+            prompt_style,
+            metaprompt_template,
+        ).render(
+            prompt=prompt,
+            requirements=joined_requirements,
+            input_variables=joined_input_variables,
+        )
+    return [
         {"role": "system", "content": system_message},
-        {
-            "role": "user",
-            "content": metaprompt_template.format(
-                prompt=prompt,
-                requirements=joined_requirements,
-                input_variables=joined_input_variables,
-                examples=GEN_EXAMPLES[prompt_style],
-            ),
-        },
+        {"role": "user", "content": content},
     ]
 
-    logger.debug(
-        "Calling OpenAI to generate refined prompt: %s",
-        prompt_gen_messages,
-    )
-    prompt_gen_response = call_open_ai(
-        messages=prompt_gen_messages,
-        temperature=temperature,
-    )
-    logger.debug(
-        "OpenAI response with refined prompt: %s",
-        prompt_gen_response,
+
+def _join_fields(fields: dict[str, str]) -> str:
+    """Render names and values as newline-prefixed ``name: value`` lines for a metaprompt."""
+    return "\n" + "\n".join(
+        [f"{k}: {v}" for k, v in fields.items()],
     )
-    return prompt_gen_response
 
 
 def call_open_ai(
     messages: list[dict[str, str]],
     temperature: float,
+    cache_tag: str | None = None,
+    task: str = "prompt",
+    validate: Callable[[str], object] | None = None,
+    response_format: dict[str, str] | None = None,
 ) -> str:
     """Send chat messages to an LLM and return its response.
 
+    This blocks the calling thread until the LLM responds; from a coroutine, use
+    :func:`acall_open_ai` instead.
+
+    Identical cacheable calls made while one is already in flight wait for and share
+    its response. Calls wait as needed to stay within the model's rate limit, if any,
+    giving way to async calls that are already waiting. Failed calls are retried,
+    within the current :func:`~prompt_brew.routers.autoprompt.resilience.deadline`,
+    and then fall back on any other models configured for the model of `task`.
+
     Parameters
     ----------
     messages : list of dict of str to str
@@ -134,6 +401,20 @@ def call_open_ai(
         https://platform.openai.com/docs/api-reference/chat/create#chat-create-messages.
     temperature : float between 0 and 2
         How much randomness the LLM should employ when generating its response.
+    cache_tag : str, optional
+        What the call is for, e.g. its prompt style. If given, a cached response to
+        the same call with the same tag is returned instead of calling the LLM, and
+        a new response is cached.
+    task : str, default "prompt"
+        What the call is for, e.g. ``"refine:SIMPLE"``, to choose its model by (see
+        :meth:`~prompt_brew.config.OpenAISettings.models_for`) and label its
+        metrics with.
+    validate : callable, optional
+        Called with a new response before it is cached, e.g. :func:`json.loads`.
+        If it raises, the response is not cached and the error propagates.
+        Responses from a fallback model are not cached either.
+    response_format : dict of str to str, optional
+        Format that the LLM must respond in, e.g. ``{"type": "json_object"}``.
 
     Returns
     -------
@@ -141,20 +422,413 @@ def call_open_ai(
         LLM response.
 
     """
-    client = _build_client()
-    model = settings.openai.openai_model
-    completions = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=temperature,
-    )
-    completion = completions.choices[0]
-    if completion.finish_reason == "length":
-        raise ValueError(
-            f'incomplete model output for model "{model}" due to token limit'
+    client = clients.get_client()
+    models = settings.openai.models_for(task)
+    key = cache_key(models[0], messages, temperature, cache_tag or "")
+    with tracing.span("call_open_ai", _span_attributes(models[0], task)) as span:
+        if cache_tag is not None:
+            cached_response = response_cache.get(key)
+            hit = cached_response is not None
+            CACHE_LOOKUPS.labels(task, "hit" if hit else "miss").inc()
+            span.set_attribute("prompt_brew.cache_hit", hit)
+            if hit:
+                logger.debug("Using cached OpenAI response for %s", cache_tag)
+                return cached_response
+        attempts = 0
+
+        def attempt(model: str) -> ChatCompletion:
+            nonlocal attempts
+            attempts += 1
+            limiter = rate_limiters.get(model)
+            if limiter is not None:
+                estimated_tokens = rate_limiters.estimate_tokens(messages)
+                limiter.acquire_blocking(estimated_tokens)
+            timeout = remaining_time()
+            with observe_stage(
+                "llm_call",
+                {"gen_ai.request.model": model, "prompt_brew.attempt": attempts},
+                client=True,
+            ):
+                completions = client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    response_format=response_format or NOT_GIVEN,
+                    timeout=NOT_GIVEN if timeout is None else max(timeout, 0.001),
+                )
+            if limiter is not None and completions.usage is not None:
+                limiter.settle(estimated_tokens, completions.usage.total_tokens)
+            return completions
+
+        def complete() -> str:
+            try:
+                model, completions = resilience.call_with_fallback(models, attempt)
+            finally:
+                span.set_attribute("prompt_brew.retries", max(attempts - 1, 0))
+            span.set_attribute("prompt_brew.model", model)
+            _record_completion(
+                model,
+                task,
+                completions.usage,
+                completions.choices[0].finish_reason,
+                span,
+            )
+            response = _get_completion_content(completions, model)
+            if validate is not None:
+                validate(response)
+            if cache_tag is not None and model == models[0]:
+                response_cache.set(key, response)
+            return response
+
+        if cache_tag is None:
+            # uncached calls are sampled afresh, so identical ones are not shared
+            return complete()
+        return in_flight_calls.do(key, complete)
+
+
+async def acall_open_ai(
+    messages: list[dict[str, str]],
+    temperature: float,
+    cache_tag: str | None = None,
+    task: str = "prompt",
+    validate: Callable[[str], object] | None = None,
+    response_format: dict[str, str] | None = None,
+    priority: Priority = Priority.STANDARD,
+    run: PromptRun | None = None,
+) -> str:
+    """Send chat messages to an LLM and return its response, without blocking.
+
+    Identical cacheable calls made while one is already in flight wait for and share
+    its response. Calls wait as needed to stay within the model's rate limit, if any.
+    Failed calls are retried, and slow ones may be hedged, within the current
+    :func:`~prompt_brew.routers.autoprompt.resilience.deadline`. Calls to a model
+    that is slow, rate-limited, or failing fall back on any other models configured
+    for it.
+
+    Parameters
+    ----------
+    messages : list of dict of str to str
+        Conversation messages to send to the LLM. For the format, see
+        https://platform.openai.com/docs/api-reference/chat/create#chat-create-messages.
+    temperature : float between 0 and 2
+        How much randomness the LLM should employ when generating its response.
+    cache_tag : str, optional
+        What the call is for, e.g. its prompt style. If given, a cached response to
+        the same call with the same tag is returned instead of calling the LLM, and
+        a new response is cached.
+    task : str, default "prompt"
+        What the call is for, e.g. ``"refine:SIMPLE"``, to choose its model by (see
+        :meth:`~prompt_brew.config.OpenAISettings.models_for`) and label its
+        metrics with.
+    validate : callable, optional
+        Called with a new response before it is cached, e.g. :func:`json.loads`.
+        If it raises, the response is not cached and the error propagates.
+        Responses from a fallback model are not cached either.
+    response_format : dict of str to str, optional
+        Format that the LLM must respond in, e.g. ``{"type": "json_object"}``.
+    priority : :class:`~prompt_brew.routers.autoprompt.rate_limit.Priority`, default ``Priority.STANDARD``
+        Where the call queues relative to others when the model's rate limit is
+        exhausted.
+    run : :class:`~prompt_brew.routers.autoprompt.history.PromptRun`, optional
+        Run being recorded in the prompt run history, to note the call's model and
+        token usage on.
+
+    Returns
+    -------
+    str
+        LLM response.
+
+    """
+    client = clients.get_async_client()
+    models = settings.openai.models_for(task)
+    key = cache_key(models[0], messages, temperature, cache_tag or "")
+    with tracing.span("call_open_ai", _span_attributes(models[0], task)) as span:
+        if cache_tag is not None:
+            cached_response = await response_cache.aget(key)
+            hit = cached_response is not None
+            CACHE_LOOKUPS.labels(task, "hit" if hit else "miss").inc()
+            span.set_attribute("prompt_brew.cache_hit", hit)
+            if hit:
+                logger.debug("Using cached OpenAI response for %s", cache_tag)
+                if run is not None:
+                    run.note_cached(models[0])
+                return cached_response
+        attempts = 0
+
+        async def attempt(model: str) -> ChatCompletion:
+            nonlocal attempts
+            attempts += 1
+            limiter = rate_limiters.get(model)
+            if limiter is not None:
+                estimated_tokens = rate_limiters.estimate_tokens(messages)
+                await limiter.acquire(estimated_tokens, priority)
+            async with clients.track():
+                with observe_stage(
+                    "llm_call",
+                    {"gen_ai.request.model": model, "prompt_brew.attempt": attempts},
+                    client=True,
+                ):
+                    completions = await client.chat.completions.create(
+                        model=model,
+                        messages=messages,
+                        temperature=temperature,
+                        response_format=response_format or NOT_GIVEN,
+                    )
+            if limiter is not None and completions.usage is not None:
+                await limiter.asettle(estimated_tokens, completions.usage.total_tokens)
+            return completions
+
+        led = False
+
+        async def complete() -> tuple[str, str]:
+            nonlocal led
+            led = True
+            try:
+                model, completions = await resilience.acall_with_fallback(
+                    models,
+                    attempt,
+                )
+            finally:
+                span.set_attribute("prompt_brew.retries", max(attempts - 1, 0))
+            span.set_attribute("prompt_brew.model", model)
+            _record_completion(
+                model,
+                task,
+                completions.usage,
+                completions.choices[0].finish_reason,
+                span,
+                run,
+            )
+            response = _get_completion_content(completions, model)
+            if validate is not None:
+                validate(response)
+            if cache_tag is not None and model == models[0]:
+                await response_cache.aset(key, response)
+            return model, response
+
+        if cache_tag is None:
+            # uncached calls are sampled afresh, so identical ones are not shared
+            _, response = await complete()
+            return response
+        model, response = await in_flight_calls.ado(key, complete)
+        if run is not None and not led:
+            # another call's response was shared, as if cached
+            run.note_cached(model)
+        return response
+
+
+async def astream_open_ai(
+    messages: list[dict[str, str]],
+    temperature: float,
+    cache_tag: str | None = None,
+    task: str = "prompt",
+    validate: Callable[[str], object] | None = None,
+    response_format: dict[str, str] | None = None,
+    priority: Priority = Priority.STANDARD,
+    run: PromptRun | None = None,
+) -> AsyncGenerator[str, None]:
+    """Send chat messages to an LLM and yield its response as it is generated.
+
+    Surrounding quotes are removed from the response, as in :func:`call_open_ai`.
+    Responses are cached under the same keys as by :func:`acall_open_ai`, so either
+    function can return a response cached by the other.
+
+    Parameters
+    ----------
+    messages : list of dict of str to str
+        Conversation messages to send to the LLM. For the format, see
+        https://platform.openai.com/docs/api-reference/chat/create#chat-create-messages.
+    temperature : float between 0 and 2
+        How much randomness the LLM should employ when generating its response.
+    cache_tag : str, optional
+        What the call is for, e.g. its prompt style. If given, a cached response to
+        the same call with the same tag is yielded whole instead of calling the LLM,
+        and a new response is cached once it is complete.
+    task : str, default "prompt"
+        What the call is for, e.g. ``"refine:SIMPLE"``, to choose its model by (see
+        :meth:`~prompt_brew.config.OpenAISettings.models_for`) and label its
+        metrics with.
+    validate : callable, optional
+        Called with a complete new response before it is cached, e.g.
+        :func:`json.loads`. If it raises, the response is not cached and the error
+        propagates. Responses from a fallback model are not cached either.
+    response_format : dict of str to str, optional
+        Format that the LLM must respond in, e.g. ``{"type": "json_object"}``.
+    priority : :class:`~prompt_brew.routers.autoprompt.rate_limit.Priority`, default ``Priority.STANDARD``
+        Where the call queues relative to others when the model's rate limit is
+        exhausted.
+    run : :class:`~prompt_brew.routers.autoprompt.history.PromptRun`, optional
+        Run being recorded in the prompt run history, to note the call's model and
+        token usage on.
+
+    Yields
+    ------
+    str
+        Next piece of the LLM response.
+
+    Raises
+    ------
+    ValueError
+        After the last piece, if the model stopped generating before completing its
+        response.
+
+    """
+    client = clients.get_async_client()
+    models = settings.openai.models_for(task)
+    key = cache_key(models[0], messages, temperature, cache_tag or "")
+    # not the current span, which would leak to the caller between yields
+    with tracing.span(
+        "stream_open_ai",
+        _span_attributes(models[0], task),
+        current=False,
+    ) as span:
+        if cache_tag is not None:
+            cached_response = await response_cache.aget(key)
+            hit = cached_response is not None
+            CACHE_LOOKUPS.labels(task, "hit" if hit else "miss").inc()
+            span.set_attribute("prompt_brew.cache_hit", hit)
+            if hit:
+                logger.debug("Using cached OpenAI response for %s", cache_tag)
+                if run is not None:
+                    run.note_cached(models[0])
+                yield cached_response
+                return
+        estimated_tokens = rate_limiters.estimate_tokens(messages)
+        attempts = 0
+
+        async def attempt(model: str) -> AsyncStream[ChatCompletionChunk]:
+            nonlocal attempts
+            attempts += 1
+            limiter = rate_limiters.get(model)
+            if limiter is not None:
+                await limiter.acquire(estimated_tokens, priority)
+            with tracing.span(
+                "open_stream",
+                {"gen_ai.request.model": model, "prompt_brew.attempt": attempts},
+                client=True,
+            ):
+                return await client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    response_format=response_format or NOT_GIVEN,
+                    stream=True,
+                    # the 2024-05-01-preview Azure API does not report usage when
+                    # streaming
+                    stream_options=(
+                        NOT_GIVEN
+                        if settings.openai.azure_openai_endpoint
+                        else {"include_usage": True}
+                    ),
+                )
+
+        async with clients.track():
+            # only opening the stream is retried; a stream cut off midway is not
+            # resumed
+            try:
+                with tracing.use(span):
+                    model, stream = await resilience.acall_with_fallback(
+                        models,
+                        attempt,
+                        hedge=False,
+                    )
+            finally:
+                span.set_attribute("prompt_brew.retries", max(attempts - 1, 0))
+            span.set_attribute("prompt_brew.model", model)
+            quote_stripper = _QuoteStripper()
+            finish_reason = None
+            usage = None
+            response = []
+            # timed without a span, for the same reason as above
+            with STAGE_DURATION.labels("llm_call").time():
+                async for chunk in stream:
+                    # usage arrives in a last chunk without choices, as do e.g.
+                    # Azure's content filter results
+                    usage = chunk.usage or usage
+                    if not chunk.choices:
+                        continue
+                    choice = chunk.choices[0]
+                    if choice.delta.content:
+                        content = quote_stripper.feed(choice.delta.content)
+                        if content:
+                            response.append(content)
+                            yield content
+                    finish_reason = choice.finish_reason or finish_reason
+        limiter = rate_limiters.get(model)
+        if limiter is not None and usage is not None:
+            await limiter.asettle(estimated_tokens, usage.total_tokens)
+        _record_completion(model, task, usage, finish_reason, span, run)
+        _check_finish_reason(finish_reason, model)
+        if validate is not None:
+            validate("".join(response))
+        if cache_tag is not None and model == models[0]:
+            await response_cache.aset(key, "".join(response))
+
+
+def _span_attributes(model: str, task: str) -> dict[str, str]:
+    """Return the attributes to start the span of an LLM call with."""
+    return {
+        "gen_ai.system": "openai",
+        "gen_ai.request.model": model,
+        "prompt_brew.task": task,
+    }
+
+
+def _record_completion(
+    model: str,
+    task: str,
+    usage: CompletionUsage | None,
+    finish_reason: str | None,
+    span: Span,
+    run: PromptRun | None = None,
+) -> None:
+    """Count the tokens used by a completed LLM call and why it finished."""
+    if run is not None:
+        run.note_completion(model, usage)
+    if usage is not None:
+        # prompt tokens whose processing the provider reused from an earlier call
+        cached_tokens = (
+            usage.prompt_tokens_details.cached_tokens or 0
+            if usage.prompt_tokens_details is not None
+            else 0
         )
-    elif completion.finish_reason == "content_filter":
-        raise ValueError(f'omitted content due to content filter from model "{model}"')
+        LLM_TOKENS.labels(model, task, "prompt").inc(usage.prompt_tokens)
+        LLM_TOKENS.labels(model, task, "cached_prompt").inc(cached_tokens)
+        LLM_TOKENS.labels(model, task, "completion").inc(usage.completion_tokens)
+        span.set_attributes(
+            {
+                "gen_ai.usage.input_tokens": usage.prompt_tokens,
+                "gen_ai.usage.cache_read.input_tokens": cached_tokens,
+                "gen_ai.usage.output_tokens": usage.completion_tokens,
+            },
+        )
+    LLM_FINISH_REASONS.labels(model, task, finish_reason or "none").inc()
+    span.set_attribute("gen_ai.response.finish_reasons", [finish_reason or "none"])
+
+
+def _get_completion_content(completions: ChatCompletion, model: str) -> str:
+    """Validate a chat completion and return its message content.
+
+    Parameters
+    ----------
+    completions : :class:`openai.types.chat.ChatCompletion`
+        Response from the chat completions API.
+    model : str
+        Name of the model that generated `completions`, for error messages.
+
+    Returns
+    -------
+    str
+        Content of the first choice, with any surrounding quotes removed.
+
+    Raises
+    ------
+    ValueError
+        If the model stopped generating before completing its response.
+
+    """
+    completion = completions.choices[0]
+    _check_finish_reason(completion.finish_reason, model)
 
     if not (
         completion.message.content.startswith('"')
@@ -165,37 +839,119 @@ def call_open_ai(
     return completion.message.content.strip('"')
 
 
-def _build_client() -> AzureOpenAI | OpenAI:
-    """Instantiate and return an OpenAI client.
+def _check_finish_reason(finish_reason: str | None, model: str) -> None:
+    """Raise if `finish_reason` shows that `model` did not complete its response.
 
-    Returns
-    -------
-    :class:`openai.AzureOpenAI` or :class:`openai.OpenAI`
-        OpenAI client.
+    Raises
+    ------
+    ValueError
+        If the model stopped generating before completing its response.
 
     """
-    if settings.openai.azure_openai_endpoint:
-        client = AzureOpenAI(
-            api_key=settings.openai.openai_api_key,
-            api_version=settings.openai.api_version,
+    if finish_reason == "length":
+        raise ValueError(
+            f'incomplete model output for model "{model}" due to token limit'
         )
-    else:
-        client = OpenAI()
-    return client
+    elif finish_reason == "content_filter":
+        raise ValueError(f'omitted content due to content filter from model "{model}"')
+
+
+class _QuoteStripper:
+    """Remove surrounding quotes from a response that arrives in pieces.
+
+    Leading quotes are dropped as they arrive. Quotes at the end of a piece are held
+    back until more content follows them, so any still held when the response ends
+    are the trailing quotes, and are never emitted.
+
+    """
+
+    def __init__(self):
+        self._started = False
+        self._held_quotes = ""
+
+    def feed(self, content: str) -> str:
+        """Return the part of `content` that can be emitted so far."""
+        if not self._started:
+            content = content.lstrip('"')
+            if not content:
+                return ""
+            self._started = True
 
+        stripped = content.rstrip('"')
+        if not stripped:
+            self._held_quotes += content
+            return ""
+        emitted = self._held_quotes + stripped
+        self._held_quotes = content[len(stripped) :]
+        return emitted
 
-def run_prompt(prompt: str) -> str:
+
+async def run_prompt(
+    prompt: str,
+    template: str | None = None,
+    input_variables: dict[str, str] | None = None,
+    priority: Priority = Priority.INTERACTIVE,
+) -> str:
     """Send a prompt to an LLM and return its response.
 
     Parameters
     ----------
     prompt : str
         Prompt to send to the LLM.
+    template : str, optional
+        Prompt template that `prompt` was rendered from, if any, to record in the
+        prompt run history in place of `prompt`.
+    input_variables : dict of str to str, optional
+        Variables that `template` was rendered with.
+    priority : :class:`~prompt_brew.routers.autoprompt.rate_limit.Priority`, default ``Priority.INTERACTIVE``
+        Where the call queues relative to others when the model's rate limit is
+        exhausted.
 
     Returns
     -------
     str
-        LLM response.
+        LLM response, which is also recorded in the prompt run history.
+
+    """
+    prompt_gen_messages = [
+        {
+            "role": "user",
+            "content": prompt,
+        },
+    ]
+    with history.recording(_test_run(prompt, template, input_variables)) as run:
+        run.response = await acall_open_ai(
+            messages=prompt_gen_messages,
+            temperature=0.3,
+            task="test",
+            priority=priority,
+            run=run,
+        )
+    return run.response
+
+
+async def stream_prompt(
+    prompt: str,
+    template: str | None = None,
+    input_variables: dict[str, str] | None = None,
+) -> AsyncGenerator[str, None]:
+    """Send a prompt to an LLM and yield its response as it is generated.
+
+    Parameters
+    ----------
+    prompt : str
+        Prompt to send to the LLM.
+    template : str, optional
+        Prompt template that `prompt` was rendered from, if any, to record in the
+        prompt run history in place of `prompt`.
+    input_variables : dict of str to str, optional
+        Variables that `template` was rendered with.
+
+    Yields
+    ------
+    str
+        Next piece of the LLM response, which is also recorded in the prompt run
+        history once complete.
 
     """
     prompt_gen_messages = [
@@ -204,7 +960,28 @@ def run_prompt(prompt: str) -> str:
             "content": prompt,
         },
     ]
-    return call_open_ai(
-        messages=prompt_gen_messages,
-        temperature=0.3,
+    with history.recording(_test_run(prompt, template, input_variables)) as run:
+        response = []
+        async for chunk in astream_open_ai(
+            messages=prompt_gen_messages,
+            temperature=0.3,
+            task="test",
+            priority=Priority.INTERACTIVE,
+            run=run,
+        ):
+            response.append(chunk)
+            yield chunk
+        run.response = "".join(response)
+
+
+def _test_run(
+    prompt: str,
+    template: str | None,
+    input_variables: dict[str, str] | None,
+) -> PromptRun:
+    """Return the run that records a test of `template`, or of `prompt` if not given."""
+    return PromptRun(
+        "test",
+        prompt if template is None else template,
+        input_variables=input_variables or {},
     )
@@ -0,0 +1,453 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""Client-side rate limiting of OpenAI calls to stay within RPM and TPM budgets."""
+
+import asyncio
+import dataclasses
+import enum
+import heapq
+import itertools
+import logging
+import sqlite3
+import threading
+import time
+from collections.abc import Callable
+
+from starlette.concurrency import run_in_threadpool
+
+from ...config import OpenAISettings, RateLimit, settings
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(enum.IntEnum):
+    """Scheduling priority of an OpenAI call; lower values are served first."""
+
+    INTERACTIVE = 0  # a user is waiting on this one response, e.g. /test-prompt
+    STANDARD = 1
+    BATCH = 2  # one of many responses, e.g. a row of a prompt batch
+
+
+@dataclasses.dataclass
+class RateLimiterStats:
+    """Queueing statistics of a :class:`RateLimiter`."""
+
+    admitted: int = 0
+    delayed: int = 0
+    total_wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        """Count one admitted call that waited `seconds` in the queue."""
+        self.admitted += 1
+        if seconds > 0.001:  # more than the bookkeeping of an immediate admission
+            self.delayed += 1
+            self.total_wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+
+class TokenBucket:
+    """Budget that refills continuously up to its capacity.
+
+    Parameters
+    ----------
+    capacity : float greater than 0
+        Largest budget that can accumulate, i.e. the per-minute limit.
+    per_seconds : float greater than 0, default 60
+        Seconds over which an empty bucket refills completely.
+
+    """
+
+    def __init__(self, capacity: float, per_seconds: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        """Add the budget accrued since the last refill."""
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def seconds_until(self, amount: float) -> float:
+        """Return how long until `amount` can be taken, as of the last refill."""
+        # a single request larger than the whole budget waits for a full bucket
+        shortfall = min(amount, self.capacity) - self.level
+        return max(0.0, shortfall / self.rate)
+
+    def take(self, amount: float) -> None:
+        """Take `amount` from the budget, which may leave it in debt."""
+        self.level -= amount
+
+
+class RateLimiter:
+    """Admit calls to one model within its requests- and tokens-per-minute budgets.
+
+    Async callers wait in a queue ordered by :class:`Priority` and then by arrival,
+    so interactive calls overtake batch work but calls of equal priority are served
+    first come, first served. Sync callers are admitted only while no async caller
+    is waiting.
+
+    Parameters
+    ----------
+    model : str
+        Name of the model that the budgets apply to.
+    rate_limit : :class:`~prompt_brew.config.RateLimit`
+        Requests- and tokens-per-minute budgets; either may be unlimited.
+    store : :class:`SQLiteBucketStore`, optional
+        Where to keep the budgets so that several processes share them. By default,
+        they are kept in this process.
+
+    """
+
+    def __init__(
+        self,
+        model: str,
+        rate_limit: RateLimit,
+        store: "SQLiteBucketStore | None" = None,
+    ):
+        self.model = model
+        # cost of a call estimated to use some number of tokens, by bucket name
+        self.buckets: dict[str, tuple[TokenBucket, Callable[[int], int]]] = {}
+        if rate_limit.rpm:
+            self.buckets["requests"] = (TokenBucket(rate_limit.rpm), lambda tokens: 1)
+        if rate_limit.tpm:
+            self.buckets["tokens"] = (
+                TokenBucket(rate_limit.tpm),
+                lambda tokens: tokens,
+            )
+        self.store = store
+        self.stats = RateLimiterStats()
+        self._queue: list[tuple[int, int, asyncio.Event]] = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of async calls waiting to be admitted."""
+        return len(self._queue)
+
+    async def acquire(self, tokens: int, priority: Priority) -> None:
+        """Wait until a call estimated to use `tokens` tokens fits within budget.
+
+        Parameters
+        ----------
+        tokens : int greater than or equal to 0
+            Estimated prompt and completion tokens of the call.
+        priority : :class:`Priority`
+            Where the call queues relative to other waiting calls.
+
+        """
+        start = time.monotonic()
+        entry = (priority, next(self._sequence), asyncio.Event())
+        heapq.heappush(self._queue, entry)
+        self._wake_head()
+        try:
+            while True:
+                if self._queue[0] is entry:
+                    wait = await self._atry_take(tokens)
+                    if wait == 0:
+                        # others may have queued while the shared budget was taken
+                        self._queue.remove(entry)
+                        heapq.heapify(self._queue)
+                        break
+                else:
+                    wait = None
+                entry[2].clear()
+                try:
+                    await asyncio.wait_for(entry[2].wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+            raise
+        finally:
+            self._wake_head()
+
+        waited = time.monotonic() - start
+        self.stats.record_wait(waited)
+        if waited > 1:
+            logger.info("Waited %.1fs for %s rate limit budget", waited, self.model)
+
+    def acquire_blocking(self, tokens: int) -> None:
+        """Block the calling thread until a call fits within budget.
+
+        Parameters
+        ----------
+        tokens : int greater than or equal to 0
+            Estimated prompt and completion tokens of the call.
+
+        """
+        start = time.monotonic()
+        while True:
+            wait = self._try_take(tokens) if not self._queue else 0.1
+            if wait == 0:
+                break
+            time.sleep(wait)
+        self.stats.record_wait(time.monotonic() - start)
+
+    def settle(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Correct the token budget once a call's actual usage is known.
+
+        Parameters
+        ----------
+        estimated_tokens : int
+            Tokens that were reserved for the call.
+        actual_tokens : int
+            Tokens that the call actually used.
+
+        """
+        if "tokens" not in self.buckets:
+            return
+        with self._lock:
+            if self.store is not None:
+                self.store.take(self.model, "tokens", actual_tokens - estimated_tokens)
+            else:
+                self.buckets["tokens"][0].take(actual_tokens - estimated_tokens)
+
+    async def asettle(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """Like :meth:`settle`, without blocking the event loop on a shared store."""
+        if self.store is None:
+            self.settle(estimated_tokens, actual_tokens)
+        else:
+            await run_in_threadpool(self.settle, estimated_tokens, actual_tokens)
+
+    async def _atry_take(self, tokens: int) -> float:
+        """Like :meth:`_try_take`, without blocking the event loop on a shared store."""
+        if self.store is None:
+            return self._try_take(tokens)
+        return await run_in_threadpool(self._try_take, tokens)
+
+    def _try_take(self, tokens: int) -> float:
+        """Take budget for a call if it is available, else return the seconds to wait."""
+        with self._lock:
+            if self.store is not None:
+                return self.store.try_take(self.model, self.buckets, tokens)
+            return _try_take(self.buckets, tokens, time.monotonic())
+
+    def _wake_head(self) -> None:
+        """Let the call at the head of the queue re-check the budget."""
+        if self._queue:
+            self._queue[0][2].set()
+
+
+class SQLiteBucketStore:
+    """Token bucket levels kept in SQLite, to share budgets between processes.
+
+    Each check-and-take runs in its own write transaction, so that worker processes
+    serving the same app never admit more calls between them than the budget
+    allows.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database file, created if it does not exist.
+
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # access is serialized by the rate limiters' locks and self._lock
+        self._connection = sqlite3.connect(
+            path,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._connection.executescript("""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            PRAGMA busy_timeout = 5000;
+            CREATE TABLE IF NOT EXISTS buckets (
+                model TEXT NOT NULL,
+                name TEXT NOT NULL,
+                level REAL NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (model, name)
+            );
+            """)
+        self._lock = threading.Lock()
+
+    def try_take(
+        self,
+        model: str,
+        buckets: dict[str, tuple[TokenBucket, Callable[[int], int]]],
+        tokens: int,
+    ) -> float:
+        """Take budget for a call if it is available, else return the seconds to wait.
+
+        Parameters
+        ----------
+        model : str
+            Name of the model that the budgets apply to.
+        buckets : dict of str to tuple of :class:`TokenBucket` and callable
+            Capacity and cost of a call for each bucket, by name. The buckets'
+            levels are overwritten with the shared levels.
+        tokens : int greater than or equal to 0
+            Estimated prompt and completion tokens of the call.
+
+        Returns
+        -------
+        float
+            0 if the budget was taken, else seconds until it may be available.
+
+        """
+        now = time.time()  # unlike time.monotonic(), comparable across processes
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+            for name, (bucket, _) in buckets.items():
+                row = self._connection.execute(
+                    "SELECT level, updated FROM buckets WHERE model = ? AND name = ?",
+                    (model, name),
+                ).fetchone()
+                bucket.level, bucket.updated = row or (bucket.capacity, now)
+            wait = _try_take(buckets, tokens, now)
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?)",
+                [
+                    (model, name, bucket.level, bucket.updated)
+                    for name, (bucket, _) in buckets.items()
+                ],
+            )
+        return wait
+
+    def take(self, model: str, name: str, amount: float) -> None:
+        """Take `amount` from a bucket, which may leave it in debt."""
+        with self._lock:
+            self._connection.execute(
+                "UPDATE buckets SET level = level - ? WHERE model = ? AND name = ?",
+                (amount, model, name),
+            )
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._connection.close()
+
+
+def _try_take(
+    buckets: dict[str, tuple[TokenBucket, Callable[[int], int]]],
+    tokens: int,
+    now: float,
+) -> float:
+    """Take a call's cost from every bucket if all can afford it, else return the wait."""
+    wait = 0.0
+    for bucket, cost in buckets.values():
+        bucket.refill(now)
+        wait = max(wait, bucket.seconds_until(cost(tokens)))
+    if wait == 0:
+        for bucket, cost in buckets.values():
+            bucket.take(cost(tokens))
+    return wait
+
+
+class RateLimiters:
+    """Registry of a :class:`RateLimiter` per model with a configured budget.
+
+    Parameters
+    ----------
+    openai_settings : :class:`~prompt_brew.config.OpenAISettings`
+        Per-model budgets, and the estimate of completion tokens per call.
+
+    """
+
+    def __init__(self, openai_settings: OpenAISettings):
+        self.openai_settings = openai_settings
+        self._limiters: dict[str, RateLimiter] = {}
+        self._store: SQLiteBucketStore | None = None
+
+    def get(self, model: str) -> RateLimiter | None:
+        """Return the rate limiter for `model`, or ``None`` if it is unlimited.
+
+        The budget under `model` in
+        :attr:`~prompt_brew.config.OpenAISettings.openai_rate_limits` applies, or
+        else the one under ``"*"``.
+
+        """
+        limiter = self._limiters.get(model)
+        if limiter is None:
+            rate_limits = self.openai_settings.openai_rate_limits
+            rate_limit = rate_limits.get(model) or rate_limits.get("*")
+            if rate_limit is None or not (rate_limit.rpm or rate_limit.tpm):
+                return None
+            if self._store is None and self.openai_settings.openai_rate_limit_path:
+                self._store = SQLiteBucketStore(
+                    self.openai_settings.openai_rate_limit_path
+                )
+            limiter = self._limiters[model] = RateLimiter(
+                model,
+                rate_limit,
+                self._store,
+            )
+        return limiter
+
+    def close(self) -> None:
+        """Release the shared budget store, if any."""
+        if self._store is not None:
+            self._store.close()
+            self._store = None
+            self._limiters.clear()
+
+    def __iter__(self):
+        return iter(self._limiters.values())
+
+    def estimate_tokens(self, messages: list[dict[str, str]]) -> int:
+        """Estimate the prompt and completion tokens of a chat completion call.
+
+        Uses the rule of thumb of about four characters per token for English text,
+        plus a few tokens of overhead per message.
+
+        Parameters
+        ----------
+        messages : list of dict of str to str
+            Conversation messages to send to the LLM.
+
+        Returns
+        -------
+        int
+            Estimated total tokens.
+
+        """
+        prompt_tokens = sum(4 + len(message["content"]) // 4 for message in messages)
+        return prompt_tokens + self.openai_settings.openai_completion_token_estimate
+
+
+rate_limiters = RateLimiters(settings.openai)
@@ -0,0 +1,267 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""Render user prompt templates with a shared, sandboxed Jinja environment."""
+
+import collections
+import contextlib
+import hashlib
+import logging
+import operator
+import threading
+import time
+from collections.abc import Iterable, Iterator
+from typing import Any
+
+from jinja2 import Template, nodes
+from jinja2.exceptions import SecurityError
+from jinja2.runtime import Context
+from jinja2.sandbox import SandboxedEnvironment
+
+from ...config import TemplateSettings, settings
+from ...metrics import observe_stage
+
+logger = logging.getLogger(__name__)
+
+
+class PromptRenderError(SecurityError):
+    """Raised when rendering a prompt template exceeds its time or size limit."""
+
+
+class _LimitedEnvironment(SandboxedEnvironment):
+    """Sandboxed environment that bounds the time and memory a template may take.
+
+    Huge values cannot be built with ``*`` or ``**``, and a render in progress is
+    stopped at its deadline by every loop iteration, call, and attribute or item
+    lookup, not only between chunks of output, as loops and macros can run for long
+    without producing any.
+
+    Parameters
+    ----------
+    max_output_chars : int greater than 0
+        Largest string or sequence that ``*`` may produce.
+    render_timeout : float greater than 0
+        Seconds that a render may take.
+
+    """
+
+    intercepted_binops = frozenset(["*", "**"])
+
+    def __init__(self, max_output_chars: int, render_timeout: float):
+        super().__init__()
+        self.max_output_chars = max_output_chars
+        self.render_timeout = render_timeout
+        self._deadline = threading.local()
+
+    @contextlib.contextmanager
+    def time_limit(self) -> Iterator[None]:
+        """Bound the time that rendering on this thread may take in this context."""
+        self._deadline.value = time.monotonic() + self.render_timeout
+        try:
+            yield
+        finally:
+            self._deadline.value = None
+
+    def check_deadline(self) -> None:
+        """Raise if the render in progress on this thread has run out of time."""
+        deadline = getattr(self._deadline, "value", None)
+        if deadline is not None and time.monotonic() > deadline:
+            raise PromptRenderError(
+                f"rendering prompt took longer than {self.render_timeout} seconds",
+            )
+
+    def guard_iterable(self, iterable: Iterable) -> Iterator:
+        """Iterate over `iterable`, checking the deadline as a loop goes round."""
+        for i, value in enumerate(iterable):
+            if not i % 256:
+                self.check_deadline()
+            yield value
+
+    def _parse(
+        self,
+        source: str,
+        name: str | None,
+        filename: str | None,
+    ) -> nodes.Template:
+        """Parse a template, making each of its loops iterate with the deadline."""
+        template = super()._parse(source, name, filename)
+        for loop in template.find_all(nodes.For):
+            loop.iter = nodes.Call(
+                nodes.EnvironmentAttribute("guard_iterable"),
+                [loop.iter],
+                [],
+                None,
+                None,
+                lineno=loop.iter.lineno,
+            ).set_environment(self)
+        return template
+
+    def call(__self, __context: Context, __obj: Any, *args: Any, **kwargs: Any) -> Any:
+        __self.check_deadline()
+        return super().call(__context, __obj, *args, **kwargs)
+
+    def getattr(self, obj: Any, attribute: str) -> Any:
+        self.check_deadline()
+        return super().getattr(obj, attribute)
+
+    def getitem(self, obj: Any, argument: Any) -> Any:
+        self.check_deadline()
+        return super().getitem(obj, argument)
+
+    def call_binop(
+        self,
+        context: Context,
+        operator_: str,
+        left: Any,
+        right: Any,
+    ) -> Any:
+        if operator_ == "*":
+            for sequence, count in ((left, right), (right, left)):
+                if (
+                    isinstance(sequence, (str, list, tuple))
+                    and isinstance(count, int)
+                    and len(sequence) * count > self.max_output_chars
+                ):
+                    raise PromptRenderError("repeated value would be too large")
+            return operator.mul(left, right)
+        if isinstance(right, int) and abs(right) > 1024:
+            raise PromptRenderError("exponent is too large")
+        return operator.pow(left, right)
+
+
+class PromptRenderer:
+    """Bounded cache of compiled prompt templates, keyed by their content.
+
+    Compiling a template parses it and generates Python code, which costs far more
+    than rendering it; the playground re-renders the same prompt with different
+    variables, so compiled templates are kept, least recently used first out.
+
+    Parameters
+    ----------
+    template_settings : :class:`~prompt_brew.config.TemplateSettings`
+        Cache size and render limits.
+
+    """
+
+    def __init__(self, template_settings: TemplateSettings):
+        self.template_settings = template_settings
+        self.environment = _LimitedEnvironment(
+            template_settings.template_max_output_chars,
+            template_settings.template_render_timeout,
+        )
+        self._templates: collections.OrderedDict[str, Template] = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get_template(self, source: str) -> Template:
+        """Return the compiled template for `source`, compiling it if needed.
+
+        Parameters
+        ----------
+        source : str
+            Jinja template source.
+
+        Returns
+        -------
+        :class:`jinja2.Template`
+            Compiled template.
+
+        """
+        key = hashlib.sha256(source.encode()).hexdigest()
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                return template
+
+        template = self.environment.from_string(source)
+        with self._lock:
+            self._templates[key] = template
+            while len(self._templates) > self.template_settings.template_cache_size:
+                self._templates.popitem(last=False)
+        return template
+
+    def render(self, source: str, variables: dict[str, str]) -> str:
+        """Render a prompt template with `variables`, within the configured limits.
+
+        Rendering is stopped once it has taken longer than
+        :attr:`~prompt_brew.config.TemplateSettings.template_render_timeout` seconds
+        or produced more than
+        :attr:`~prompt_brew.config.TemplateSettings.template_max_output_chars`
+        characters.
+
+        Parameters
+        ----------
+        source : str
+            Jinja template source.
+        variables : dict of str to str
+            Values for the template's variables.
+
+        Returns
+        -------
+        str
+            Rendered prompt.
+
+        Raises
+        ------
+        :class:`PromptRenderError`
+            If rendering exceeds its time or size limit.
+        :class:`jinja2.TemplateError`
+            If the template is invalid or unsafe.
+
+        """
+        with observe_stage("render"), self.environment.time_limit():
+            template = self.get_template(source)
+            max_chars = self.template_settings.template_max_output_chars
+            chunks = []
+            length = 0
+            for chunk in template.generate(variables):
+                chunks.append(chunk)
+                length += len(chunk)
+                if length > max_chars:
+                    raise PromptRenderError(
+                        f"rendered prompt is longer than {max_chars} characters",
+                    )
+                self.environment.check_deadline()
+            return "".join(chunks)
+
+
+prompt_renderer = PromptRenderer(settings.templates)
@@ -0,0 +1,616 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""Retries, hedged requests, deadlines, and circuit breaking for OpenAI calls."""
+
+import asyncio
+import collections
+import contextlib
+import contextvars
+import dataclasses
+import functools
+import logging
+import random
+import threading
+import time
+from collections.abc import Awaitable, Callable, Iterator
+from typing import TypeVar
+
+import openai
+
+from ...config import ResilienceSettings, settings
+from ...metrics import LLM_FALLBACKS, LLM_HEDGES, LLM_RETRIES, LLM_SHORT_CIRCUITS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar(
+    "deadline",
+    default=None,
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a model whose recent calls have kept failing."""
+
+
+@contextlib.contextmanager
+def deadline(seconds: float | None) -> Iterator[None]:
+    """Bound the time that OpenAI calls, including retries, may take in this context.
+
+    The deadline is inherited by tasks started within the context. A nested deadline
+    can only shorten an enclosing one.
+
+    Parameters
+    ----------
+    seconds : float greater than 0, optional
+        Seconds from now until the deadline. If not given, the enclosing deadline,
+        if any, applies.
+
+    """
+    if seconds is None:
+        yield
+        return
+    expires = time.monotonic() + seconds
+    enclosing = _deadline.get()
+    if enclosing is not None:
+        expires = min(expires, enclosing)
+    token = _deadline.set(expires)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_time() -> float | None:
+    """Return the seconds left until the current deadline, or ``None`` if there is none."""
+    expires = _deadline.get()
+    return None if expires is None else expires - time.monotonic()
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Return whether an OpenAI call that raised `error` may succeed if repeated."""
+    if isinstance(error, openai.APIConnectionError):  # includes timeouts
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def _is_upstream_failure(error: BaseException) -> bool:
+    """Return whether `error` suggests that the upstream service is degraded."""
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class CircuitBreaker:
+    """Fail fast while a model keeps failing, then let a single trial call through.
+
+    The circuit opens after `failure_threshold` consecutive upstream failures. After
+    `reset_timeout` seconds one call is let through; the circuit closes again if it
+    succeeds, or stays open for another `reset_timeout` if it fails. If the trial call
+    ends without an outcome, e.g. it times out or is cancelled, the next call is let
+    through as a trial instead.
+
+    Parameters
+    ----------
+    model : str
+        Name of the model, for error messages.
+    failure_threshold : int greater than 0
+        Consecutive upstream failures that open the circuit.
+    reset_timeout : float greater than 0
+        Seconds to fail fast before a trial call.
+
+    """
+
+    def __init__(self, model: str, failure_threshold: int, reset_timeout: float):
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        """Whether calls are currently failing fast."""
+        return self.opened_at is not None
+
+    def before_call(self) -> bool:
+        """Raise :class:`CircuitOpenError` if a call should not be made now.
+
+        Returns
+        -------
+        bool
+            Whether the call is the trial call of an open circuit, which must end in
+            :meth:`record_success`, :meth:`record_failure`, or :meth:`abandon_trial`.
+
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            if (
+                not self._trial_in_flight
+                and time.monotonic() - self.opened_at >= self.reset_timeout
+            ):
+                self._trial_in_flight = True
+                return True
+        raise CircuitOpenError(
+            f'calls to model "{self.model}" are failing; not retrying until the'
+            " upstream service recovers"
+        )
+
+    def record_success(self) -> None:
+        """Close the circuit after a successful call."""
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("Closing circuit for model %s", self.model)
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def abandon_trial(self) -> None:
+        """Let another trial call through, as the last one ended without an outcome."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self, error: BaseException) -> None:
+        """Count a failed call, opening the circuit if the upstream looks degraded."""
+        with self._lock:
+            if not _is_upstream_failure(error):
+                # the trial call reached the model, so it is not degraded
+                if self._trial_in_flight:
+                    self.opened_at = None
+                    self._trial_in_flight = False
+                return
+            self.failures += 1
+            if self._trial_in_flight or self.failures >= self.failure_threshold:
+                logger.warning(
+                    "Opening circuit for model %s after %d consecutive failures",
+                    self.model,
+                    self.failures,
+                )
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+
+class LatencyTracker:
+    """Sliding window of recent successful call latencies.
+
+    Parameters
+    ----------
+    window : int greater than 0, default 200
+        Number of most recent latencies to keep.
+
+    """
+
+    def __init__(self, window: int = 200):
+        self._latencies: collections.deque[float] = collections.deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self._latencies)
+
+    def record(self, seconds: float) -> None:
+        """Add the latency of a successful call."""
+        self._latencies.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        """Return the `q` quantile, between 0 and 1, of the recent latencies."""
+        latencies = sorted(self._latencies)
+        return latencies[round(q * (len(latencies) - 1))]
+
+
+@dataclasses.dataclass
+class ResilienceStats:
+    """Counts of the calls made by :class:`Resilience` since startup."""
+
+    attempts: int = 0
+    retries: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+    short_circuits: int = 0
+    fallbacks: int = 0
+
+
+class Resilience:
+    """Make OpenAI calls with retries, optional hedging, deadlines, and circuit breaking.
+
+    Calls that fail with a connection error, 429, or 5xx status are retried with
+    exponentially increasing, fully jittered backoff, or after the ``Retry-After``
+    period that a 429 response asks for. No attempt or backoff runs past the
+    :func:`deadline` of the calling context, if any. Each model has its own
+    :class:`CircuitBreaker`. Calls can also fall back on other models, in order,
+    when a model is slow, rate-limited, or failing.
+
+    Parameters
+    ----------
+    resilience_settings : :class:`~prompt_brew.config.ResilienceSettings`
+        Retry, hedging, and circuit breaking configuration.
+
+    """
+
+    def __init__(self, resilience_settings: ResilienceSettings):
+        self.resilience_settings = resilience_settings
+        self.stats = ResilienceStats()
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._latencies: dict[str, LatencyTracker] = collections.defaultdict(
+            LatencyTracker
+        )
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        """Return the circuit breaker for `model`."""
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            breaker = self._breakers[model] = CircuitBreaker(
+                model,
+                self.resilience_settings.circuit_failure_threshold,
+                self.resilience_settings.circuit_reset_timeout,
+            )
+        return breaker
+
+    def call(
+        self,
+        model: str,
+        attempt: Callable[[], T],
+        has_fallback: bool = False,
+    ) -> T:
+        """Call `attempt` until it succeeds or retrying is futile, blocking the thread.
+
+        `attempt` should bound its own duration by :func:`remaining_time`.
+
+        Parameters
+        ----------
+        model : str
+            Name of the model that `attempt` calls.
+        attempt : callable
+            Makes one OpenAI call and returns its result.
+        has_fallback : bool, default False
+            Whether another model will be called if this call fails, in which case
+            rate-limited attempts are not retried.
+
+        Returns
+        -------
+        object
+            Result of the first successful attempt.
+
+        Raises
+        ------
+        CircuitOpenError
+            If the model's circuit is open.
+        asyncio.TimeoutError
+            If the deadline passes before an attempt is made.
+
+        """
+        breaker = self.breaker(model)
+        for attempt_number in range(1, self.resilience_settings.retry_max_attempts + 1):
+            trial = self._before_attempt(breaker)
+            start = time.monotonic()
+            try:
+                result = attempt()
+            except Exception as e:
+                breaker.record_failure(e)
+                time.sleep(self._backoff(model, attempt_number, e, has_fallback))
+            except BaseException:
+                if trial:
+                    breaker.abandon_trial()
+                raise
+            else:
+                breaker.record_success()
+                self._latencies[model].record(time.monotonic() - start)
+                return result
+
+    async def acall(
+        self,
+        model: str,
+        attempt: Callable[[], Awaitable[T]],
+        hedge: bool = True,
+        has_fallback: bool = False,
+    ) -> T:
+        """Await `attempt` until it succeeds or retrying is futile.
+
+        Parameters
+        ----------
+        model : str
+            Name of the model that `attempt` calls.
+        attempt : callable
+            Makes one OpenAI call and returns its result.
+        hedge : bool, default True
+            Whether to start a second, concurrent attempt when the first is slower
+            than usual, if :attr:`~prompt_brew.config.ResilienceSettings.hedge_requests`
+            is enabled.
+        has_fallback : bool, default False
+            Whether another model will be called if this call fails, in which case
+            rate-limited attempts are not retried.
+
+        Returns
+        -------
+        object
+            Result of the first successful attempt.
+
+        Raises
+        ------
+        CircuitOpenError
+            If the model's circuit is open.
+        asyncio.TimeoutError
+            If the deadline passes before an attempt succeeds.
+
+        """
+        breaker = self.breaker(model)
+        for attempt_number in range(1, self.resilience_settings.retry_max_attempts + 1):
+            trial = self._before_attempt(breaker)
+            start = time.monotonic()
+            try:
+                result = await asyncio.wait_for(
+                    self._ahedged(model, attempt, hedge),
+                    timeout=remaining_time(),
+                )
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                # the deadline or the caller ended the attempt, not the model
+                if trial:
+                    breaker.abandon_trial()
+                raise
+            except Exception as e:
+                breaker.record_failure(e)
+                await asyncio.sleep(
+                    self._backoff(model, attempt_number, e, has_fallback),
+                )
+            else:
+                breaker.record_success()
+                self._latencies[model].record(time.monotonic() - start)
+                return result
+
+    def call_with_fallback(
+        self,
+        models: list[str],
+        attempt: Callable[[str], T],
+    ) -> tuple[str, T]:
+        """Like :meth:`call`, but call each of `models` in turn until one succeeds.
+
+        A model is given up on once it fails in a way that another model might not,
+        e.g. after exhausting its retries or with an open circuit. A model that is
+        merely slow is not given up on, as a blocked thread cannot be interrupted;
+        see :meth:`acall_with_fallback`.
+
+        Parameters
+        ----------
+        models : list of str
+            Names of the models to call, in order of preference.
+        attempt : callable
+            Makes one OpenAI call to the model it is given and returns its result.
+
+        Returns
+        -------
+        tuple of str and object
+            Name of the model that succeeded, and its result.
+
+        """
+        for model, fallback in zip(models, [*models[1:], None]):
+            try:
+                return model, self.call(
+                    model,
+                    functools.partial(attempt, model),
+                    has_fallback=fallback is not None,
+                )
+            except Exception as e:
+                if fallback is None or not self._should_fall_back(e):
+                    raise
+                self._fall_back(model, fallback, e)
+
+    async def acall_with_fallback(
+        self,
+        models: list[str],
+        attempt: Callable[[str], Awaitable[T]],
+        hedge: bool = True,
+    ) -> tuple[str, T]:
+        """Like :meth:`acall`, but call each of `models` in turn until one succeeds.
+
+        A model is given up on once it fails in a way that another model might not,
+        e.g. after exhausting its retries or with an open circuit, is rate-limited,
+        or has not succeeded within
+        :attr:`~prompt_brew.config.ResilienceSettings.fallback_timeout` seconds.
+
+        Parameters
+        ----------
+        models : list of str
+            Names of the models to call, in order of preference.
+        attempt : callable
+            Makes one OpenAI call to the model it is given and returns its result.
+        hedge : bool, default True
+            Whether to hedge slow attempts, as for :meth:`acall`.
+
+        Returns
+        -------
+        tuple of str and object
+            Name of the model that succeeded, and its result.
+
+        """
+        for model, fallback in zip(models, [*models[1:], None]):
+            call = self.acall(
+                model,
+                functools.partial(attempt, model),
+                hedge,
+                has_fallback=fallback is not None,
+            )
+            try:
+                if fallback is None:
+                    return model, await call
+                return model, await asyncio.wait_for(
+                    call,
+                    timeout=self.resilience_settings.fallback_timeout,
+                )
+            except Exception as e:
+                if fallback is None or not self._should_fall_back(e):
+                    raise
+                self._fall_back(model, fallback, e)
+
+    def _should_fall_back(self, error: Exception) -> bool:
+        """Return whether another model might succeed where one failed with `error`."""
+        if isinstance(error, asyncio.TimeoutError):
+            # either the fallback timeout or the caller's deadline
+            remaining = remaining_time()
+            return remaining is None or remaining > 0
+        return isinstance(error, CircuitOpenError) or is_retryable(error)
+
+    def _fall_back(self, model: str, fallback: str, error: Exception) -> None:
+        """Count and log giving up on `model` for `fallback`."""
+        logger.warning(
+            "Falling back from OpenAI model %s to %s: %r",
+            model,
+            fallback,
+            error,
+        )
+        self.stats.fallbacks += 1
+        LLM_FALLBACKS.labels(model, fallback).inc()
+
+    def _before_attempt(self, breaker: CircuitBreaker) -> bool:
+        """Raise if no attempt should be made now, else count the attempt.
+
+        Returns whether the attempt is the trial call of `breaker`.
+
+        """
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise asyncio.TimeoutError("deadline exceeded before calling OpenAI")
+        try:
+            trial = breaker.before_call()
+        except CircuitOpenError:
+            self.stats.short_circuits += 1
+            LLM_SHORT_CIRCUITS.labels(breaker.model).inc()
+            raise
+        self.stats.attempts += 1
+        return trial
+
+    def _backoff(
+        self,
+        model: str,
+        attempt_number: int,
+        error: Exception,
+        has_fallback: bool,
+    ) -> float:
+        """Return seconds to wait before retrying after `error`, or re-raise it."""
+        if (
+            not is_retryable(error)
+            or attempt_number >= self.resilience_settings.retry_max_attempts
+            # sooner call a fallback model than wait for the rate limit to reset
+            or (has_fallback and isinstance(error, openai.RateLimitError))
+        ):
+            raise error
+        delay = random.uniform(
+            0,
+            min(
+                self.resilience_settings.retry_backoff_max,
+                self.resilience_settings.retry_backoff_base * 2 ** (attempt_number - 1),
+            ),
+        )
+        if isinstance(error, openai.APIStatusError):
+            try:
+                retry_after = float(error.response.headers["retry-after"])
+            except (KeyError, ValueError):
+                pass
+            else:
+                if retry_after > self.resilience_settings.retry_backoff_max:
+                    # sooner fail, or fall back, than wait that long
+                    raise error
+                delay = max(retry_after, 0)
+        remaining = remaining_time()
+        if remaining is not None and delay >= remaining:
+            raise error
+        logger.warning(
+            "OpenAI call to %s failed on attempt %d, retrying in %.2fs: %r",
+            model,
+            attempt_number,
+            delay,
+            error,
+        )
+        self.stats.retries += 1
+        LLM_RETRIES.labels(model).inc()
+        return delay
+
+    async def _ahedged(
+        self,
+        model: str,
+        attempt: Callable[[], Awaitable[T]],
+        hedge: bool,
+    ) -> T:
+        """Await `attempt`, racing a second one if the first is unusually slow."""
+        hedge_after = None
+        latencies = self._latencies[model]
+        if (
+            hedge
+            and self.resilience_settings.hedge_requests
+            and len(latencies) >= self.resilience_settings.hedge_min_samples
+        ):
+            hedge_after = latencies.percentile(
+                self.resilience_settings.hedge_percentile
+            )
+
+        first = asyncio.ensure_future(attempt())
+        pending = {first}
+        try:
+            if hedge_after is not None:
+                done, pending = await asyncio.wait(pending, timeout=hedge_after)
+                if not done:
+                    logger.debug("Hedging OpenAI call to %s", model)
+                    self.stats.hedges += 1
+                    LLM_HEDGES.labels(model).inc()
+                    pending.add(asyncio.ensure_future(attempt()))
+                else:
+                    pending = done
+            while True:
+                done, pending = await asyncio.wait(
+                    pending,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.stats.hedge_wins += 1
+                        return task.result()
+                if not pending:
+                    return done.pop().result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+
+resilience = Resilience(settings.resilience)
@@ -0,0 +1,392 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""
+Cache of values by the similarity of their task text, for near-duplicate tasks.
+
+Task descriptions that differ only in case, punctuation, filler words, plurals, or
+spelling, e.g. "Write catchy LinkedIn posts" and "write catchy linkedin posts for
+me", or "summarize" and "summarise", miss the response cache, whose keys are exact.
+This cache instead compares the shingles of normalized task text: MinHash
+signatures, bucketed by locality-sensitive hashing, narrow each lookup to a few
+candidates, and the Jaccard similarity of a candidate's shingles to the task's
+decides whether it is a hit. A candidate is only a hit if each of its content words
+is one of the task's, or a spelling variant of one, as a single changed word, e.g.
+"formal" for "informal" or "France" for "Germany", can change what a task asks for
+while leaving it highly similar. Spelling variants are respelled as in the candidate
+before comparing shingles, so they don't count against its similarity.
+
+"""
+
+import collections
+import hashlib
+import itertools
+import random
+import re
+import threading
+import time
+import unicodedata
+from collections.abc import Hashable
+from typing import Generic, NamedTuple, TypeVar
+
+from ...config import CacheSettings, settings
+
+V = TypeVar("V")
+
+# words that rarely change what a task asks for
+STOP_WORDS = frozenset(
+    """
+    a about an and are be can could for help i in is me my of on our please some
+    that the to us with would you
+    """.split(),
+)
+
+# shortest words compared as spelling variants; shorter ones, e.g. "sort" and
+# "port", are too often other words altogether
+MIN_VARIANT_LENGTH = 5
+
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def normalize(text: str) -> list[str]:
+    """Return the words of `text` that matter for similarity, lowercased and singular."""
+    words = re.findall(r"\w+", unicodedata.normalize("NFKC", text).lower())
+    return [
+        # a crude plural, e.g. "posts", but not "class"
+        word[:-1] if len(word) > 3 and word.endswith("s") and word[-2] != "s" else word
+        for word in words
+        if word not in STOP_WORDS
+    ]
+
+
+def content_words(text: str) -> frozenset[str]:
+    """Return the set of words of `text` that matter for similarity."""
+    return frozenset(normalize(text))
+
+
+def is_spelling_variant(a: str, b: str) -> bool:
+    """Return whether words `a` and `b` differ by one added, removed, or changed letter.
+
+    Only words of at least :data:`MIN_VARIANT_LENGTH` letters with the same first
+    letter are variants, e.g. "summarize" and "summarise" or "linkedin" and
+    "linkdin", but not "formal" and "normal".
+
+    """
+    if (
+        min(len(a), len(b)) < MIN_VARIANT_LENGTH
+        or abs(len(a) - len(b)) > 1
+        or a[0] != b[0]
+    ):
+        return False
+    if len(a) == len(b):
+        return sum(x != y for x, y in zip(a, b)) == 1
+    shorter, longer = sorted((a, b), key=len)
+    return any(longer[:i] + longer[i + 1 :] == shorter for i in range(len(longer)))
+
+
+def respell(words: list[str], known_words: frozenset[str]) -> list[str] | None:
+    """Return `words` with spelling variants of `known_words` spelled as those are.
+
+    Returns None unless each of `words` is one of `known_words` or a variant of
+    one, from :func:`is_spelling_variant`, and each of `known_words` is matched.
+
+    """
+    respelled = []
+    for word in words:
+        if word not in known_words:
+            word = next(
+                (known for known in known_words if is_spelling_variant(word, known)),
+                None,
+            )
+            if word is None:
+                return None
+        respelled.append(word)
+    return respelled if known_words.issubset(respelled) else None
+
+
+def shingles(text: str) -> frozenset[str]:
+    """Return the character trigrams and word pairs of normalized `text`.
+
+    Trigrams keep text with a misspelled or changed word a likely candidate, while
+    word pairs tell apart tasks whose words are in another order, e.g. translating
+    English to French and French to English.
+
+    """
+    return _word_shingles(normalize(text))
+
+
+def _word_shingles(words: list[str]) -> frozenset[str]:
+    """Return the character trigrams and word pairs of normalized `words`."""
+    padded = f" {' '.join(words)} "
+    trigrams = {padded[i : i + 3] for i in range(len(padded) - 2)} if words else set()
+    # the NUL prefix keeps word pairs from colliding with trigrams
+    pairs = {f"\0{first} {second}" for first, second in zip(words, words[1:])}
+    return frozenset(trigrams | pairs)
+
+
+def jaccard(a: frozenset[str], b: frozenset[str]) -> float:
+    """Return the Jaccard similarity of two sets, or 0 if both are empty."""
+    union = len(a | b)
+    return len(a & b) / union if union else 0.0
+
+
+class MinHasher:
+    """Compute MinHash signatures, whose agreement estimates Jaccard similarity.
+
+    Parameters
+    ----------
+    num_perm : int greater than 0, default 64
+        Number of hash functions, and so the length of each signature.
+    seed : int, default 0
+        Seed of the hash functions, which must match for signatures to compare.
+
+    """
+
+    def __init__(self, num_perm: int = 64, seed: int = 0):
+        rng = random.Random(seed)
+        self._permutations = [
+            (rng.randrange(1, _MERSENNE_PRIME), rng.randrange(_MERSENNE_PRIME))
+            for _ in range(num_perm)
+        ]
+
+    def signature(self, shingles: frozenset[str]) -> tuple[int, ...]:
+        """Return the MinHash signature of a non-empty set of shingles."""
+        hashes = [
+            int.from_bytes(
+                hashlib.blake2b(shingle.encode(), digest_size=8).digest(),
+                "little",
+            )
+            for shingle in shingles
+        ]
+        return tuple(
+            min((a * h + b) % _MERSENNE_PRIME for h in hashes)
+            for a, b in self._permutations
+        )
+
+
+class SimilarMatch(NamedTuple):
+    """Value found by :meth:`SimilarityIndex.get`, and how similar its text was."""
+
+    value: object
+    similarity: float
+
+
+class _Entry(NamedTuple):
+    """Value cached in a :class:`SimilarityIndex`, with what it was cached for."""
+
+    scope: Hashable
+    words: frozenset[str]
+    shingles: frozenset[str]
+    buckets: list[tuple]
+    value: object
+    created_at: float
+
+
+class SimilarityIndex(Generic[V]):
+    """In-process LRU cache of values, looked up by the similarity of their text.
+
+    Parameters
+    ----------
+    threshold : float between 0 and 1
+        Least Jaccard similarity of shingles, from :func:`shingles`, at which a
+        cached value is returned for other text with the same content words, from
+        :func:`content_words`, up to spelling variants; see :func:`respell`.
+    max_entries : int greater than 0
+        Number of values to keep; the least recently used are evicted first.
+    ttl : float greater than 0
+        Seconds after which a cached value expires.
+    bands, rows : int greater than 0, default 16 and 4
+        Locality-sensitive hashing of signatures of ``bands * rows`` hashes: text
+        that agrees on all of the rows of any band is a candidate. With the
+        defaults, text at a similarity of 0.8 is a candidate over 99.9% of the time.
+
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        max_entries: int,
+        ttl: float,
+        bands: int = 16,
+        rows: int = 4,
+    ):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.bands = bands
+        self.rows = rows
+        self._hasher = MinHasher(bands * rows)
+        self._ids = itertools.count()
+        self._entries: collections.OrderedDict[int, _Entry] = collections.OrderedDict()
+        self._buckets: dict[tuple, set[int]] = collections.defaultdict(set)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, text: str, scope: Hashable = None) -> SimilarMatch | None:
+        """Return the cached value whose text is most similar to `text`, if any.
+
+        Parameters
+        ----------
+        text : str
+            Text to look up, e.g. a task description.
+        scope : hashable, optional
+            Only values cached with the same scope are returned, e.g. for the same
+            request parameters.
+
+        Returns
+        -------
+        :class:`SimilarMatch` or None
+            Cached value and its similarity, if it is at least :attr:`threshold` and
+            its text has the same content words, up to spelling variants.
+
+        """
+        text_shingles = shingles(text)
+        if not text_shingles:
+            return None
+        text_words = normalize(text)
+        buckets = self._bucket_keys(scope, text_shingles)
+        now = time.time()
+        with self._lock:
+            best_id, best_similarity = None, 0.0
+            for entry_id in set().union(*(self._buckets.get(b, ()) for b in buckets)):
+                entry = self._entries[entry_id]
+                if entry.created_at + self.ttl < now:
+                    self._remove(entry_id)
+                    continue
+                if entry.scope != scope:
+                    continue
+                respelled = respell(text_words, entry.words)
+                if respelled is None:
+                    continue
+                similarity = jaccard(_word_shingles(respelled), entry.shingles)
+                if similarity > best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is None or best_similarity < self.threshold:
+                return None
+            self._entries.move_to_end(best_id)
+            return SimilarMatch(self._entries[best_id].value, best_similarity)
+
+    def set(self, text: str, value: V, scope: Hashable = None) -> None:
+        """Cache `value` for `text`, replacing any value for the same shingles.
+
+        Parameters
+        ----------
+        text : str
+            Text to cache `value` for, e.g. a task description.
+        value : object
+            Value to cache, which must not be changed afterward.
+        scope : hashable, optional
+            Scope to cache `value` in; see :meth:`get`.
+
+        """
+        text_shingles = shingles(text)
+        if not text_shingles:
+            return
+        buckets = self._bucket_keys(scope, text_shingles)
+        with self._lock:
+            for entry_id in list(self._buckets.get(buckets[0], ())):
+                entry = self._entries[entry_id]
+                if entry.scope == scope and entry.shingles == text_shingles:
+                    self._remove(entry_id)
+            entry_id = next(self._ids)
+            self._entries[entry_id] = _Entry(
+                scope,
+                content_words(text),
+                text_shingles,
+                buckets,
+                value,
+                time.time(),
+            )
+            for bucket in buckets:
+                self._buckets[bucket].add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def _bucket_keys(self, scope: Hashable, text_shingles: frozenset[str]) -> list:
+        """Return the LSH bucket of each band of the signature of `text_shingles`."""
+        signature = self._hasher.signature(text_shingles)
+        return [
+            (scope, band, signature[band * self.rows : (band + 1) * self.rows])
+            for band in range(self.bands)
+        ]
+
+    def _remove(self, entry_id: int) -> None:
+        """Remove an entry and its buckets, with the lock held."""
+        entry = self._entries.pop(entry_id)
+        for bucket in entry.buckets:
+            bucket_ids = self._buckets[bucket]
+            bucket_ids.discard(entry_id)
+            if not bucket_ids:
+                del self._buckets[bucket]
+
+
+def build_similarity_index(cache_settings: CacheSettings) -> SimilarityIndex | None:
+    """Instantiate and return the similarity cache configured by `cache_settings`.
+
+    Parameters
+    ----------
+    cache_settings : :class:`~prompt_brew.config.CacheSettings`
+        Cache backend, limits, and similarity threshold.
+
+    Returns
+    -------
+    :class:`SimilarityIndex` or None
+        Similarity cache, or ``None`` if caching or the similarity threshold is
+        disabled.
+
+    """
+    if (
+        cache_settings.cache_backend == "none"
+        or cache_settings.cache_similarity_threshold is None
+    ):
+        return None
+    return SimilarityIndex(
+        cache_settings.cache_similarity_threshold,
+        cache_settings.cache_max_entries,
+        cache_settings.cache_ttl,
+    )
+
+
+# dimensions suggested for each task, as (nominal, ordinal) dimensions
+similar_dimensions: (
+    SimilarityIndex[tuple[dict[str, list[str]], dict[str, list[str]]]] | None
+) = build_similarity_index(settings.cache)
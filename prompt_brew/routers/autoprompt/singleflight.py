@@ -0,0 +1,168 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""Coalesce identical concurrent calls into one."""
+
+import asyncio
+import dataclasses
+import logging
+import threading
+from collections.abc import Awaitable, Callable
+from typing import Any, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclasses.dataclass
+class _AsyncFlight:
+    """Shared call that one or more coroutines are waiting on."""
+
+    task: asyncio.Task
+    waiters: int = 0
+
+
+@dataclasses.dataclass
+class _SyncFlight:
+    """Shared call that one or more threads are waiting on."""
+
+    done: threading.Event = dataclasses.field(default_factory=threading.Event)
+    result: Any = None
+    error: BaseException | None = None
+
+
+class SingleFlight:
+    """Share one call's result among all identical calls made while it is in flight.
+
+    Calls are identified by a key; a call whose key matches one already in flight
+    waits for, and returns, that call's result (or raises its error) instead of
+    running again. Sync calls, from threads, and async calls, from coroutines, are
+    coalesced separately.
+
+    """
+
+    def __init__(self):
+        self.coalesced = 0
+        self._async_flights: dict[str, _AsyncFlight] = {}
+        self._sync_flights: dict[str, _SyncFlight] = {}
+        self._sync_lock = threading.Lock()
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """Await ``fn()``, or the identical call already in flight for `key`.
+
+        The shared call is only cancelled once every coroutine waiting on it has
+        been cancelled, so one client disconnecting does not fail the others.
+
+        Parameters
+        ----------
+        key : str
+            Identifies calls that are interchangeable.
+        fn : callable returning awaitable
+            Makes the call.
+
+        Returns
+        -------
+        object
+            Result of the shared call.
+
+        """
+        flight = self._async_flights.get(key)
+        if flight is None:
+            flight = _AsyncFlight(asyncio.ensure_future(fn()))
+            self._async_flights[key] = flight
+            flight.task.add_done_callback(
+                lambda _: self._async_flights.pop(key, None),
+            )
+        else:
+            self.coalesced += 1
+            logger.debug("Joining in-flight call %s", key)
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1:
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        """Call ``fn()``, or wait for the identical call already in flight for `key`.
+
+        Parameters
+        ----------
+        key : str
+            Identifies calls that are interchangeable.
+        fn : callable
+            Makes the call.
+
+        Returns
+        -------
+        object
+            Result of the shared call.
+
+        """
+        with self._sync_lock:
+            flight = self._sync_flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._sync_flights[key] = _SyncFlight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            logger.debug("Joining in-flight call %s", key)
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._sync_lock:
+                del self._sync_flights[key]
+            flight.done.set()
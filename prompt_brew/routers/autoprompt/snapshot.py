@@ -0,0 +1,210 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""
+Snapshot of dimensions and refined prompts precomputed for the suggested tasks.
+
+The web UI offers a few suggested tasks, which are the most common first requests.
+A snapshot of their dimensions, and of their refinement in each prompt style with
+no dimensions or variables selected, as the web UI first requests it, lets those
+requests be answered without calling the LLM. Snapshots are made by
+:mod:`prompt_brew.warmup`, and are only used while the models and metaprompts they
+were made with are unchanged.
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+from ...config import settings
+from .prompts import (
+    GEN_EXAMPLES,
+    NOM_GEN_PROMPT,
+    ORD_GEN_PROMPT,
+    PROMPT_GEN_PROMPT_TEMPLATE,
+    PromptStyle,
+)
+
+logger = logging.getLogger(__name__)
+
+# numbers of nominal dimensions, their values, and ordinal dimensions in snapshots
+DIMENSION_COUNTS = (5, 5, 5)
+REFINE_TEMPERATURE = 0.3
+
+
+def fingerprint() -> str:
+    """Return a digest of the configuration that snapshot contents depend on."""
+    payload = json.dumps(
+        [
+            settings.openai.models_for("dimensions:nominal"),
+            settings.openai.models_for("dimensions:ordinal"),
+            [
+                settings.openai.models_for(f"refine:{style.value}")
+                for style in PromptStyle
+            ],
+            settings.dimensions_json_mode,
+            NOM_GEN_PROMPT,
+            ORD_GEN_PROMPT,
+            PROMPT_GEN_PROMPT_TEMPLATE,
+            GEN_EXAMPLES,
+        ],
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class Snapshot:
+    """Dimensions and refined prompts precomputed for some tasks.
+
+    Tasks are matched exactly, after stripping surrounding whitespace.
+
+    """
+
+    def __init__(self):
+        self.tasks: dict[str, dict] = {}
+        self.created_at: float | None = None
+
+    def __len__(self) -> int:
+        return len(self.tasks)
+
+    def dimensions(
+        self,
+        task: str,
+        counts: tuple[int, int, int],
+    ) -> tuple[dict[str, list[str]], dict[str, list[str]]] | None:
+        """Return copies of the nominal and ordinal dimensions of `task`, if any.
+
+        Parameters
+        ----------
+        task : str
+            Task description.
+        counts : tuple of int
+            Numbers of nominal dimensions, their values, and ordinal dimensions
+            requested, which must be :data:`DIMENSION_COUNTS`.
+
+        """
+        entry = self.tasks.get(task.strip())
+        if entry is None or counts != DIMENSION_COUNTS:
+            return None
+        return tuple(
+            {name: list(values) for name, values in entry[kind].items()}
+            for kind in ("nominal", "ordinal")
+        )
+
+    def refined_prompt(self, task: str, prompt_style: PromptStyle) -> str | None:
+        """Return `task` refined in `prompt_style`, with no dimensions or variables."""
+        entry = self.tasks.get(task.strip())
+        return (
+            None if entry is None else entry["refined_prompts"].get(prompt_style.value)
+        )
+
+    def add(
+        self,
+        task: str,
+        nominal: dict[str, list[str]],
+        ordinal: dict[str, list[str]],
+        refined_prompts: dict[PromptStyle, str],
+    ) -> None:
+        """Add the dimensions and refined prompts of `task`."""
+        self.tasks[task.strip()] = {
+            "nominal": nominal,
+            "ordinal": ordinal,
+            "refined_prompts": {
+                style.value: refined_prompt
+                for style, refined_prompt in refined_prompts.items()
+            },
+        }
+        self.created_at = time.time()
+
+    def update(self, other: "Snapshot") -> None:
+        """Replace the contents of this snapshot with those of `other`."""
+        self.tasks = other.tasks
+        self.created_at = other.created_at
+
+    def save(self, path: str | Path) -> None:
+        """Write the snapshot to a JSON file, replacing it atomically."""
+        path = Path(path)
+        temporary_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        temporary_path.write_text(
+            json.dumps(
+                {
+                    "fingerprint": fingerprint(),
+                    "created_at": self.created_at,
+                    "tasks": self.tasks,
+                },
+                ensure_ascii=False,
+                indent=2,
+            ),
+            encoding="utf-8",
+        )
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "Snapshot | None":
+        """Read a snapshot saved by :meth:`save`.
+
+        Returns
+        -------
+        :class:`Snapshot` or None
+            Snapshot, or ``None`` if the file does not exist or was made with other
+            models or metaprompts.
+
+        """
+        try:
+            content = json.loads(Path(path).read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return None
+        if content["fingerprint"] != fingerprint():
+            logger.warning(
+                "Ignoring snapshot %s, made with other models or metaprompts",
+                path,
+            )
+            return None
+        snapshot = cls()
+        snapshot.tasks = content["tasks"]
+        snapshot.created_at = content["created_at"]
+        return snapshot
+
+
+snapshot = Snapshot()
@@ -0,0 +1,211 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""Helpers for streaming LLM responses to clients as they are generated."""
+
+import asyncio
+import contextlib
+import json
+import logging
+import time
+from collections.abc import AsyncGenerator, AsyncIterator
+from typing import NamedTuple
+
+from fastapi.responses import StreamingResponse
+
+from .resilience import deadline
+
+logger = logging.getLogger(__name__)
+
+STREAM_HEADERS = {
+    "Cache-Control": "no-cache",
+    # keep reverse proxies from buffering the stream into one late response
+    "X-Accel-Buffering": "no",
+}
+
+
+async def open_event_stream(
+    chunks: AsyncGenerator[object, None],
+    timeout: float | None = None,
+) -> StreamingResponse:
+    """Start streaming `chunks` as Server-Sent Events.
+
+    The first chunk is awaited before the response starts, so that errors from
+    starting the LLM call can still be reported with an HTTP status code. Each
+    chunk is sent as a ``data`` event holding it as JSON. The stream ends with a
+    ``done`` event, or an ``error`` event holding a JSON error message if the LLM
+    call fails or times out after the response has started.
+
+    Parameters
+    ----------
+    chunks : async generator of JSON-serializable objects or named tuples
+        Pieces of an LLM response, e.g. strings from
+        :func:`~prompt_brew.routers.autoprompt.open_ai.astream_open_ai`. Named
+        tuples are sent as JSON objects.
+    timeout : float greater than 0, optional
+        Seconds that the whole stream may take, including any retries of the LLM
+        call, after which `chunks` is closed.
+
+    Returns
+    -------
+    :class:`fastapi.responses.StreamingResponse`
+        Event stream response.
+
+    Raises
+    ------
+    asyncio.TimeoutError
+        If the first chunk takes longer than `timeout`.
+
+    """
+    expires = None if timeout is None else time.monotonic() + timeout
+    try:
+        first_chunk = await _next_chunk(chunks, expires, timeout)
+    except StopAsyncIteration:
+        first_chunk = None
+    except BaseException:
+        await chunks.aclose()
+        raise
+    return StreamingResponse(
+        _format_events(first_chunk, chunks, expires, timeout),
+        media_type="text/event-stream",
+        headers=STREAM_HEADERS,
+    )
+
+
+async def _next_chunk(
+    chunks: AsyncGenerator[object, None],
+    expires: float | None,
+    timeout: float | None,
+) -> object:
+    """Return the next of `chunks`, or raise if it is not ready before `expires`."""
+    if expires is None:
+        return await anext(chunks)
+    remaining = expires - time.monotonic()
+    # the deadline also bounds retries within the LLM call
+    with deadline(remaining):
+        try:
+            return await asyncio.wait_for(anext(chunks), timeout=remaining)
+        except asyncio.TimeoutError as e:
+            raise asyncio.TimeoutError(
+                f"response took longer than {timeout} seconds"
+            ) from e
+
+
+async def _format_events(
+    first_chunk: object | None,
+    chunks: AsyncGenerator[object, None],
+    expires: float | None,
+    timeout: float | None,
+) -> AsyncIterator[str]:
+    """Yield `first_chunk` and then the rest of `chunks` as Server-Sent Events."""
+    try:
+        # close the LLM stream promptly if the client disconnects mid-response
+        async with contextlib.aclosing(chunks):
+            if first_chunk is not None:
+                yield format_event(_to_json(first_chunk))
+                while True:
+                    try:
+                        chunk = await _next_chunk(chunks, expires, timeout)
+                    except StopAsyncIteration:
+                        break
+                    yield format_event(_to_json(chunk))
+    except Exception as e:
+        logger.exception("Encountered error while streaming")
+        yield format_event(json.dumps(str(e)), event="error")
+    else:
+        yield format_event("", event="done")
+
+
+def _to_json(chunk: object) -> str:
+    """Serialize a chunk of a stream, named tuples as objects."""
+    if isinstance(chunk, tuple) and hasattr(chunk, "_asdict"):
+        chunk = chunk._asdict()
+    return json.dumps(chunk)
+
+
+def format_event(data: str, event: str | None = None) -> str:
+    """Format one Server-Sent Event.
+
+    Parameters
+    ----------
+    data : str
+        Single-line event payload.
+    event : str, optional
+        Event type. Clients treat events without a type as ``message`` events.
+
+    Returns
+    -------
+    str
+        Event in the ``text/event-stream`` wire format.
+
+    """
+    lines = [f"data: {data}"]
+    if event is not None:
+        lines.insert(0, f"event: {event}")
+    return "\n".join(lines) + "\n\n"
+
+
+def open_ndjson_stream(
+    records: AsyncGenerator[NamedTuple, None],
+) -> StreamingResponse:
+    """Stream `records` as newline-delimited JSON objects.
+
+    Parameters
+    ----------
+    records : async generator of named tuple
+        Records to send, one JSON object per line.
+
+    Returns
+    -------
+    :class:`fastapi.responses.StreamingResponse`
+        NDJSON response.
+
+    """
+
+    async def format_lines() -> AsyncIterator[str]:
+        async with contextlib.aclosing(records):
+            async for record in records:
+                yield json.dumps(record._asdict()) + "\n"
+
+    return StreamingResponse(
+        format_lines(),
+        media_type="application/x-ndjson",
+        headers=STREAM_HEADERS,
+    )
@@ -0,0 +1,143 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""
+Production launcher for the PromptBrew server, with several worker processes.
+
+Run from the ``prompt_brew`` directory, with its parent on the import path::
+
+    PYTHONPATH=.. python -m prompt_brew.serve --workers 2
+
+With more than one worker, the LLM response cache and OpenAI rate limit budgets are
+moved to SQLite files that every worker shares, unless they have been configured
+explicitly, and every worker records Prometheus metrics to a shared directory,
+which is removed when the launcher exits unless it was set explicitly. Send
+``SIGHUP`` to the launcher to replace the workers one at a time, e.g. after changing
+configuration, and ``SIGTTIN`` or ``SIGTTOU`` to add or remove a worker.
+
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+
+import uvicorn
+
+from .config import settings
+
+# not __name__, which is "__main__" when run with -m
+logger = logging.getLogger("prompt_brew.serve")
+
+SHARED_CACHE_PATH = "prompt_brew_cache.sqlite3"
+SHARED_RATE_LIMIT_PATH = "prompt_brew_rate_limits.sqlite3"
+
+
+def share_state_across_workers() -> str | None:
+    """Configure worker processes to share their cache, rate limits, and metrics.
+
+    Worker processes read their configuration from the environment when they start,
+    so this sets environment variables for any setting left at its default.
+
+    Returns
+    -------
+    str or None
+        Temporary directory created for the metrics of the workers, to remove once
+        they have exited, or ``None`` if ``PROMETHEUS_MULTIPROC_DIR`` was set.
+
+    """
+    if "cache_backend" not in settings.cache.model_fields_set:
+        logger.info("Sharing LLM response cache across workers via SQLite")
+        os.environ["CACHE_BACKEND"] = "sqlite"
+        os.environ.setdefault("CACHE_PATH", SHARED_CACHE_PATH)
+    elif settings.cache.cache_backend == "memory":
+        logger.warning("Each worker will keep its own LLM response cache")
+
+    if settings.openai.openai_rate_limits and not (
+        settings.openai.openai_rate_limit_path
+    ):
+        logger.info("Sharing OpenAI rate limit budgets across workers via SQLite")
+        os.environ["OPENAI_RATE_LIMIT_PATH"] = SHARED_RATE_LIMIT_PATH
+
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        return None
+    # must start out empty, so that metrics of a previous run are not counted
+    metrics_dir = tempfile.mkdtemp(prefix="prompt_brew_metrics_")
+    os.environ["PROMETHEUS_MULTIPROC_DIR"] = metrics_dir
+    return metrics_dir
+
+
+def main() -> None:
+    """Serve PromptBrew from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=int(os.environ.get("CDSW_APP_PORT", 8081)),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.workers,
+        help="number of worker processes (default: the WORKERS setting)",
+    )
+    args = parser.parse_args()
+
+    metrics_dir = share_state_across_workers() if args.workers > 1 else None
+    try:
+        uvicorn.run(
+            "prompt_brew.main:app",
+            host=args.host,
+            port=args.port,
+            workers=args.workers,
+            # let in-flight LLM calls finish when a worker is replaced or stopped
+            timeout_graceful_shutdown=int(
+                settings.openai.openai_shutdown_grace_period,
+            ),
+        )
+    finally:
+        if metrics_dir is not None:
+            shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""
+Serving of the built web app, compressed and cached by browsers where possible.
+
+Each file is served as the smallest variant written by :mod:`prompt_brew.precompress`
+that the browser accepts. Files named with a content hash are cached for good, any
+other file is revalidated by an ETag of its content, and small files are held in
+memory once requested.
+
+"""
+
+import hashlib
+import os
+import re
+import stat
+import threading
+from email.utils import formatdate
+from mimetypes import guess_type
+from typing import NamedTuple
+
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, PathLike, StaticFiles
+from starlette.types import Scope
+
+from .config import StaticSettings
+from .precompress import VARIANT_SUFFIXES
+
+# preferred content codings first, for browsers that accept several equally
+ENCODINGS = ("br", "gzip", "identity")
+
+
+class _Variant(NamedTuple):
+    """File to serve for one content coding of a static file."""
+
+    path: str
+    stat_result: os.stat_result
+    etag: str
+    body: bytes | None  # if held in memory
+
+
+class _StaticFile(NamedTuple):
+    """Variants of a static file, as of its last modification."""
+
+    mtime_ns: int
+    size: int
+    variants: dict[str, _Variant]  # by content coding
+
+
+def accepted_encodings(accept_encoding: str) -> dict[str, float]:
+    """Parse an ``Accept-Encoding`` header into the quality of each coding.
+
+    Parameters
+    ----------
+    accept_encoding : str
+        Header value, e.g. ``"gzip, deflate, br;q=0.9"``.
+
+    Returns
+    -------
+    dict of str to float
+        Quality from 0 (not acceptable) to 1 by content coding, including
+        ``"identity"`` unless refused, and ``"*"`` if given.
+
+    """
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        name, _, value = params.partition("=")
+        if name.strip().lower() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        qualities[coding] = quality
+    qualities.setdefault("identity", qualities.get("*", 1.0))
+    return qualities
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """Static files served with precompressed variants and cache headers.
+
+    Parameters
+    ----------
+    static_settings : :class:`~prompt_brew.config.StaticSettings`
+        Which files to cache for good, and how much to hold in memory.
+    **kwargs
+        Passed on to :class:`~starlette.staticfiles.StaticFiles`.
+
+    """
+
+    def __init__(self, static_settings: StaticSettings, **kwargs):
+        super().__init__(**kwargs)
+        self.immutable_pattern = re.compile(static_settings.static_immutable_pattern)
+        self.max_age = static_settings.static_max_age
+        self.memory_file_size = static_settings.static_memory_file_size
+        self.memory_max_bytes = static_settings.static_memory_max_bytes
+        self.memory_bytes = 0
+        self.files: dict[str, _StaticFile] = {}
+        self.lock = threading.Lock()
+
+    def lookup_path(self, path: str) -> tuple[str, os.stat_result | None]:
+        """Find the file to serve for `path`, and read it if it changed.
+
+        Run in a worker thread, so that files are read off the event loop.
+
+        """
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+            static_file = self.files.get(full_path)
+            if (
+                static_file is None
+                or static_file.mtime_ns != stat_result.st_mtime_ns
+                or static_file.size != stat_result.st_size
+            ):
+                self._load(full_path, stat_result)
+        return full_path, stat_result
+
+    def file_response(
+        self,
+        full_path: PathLike,
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        """Serve the variant of a file that the request accepts, if modified."""
+        static_file = self.files.get(os.fspath(full_path))
+        if static_file is None:
+            return super().file_response(full_path, stat_result, scope, status_code)
+
+        request_headers = Headers(scope=scope)
+        qualities = accepted_encodings(request_headers.get("accept-encoding", ""))
+        encoding = max(
+            (e for e in ENCODINGS if e in static_file.variants),
+            key=lambda e: qualities.get(e, qualities.get("*", 0.0)),
+        )
+        variant = static_file.variants[encoding]
+
+        relative_path = os.path.relpath(full_path, self.directory).replace(os.sep, "/")
+        if self.immutable_pattern.search(relative_path):
+            cache_control = f"public, max-age={self.max_age}, immutable"
+        else:
+            cache_control = "no-cache"
+        headers = {
+            "cache-control": cache_control,
+            "content-length": str(variant.stat_result.st_size),
+            "etag": variant.etag,
+            "last-modified": formatdate(variant.stat_result.st_mtime, usegmt=True),
+        }
+        if len(static_file.variants) > 1:
+            headers["vary"] = "Accept-Encoding"
+        if encoding != "identity":
+            headers["content-encoding"] = encoding
+
+        if self.is_not_modified(Headers(headers), request_headers):
+            return NotModifiedResponse(Headers(headers))
+        # as FileResponse would guess from the uncompressed file's name
+        media_type = guess_type(full_path)[0] or "text/plain"
+        if variant.body is None:
+            return FileResponse(
+                variant.path,
+                status_code=status_code,
+                headers=headers,
+                media_type=media_type,
+                stat_result=variant.stat_result,
+            )
+        body = b"" if scope["method"] == "HEAD" else variant.body
+        return Response(body, status_code, headers, media_type)
+
+    def _load(self, full_path: str, stat_result: os.stat_result) -> None:
+        """Hash every variant of a file, holding any small enough in memory."""
+        variants = {"identity": self._read(full_path, stat_result)}
+        for encoding, suffix in VARIANT_SUFFIXES.items():
+            try:
+                variant_stat = os.stat(full_path + suffix)
+            except OSError:
+                continue
+            # a variant older than its file was left behind by an earlier build
+            if variant_stat.st_mtime_ns >= stat_result.st_mtime_ns:
+                variants[encoding] = self._read(full_path + suffix, variant_stat)
+
+        with self.lock:
+            replaced = self.files.get(full_path)
+            if replaced is not None:
+                self.memory_bytes -= _memory_size(replaced)
+            static_file = _StaticFile(
+                stat_result.st_mtime_ns, stat_result.st_size, variants
+            )
+            if self.memory_bytes + _memory_size(static_file) > self.memory_max_bytes:
+                static_file = static_file._replace(
+                    variants={
+                        encoding: variant._replace(body=None)
+                        for encoding, variant in variants.items()
+                    }
+                )
+            self.memory_bytes += _memory_size(static_file)
+            self.files[full_path] = static_file
+
+    def _read(self, path: str, stat_result: os.stat_result) -> _Variant:
+        """Hash a file, keeping its contents if it is small enough."""
+        digest = hashlib.sha256()
+        body = None
+        with open(path, "rb") as file:
+            if stat_result.st_size <= self.memory_file_size:
+                body = file.read()
+                digest.update(body)
+            else:
+                for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                    digest.update(chunk)
+        return _Variant(path, stat_result, f'"{digest.hexdigest()[:32]}"', body)
+
+
+def _memory_size(static_file: _StaticFile) -> int:
+    """Bytes of a static file's variants held in memory."""
+    return sum(len(v.body) for v in static_file.variants.values() if v.body)
@@ -0,0 +1,276 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""
+Optional OpenTelemetry tracing for PromptBrew.
+
+Tracing is off unless ``TRACING_EXPORTER`` is set and the ``opentelemetry-sdk``
+package is installed, in which case :meth:`Tracing.span` opens spans around the
+route, each stage of handling it, and each attempt at an LLM call. Otherwise spans
+cost next to nothing.
+
+"""
+
+import contextlib
+import logging
+from collections.abc import Iterator
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .config import TracingSettings, settings
+
+try:
+    from opentelemetry import trace
+    from opentelemetry.sdk.resources import SERVICE_NAME, Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import (
+        BatchSpanProcessor,
+        ConsoleSpanExporter,
+        SpanExporter,
+    )
+except ImportError:  # tracing is optional
+    trace = None
+
+logger = logging.getLogger(__name__)
+
+
+class _NoOpSpan:
+    """Stand-in for a span while tracing is off, which ignores attributes."""
+
+    def set_attribute(self, key: str, value: object) -> None:
+        pass
+
+    def set_attributes(self, attributes: dict[str, object]) -> None:
+        pass
+
+    def update_name(self, name: str) -> None:
+        pass
+
+
+_NO_OP_SPAN = _NoOpSpan()
+
+# what Tracing.span yields, whether or not tracing is on
+Span = _NoOpSpan if trace is None else trace.Span | _NoOpSpan
+
+
+class Tracing:
+    """Exports spans to an OTLP collector or a file, once started.
+
+    Parameters
+    ----------
+    tracing_settings : :class:`~prompt_brew.config.TracingSettings`
+        Where to export spans to.
+
+    """
+
+    def __init__(self, tracing_settings: TracingSettings):
+        self.tracing_settings = tracing_settings
+        self._provider = None
+        self._file = None
+
+    @property
+    def enabled(self) -> bool:
+        """Whether spans are being recorded."""
+        return self._provider is not None
+
+    def start(self) -> None:
+        """Start exporting spans, if an exporter is configured.
+
+        Raises
+        ------
+        ImportError
+            If an exporter is configured but the OpenTelemetry packages it needs are
+            not installed.
+
+        """
+        exporter_name = self.tracing_settings.tracing_exporter
+        if exporter_name == "none" or self.enabled:
+            return
+        if trace is None:
+            raise ImportError(
+                f"TRACING_EXPORTER={exporter_name} requires the opentelemetry-sdk package",
+            )
+        self._provider = TracerProvider(
+            resource=Resource.create(
+                {SERVICE_NAME: self.tracing_settings.tracing_service_name},
+            ),
+        )
+        self._provider.add_span_processor(BatchSpanProcessor(self._build_exporter()))
+        logger.info("Exporting traces via %s", exporter_name)
+
+    def close(self) -> None:
+        """Export any spans still buffered and stop recording spans."""
+        if self._provider is not None:
+            self._provider.shutdown()
+            self._provider = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @contextlib.contextmanager
+    def span(
+        self,
+        name: str,
+        attributes: dict[str, object] | None = None,
+        client: bool = False,
+        current: bool = True,
+    ) -> Iterator[Span]:
+        """Record the enclosed code as a span, a child of the current span if any.
+
+        The span is the current span until the block exits, and records any
+        exception that escapes it.
+
+        Parameters
+        ----------
+        name : str
+            Name of the span, e.g. ``"get_refined_prompt"``.
+        attributes : dict of str to object, optional
+            Attributes to start the span with.
+        client : bool, default False
+            Whether the span is a call to another service, e.g. OpenAI.
+        current : bool, default True
+            Whether the span is the current span, and so the parent of spans opened
+            in the enclosed code. Async generators should pass ``False``, as the
+            current span would otherwise leak to their caller between yields; see
+            :meth:`use` to make it current for part of the enclosed code instead.
+
+        Yields
+        ------
+        :class:`opentelemetry.trace.Span`
+            Span to set further attributes on, which ignores them while tracing is
+            off.
+
+        """
+        if self._provider is None:
+            yield _NO_OP_SPAN
+            return
+        tracer = self._provider.get_tracer(__name__)
+        kind = trace.SpanKind.CLIENT if client else trace.SpanKind.INTERNAL
+        if current:
+            with tracer.start_as_current_span(
+                name,
+                kind=kind,
+                attributes=attributes,
+            ) as span:
+                yield span
+            return
+        span = tracer.start_span(name, kind=kind, attributes=attributes)
+        try:
+            yield span
+        except Exception as e:
+            span.record_exception(e)
+            span.set_status(trace.Status(trace.StatusCode.ERROR, str(e)))
+            raise
+        finally:
+            span.end()
+
+    @contextlib.contextmanager
+    def use(self, span: Span) -> Iterator[None]:
+        """Make `span` the current span in the enclosed code, without ending it.
+
+        Parameters
+        ----------
+        span : :class:`opentelemetry.trace.Span`
+            Span yielded by :meth:`span`.
+
+        """
+        if isinstance(span, _NoOpSpan):
+            yield
+            return
+        with trace.use_span(span):
+            yield
+
+    def _build_exporter(self) -> "SpanExporter":
+        """Return the configured span exporter."""
+        if self.tracing_settings.tracing_exporter == "file":
+            # appended one JSON object per line, so that workers can share the file
+            self._file = open(self.tracing_settings.tracing_file_path, "a")
+            return ConsoleSpanExporter(
+                out=self._file,
+                formatter=lambda span: span.to_json(indent=None) + "\n",
+            )
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+                OTLPSpanExporter,
+            )
+        except ImportError as e:
+            raise ImportError(
+                "TRACING_EXPORTER=otlp requires the "
+                "opentelemetry-exporter-otlp-proto-http package",
+            ) from e
+        return OTLPSpanExporter(endpoint=self.tracing_settings.tracing_otlp_endpoint)
+
+
+class TracingMiddleware:
+    """ASGI middleware that records each HTTP request as a span named by its route.
+
+    Parameters
+    ----------
+    app : ASGI application
+        Application to trace requests to.
+
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not tracing.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        with tracing.span(scope["method"]) as span:
+            span.set_attribute("http.request.method", scope["method"])
+
+            async def send_and_record(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    span.set_attribute("http.response.status_code", message["status"])
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_and_record)
+            finally:
+                route = getattr(scope.get("route"), "path", None)
+                if route is not None:
+                    span.update_name(f"{scope['method']} {route}")
+                    span.set_attribute("http.route", route)
+
+
+tracing = Tracing(settings.tracing)
@@ -0,0 +1,233 @@
+# ###########################################################################
+#
+#  CLOUDERA APPLIED MACHINE LEARNING PROTOTYPE (AMP)
+#  (C) Cloudera, Inc. 2024
+#  All rights reserved.
+#
+#  Applicable Open Source License: Apache 2.0
+#
+#  NOTE: Cloudera open source products are modular software products
+#  made up of hundreds of individual components, each of which was
+#  individually copyrighted.  Each Cloudera open source product is a
+#  collective work under U.S. Copyright Law. Your license to use the
+#  collective work is as provided in your written agreement with
+#  Cloudera.  Used apart from the collective work, this file is
+#  licensed for your use pursuant to the open source license
+#  identified above.
+#
+#  This code is provided to you pursuant a written agreement with
+#  (i) Cloudera, Inc. or (ii) a third-party authorized to distribute
+#  this code. If you do not have a written agreement with Cloudera nor
+#  with an authorized and properly licensed third party, you do not
+#  have any rights to access nor to use this code.
+#
+#  Absent a written agreement with Cloudera, Inc. (“Cloudera”) to the
+#  contrary, A) CLOUDERA PROVIDES THIS CODE TO YOU WITHOUT WARRANTIES OF ANY
+#  KIND; (B) CLOUDERA DISCLAIMS ANY AND ALL EXPRESS AND IMPLIED
+#  WARRANTIES WITH RESPECT TO THIS CODE, INCLUDING BUT NOT LIMITED TO
+#  IMPLIED WARRANTIES OF TITLE, NON-INFRINGEMENT, MERCHANTABILITY AND
+#  FITNESS FOR A PARTICULAR PURPOSE; (C) CLOUDERA IS NOT LIABLE TO YOU,
+#  AND WILL NOT DEFEND, INDEMNIFY, NOR HOLD YOU HARMLESS FOR ANY CLAIMS
+#  ARISING FROM OR RELATED TO THE CODE; AND (D)WITH RESPECT TO YOUR EXERCISE
+#  OF ANY RIGHTS GRANTED TO YOU FOR THE CODE, CLOUDERA IS NOT LIABLE FOR ANY
+#  DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, PUNITIVE OR
+#  CONSEQUENTIAL DAMAGES INCLUDING, BUT NOT LIMITED TO, DAMAGES
+#  RELATED TO LOST REVENUE, LOST PROFITS, LOSS OF INCOME, LOSS OF
+#  BUSINESS ADVANTAGE OR UNAVAILABILITY, OR LOSS OR CORRUPTION OF
+#  DATA.
+#
+# ###########################################################################
+
+"""
+Snapshot of dimensions and refined prompts for the web UI's suggested tasks.
+
+Their first requests are then answered from the snapshot instead of the LLM.
+
+Run from the ``prompt_brew`` directory, with its parent on the import path, e.g. as
+a CML job (see ``tasks/warm_up_suggested_tasks.py``)::
+
+    PYTHONPATH=.. python -m prompt_brew.warmup
+
+The app loads the snapshot at startup. With ``WARMUP_AT_STARTUP=true``, it instead
+makes the snapshot in the background when it is missing or stale, in one worker
+process at a time.
+
+"""
+
+import argparse
+import asyncio
+import fcntl
+import logging
+import sys
+from pathlib import Path
+from typing import IO
+
+from .config import WarmupSettings, settings
+from .routers.autoprompt.clients import clients
+from .routers.autoprompt.dimensions import (
+    get_nomimal_dimensions,
+    get_ordinal_dimensions,
+)
+from .routers.autoprompt.history import history
+from .routers.autoprompt.open_ai import get_refined_prompts
+from .routers.autoprompt.snapshot import (
+    DIMENSION_COUNTS,
+    REFINE_TEMPERATURE,
+    Snapshot,
+    snapshot,
+)
+
+# not __name__, which is "__main__" when run with -m
+logger = logging.getLogger("prompt_brew.warmup")
+
+
+async def make_snapshot(tasks: list[str], refine: bool = True) -> Snapshot:
+    """Generate dimensions, and optionally refined prompts, for each task.
+
+    A task whose dimensions fail to generate is left out of the snapshot, and a
+    prompt style that fails to refine is left out for its task.
+
+    Parameters
+    ----------
+    tasks : list of str
+        Task descriptions, e.g. the suggested tasks of the web UI.
+    refine : bool, default True
+        Whether to also refine each task in every prompt style, with no dimensions
+        or variables selected.
+
+    Returns
+    -------
+    :class:`~prompt_brew.routers.autoprompt.snapshot.Snapshot`
+        Snapshot of the tasks.
+
+    """
+    cat_num_nominal, val_num_nominal, cat_num_ordinal = DIMENSION_COUNTS
+    new_snapshot = Snapshot()
+
+    async def warm_up(task: str) -> None:
+        try:
+            nominal, ordinal = await asyncio.gather(
+                get_nomimal_dimensions(task, cat_num_nominal, val_num_nominal),
+                get_ordinal_dimensions(task, cat_num_ordinal),
+            )
+        except Exception:
+            logger.exception("Failed to generate dimensions for task: %s", task)
+            return
+        refined_prompts = {}
+        if refine:
+            for result in await get_refined_prompts(
+                task,
+                requirements={},
+                input_variables={},
+                temperature=REFINE_TEMPERATURE,
+            ):
+                if result.refined_prompt is not None:
+                    refined_prompts[result.prompt_style] = result.refined_prompt
+        new_snapshot.add(task, nominal, ordinal, refined_prompts)
+        logger.info("Warmed up task: %s", task)
+
+    await asyncio.gather(*map(warm_up, tasks))
+    return new_snapshot
+
+
+def start_warmup(warmup_settings: WarmupSettings) -> asyncio.Task | None:
+    """Load the snapshot, and start making it in the background if needed.
+
+    A snapshot is made if :attr:`~prompt_brew.config.WarmupSettings.warmup_at_startup`
+    is set and the snapshot is missing, stale, or lacks any of the tasks to warm up,
+    unless another process is already making it.
+
+    Parameters
+    ----------
+    warmup_settings : :class:`~prompt_brew.config.WarmupSettings`
+        Tasks to warm up and where to keep their snapshot.
+
+    Returns
+    -------
+    :class:`asyncio.Task` or None
+        Task making the snapshot, which installs it once it is made, if started.
+
+    """
+    loaded = Snapshot.load(warmup_settings.warmup_snapshot_path)
+    if loaded is not None:
+        snapshot.update(loaded)
+        logger.info("Loaded warm-up snapshot of %d tasks", len(loaded))
+        if all(task.strip() in loaded.tasks for task in warmup_settings.warmup_tasks):
+            return None
+    if not warmup_settings.warmup_at_startup:
+        return None
+
+    lock = open(f"{warmup_settings.warmup_snapshot_path}.lock", "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        logger.info("Another process is making the warm-up snapshot")
+        lock.close()
+        return None
+    return asyncio.ensure_future(_warm_up(warmup_settings, lock))
+
+
+async def _warm_up(warmup_settings: WarmupSettings, lock: IO) -> None:
+    """Make, save, and install the snapshot, then release `lock`."""
+    try:
+        logger.info(
+            "Making warm-up snapshot of %d tasks",
+            len(warmup_settings.warmup_tasks),
+        )
+        new_snapshot = await make_snapshot(
+            warmup_settings.warmup_tasks,
+            warmup_settings.warmup_refine,
+        )
+        new_snapshot.save(warmup_settings.warmup_snapshot_path)
+        snapshot.update(new_snapshot)
+    except Exception:
+        logger.exception("Failed to make warm-up snapshot")
+    finally:
+        lock.close()
+
+
+async def _main(tasks: list[str], refine: bool) -> Snapshot:
+    """Make a snapshot of `tasks`, then close the OpenAI clients."""
+    try:
+        return await make_snapshot(tasks, refine)
+    finally:
+        await clients.aclose()
+
+
+def main() -> None:
+    """Make a snapshot from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "tasks",
+        nargs="*",
+        default=settings.warmup.warmup_tasks,
+        help="tasks to warm up (default: the WARMUP_TASKS setting)",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=Path(settings.warmup.warmup_snapshot_path),
+        help="file to save the snapshot to (default: the WARMUP_SNAPSHOT_PATH setting)",
+    )
+    parser.add_argument(
+        "--skip-refine",
+        action="store_true",
+        default=not settings.warmup.warmup_refine,
+        help="only generate dimensions, not refined prompts",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    history.open()
+    try:
+        new_snapshot = asyncio.run(_main(args.tasks, not args.skip_refine))
+    finally:
+        history.close()
+    new_snapshot.save(args.output)
+    logger.info("Saved snapshot of %d tasks to %s", len(new_snapshot), args.output)
+    if len(new_snapshot) < len(set(args.tasks)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
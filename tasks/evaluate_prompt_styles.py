@@ -0,0 +1,20 @@
+import shlex
+import subprocess
+import sys
+
+# job arguments are passed on, e.g.
+# --tasks data/tasks.txt --variables data/rows.csv --output data/results.csv
+# without any, the suggested tasks are evaluated into prompt_brew_evaluation.csv
+print(
+    subprocess.run(
+        [
+            f"bash /home/cdsw/tasks/scripts/evaluate_prompt_styles.sh {shlex.join(sys.argv[1:])}"
+        ],
+        shell=True,
+        check=True,
+    )
+)
+
+print(
+    "Evaluation complete. Results are in the --output file, by default prompt_brew_evaluation.csv."
+)
@@ -0,0 +1,7 @@
+#!/usr/bin/bash
+set -eox pipefail
+
+# saving results as Parquet also requires pyarrow, which is not installed here
+python -m pip install -r prompt_brew/requirements.txt
+
+python -m prompt_brew.evaluate "$@"
@@ -23,3 +23,8 @@ cd FeApp
 npm install
 npm run build
 
+# gzip and brotli variants of the web app, served to browsers that accept them
+cd ..
+python -m pip install -r prompt_brew/requirements.txt brotli
+python -m prompt_brew.precompress FeApp/dist
+
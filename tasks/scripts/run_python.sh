@@ -4,4 +4,5 @@ set -eox pipefail
 cd prompt_brew
 python -m pip install -r requirements.txt
 
-fastapi run --host 127.0.0.1 --port ${CDSW_APP_PORT-8081}
+# WORKERS sets the number of server processes; send SIGHUP to reload them
+PYTHONPATH=.. python -m prompt_brew.serve --host 127.0.0.1 --port ${CDSW_APP_PORT-8081}
@@ -0,0 +1,8 @@
+#!/usr/bin/bash
+set -eox pipefail
+
+python -m pip install -r prompt_brew/requirements.txt
+
+# the application runs from prompt_brew, where it looks for the snapshot
+cd prompt_brew
+PYTHONPATH=.. python -m prompt_brew.warmup "$@"
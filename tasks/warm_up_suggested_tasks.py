@@ -0,0 +1,16 @@
+import shlex
+import subprocess
+import sys
+
+# job arguments are passed on, e.g. --skip-refine "Summarize a support ticket"
+print(
+    subprocess.run(
+        [
+            f"bash /home/cdsw/tasks/scripts/warm_up_suggested_tasks.sh {shlex.join(sys.argv[1:])}"
+        ],
+        shell=True,
+        check=True,
+    )
+)
+
+print("Warm-up complete. Restart the PromptBrew application to load the snapshot.")
@@ -0,0 +1,4 @@
+import os
+
+# settings are read at import time, and no test calls OpenAI
+os.environ.setdefault("OPENAI_API_KEY", "test")
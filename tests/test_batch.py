@@ -0,0 +1,117 @@
+"""Tests for testing a prompt against rows of sample data."""
+
+import io
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from prompt_brew.routers import autoprompt
+from prompt_brew.routers.autoprompt import batch
+from prompt_brew.routers.autoprompt.batch import ROWS_PER_READ, parse_rows
+
+
+def parse(content: bytes, filename: str, max_rows: int = 10) -> list[dict[str, str]]:
+    return list(parse_rows(io.BytesIO(content), filename, max_rows))
+
+
+def test_csv_rows_are_parsed():
+    content = '\ufefftopic,tone\nbees,formal\n"ants, mostly",\n'.encode()
+    assert parse(content, "rows.csv") == [
+        {"topic": "bees", "tone": "formal"},
+        {"topic": "ants, mostly", "tone": ""},
+    ]
+
+
+def test_json_lines_rows_are_parsed():
+    content = b'{"topic": "bees", "count": 3}\n\n{"topic": null}\n'
+    assert parse(content, "rows.JSONL") == [
+        {"topic": "bees", "count": "3"},
+        {"topic": ""},
+    ]
+
+
+def test_json_lines_row_that_is_not_an_object_is_invalid():
+    rows = parse_rows(io.BytesIO(b'{"topic": "bees"}\n["ants"]\n'), "rows.ndjson", 10)
+    assert next(rows) == {"topic": "bees"}
+    with pytest.raises(ValueError, match="line 2 is not a JSON object"):
+        next(rows)
+
+
+def test_json_lines_row_that_is_not_json_is_invalid():
+    with pytest.raises(ValueError, match="line 1 is not valid JSON"):
+        parse(b"{topic: bees}\n", "rows.jsonl")
+
+
+def test_rows_beyond_the_most_allowed_are_invalid():
+    with pytest.raises(ValueError, match="more than 2 rows"):
+        parse(b"topic\na\nb\nc\n", "rows.csv", max_rows=2)
+
+
+def test_file_that_is_not_utf8_is_invalid():
+    with pytest.raises(UnicodeDecodeError):
+        parse("topic\ncafé\n".encode("latin-1"), "rows.csv")
+
+
+@pytest.fixture
+def client(monkeypatch) -> TestClient:
+    async def run_prompt(prompt, template=None, input_variables=None, priority=None):
+        if "fail" in prompt:
+            raise RuntimeError("model failed")
+        return prompt.upper()
+
+    monkeypatch.setattr(batch, "run_prompt", run_prompt)
+    app = FastAPI()
+    app.include_router(autoprompt.router)
+    return TestClient(app)
+
+
+def upload(client: TestClient, content: bytes, filename: str) -> list[dict]:
+    response = client.post(
+        "/promptbrew/test-prompt/batch/upload",
+        data={"prompt": "about {{ topic }}"},
+        files={"file": (filename, content)},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    results = [json.loads(line) for line in response.text.splitlines()]
+    return sorted(results, key=lambda result: result["row"])
+
+
+def test_upload_streams_a_result_per_row(client):
+    results = upload(client, b"topic\nbees\nfail\n", "rows.csv")
+    assert [result["row"] for result in results] == [0, 1]
+    assert results[0]["output"] == "ABOUT BEES"
+    assert results[0]["error"] is None
+    assert results[1]["output"] is None
+    assert results[1]["error"] == "model failed"
+
+
+def test_upload_reports_a_later_invalid_row_as_last_result(client):
+    content = b'{"topic": "bees"}\n' * ROWS_PER_READ + b"not json\n"
+    results = upload(client, content, "rows.jsonl")
+    assert len(results) == ROWS_PER_READ + 1
+    assert all(result["error"] is None for result in results[:-1])
+    assert results[-1]["row"] == ROWS_PER_READ
+    assert "is not valid JSON" in results[-1]["error"]
+
+
+def test_upload_with_an_early_invalid_row_fails(client):
+    response = client.post(
+        "/promptbrew/test-prompt/batch/upload",
+        data={"prompt": "about {{ topic }}"},
+        files={"file": ("rows.jsonl", b"not json\n")},
+    )
+    assert response.status_code == 400
+    assert "line 1" in response.json()["detail"]
+
+
+def test_upload_beyond_the_size_limit_is_rejected(client, monkeypatch):
+    monkeypatch.setattr(autoprompt.settings, "batch_max_upload_bytes", 8)
+    response = client.post(
+        "/promptbrew/test-prompt/batch/upload",
+        data={"prompt": "about {{ topic }}"},
+        files={"file": ("rows.csv", b"topic\nbees\nants\n")},
+    )
+    assert response.status_code == 413
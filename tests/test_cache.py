@@ -0,0 +1,55 @@
+"""Tests for the in-process and SQLite caches of LLM responses."""
+
+import asyncio
+import time
+
+from prompt_brew.routers.autoprompt.cache import MemoryCache, SQLiteCache
+
+
+def test_memory_cache_evicts_least_recently_used():
+    cache = MemoryCache(max_entries=2, ttl=60)
+    cache.set("a", "first")
+    cache.set("b", "second")
+    assert cache.get("a") == "first"
+    cache.set("c", "third")
+    assert cache.get("b") is None
+    assert cache.get("a") == "first"
+    assert cache.get("c") == "third"
+    assert len(cache) == 2
+
+
+def test_memory_cache_expires_responses():
+    cache = MemoryCache(max_entries=2, ttl=0.05)
+    cache.set("a", "first")
+    assert cache.get("a") == "first"
+    time.sleep(0.1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+
+
+def test_lookups_are_counted_without_writing(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    cache = SQLiteCache(path, max_entries=10, ttl=60)
+    cache.set("a", "response")
+    total_changes = cache._connection.total_changes
+    assert cache.get("a") == "response"
+    assert cache.get("b") is None
+    assert cache._connection.total_changes == total_changes
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+    cache.close()
+
+    reopened = SQLiteCache(path, max_entries=10, ttl=60)
+    assert (reopened.stats.hits, reopened.stats.misses) == (1, 1)
+    reopened.close()
+
+
+def test_hits_keep_responses_from_eviction(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite3"), max_entries=2, ttl=60)
+    cache.set("a", "first")
+    cache.set("b", "second")
+    assert asyncio.run(cache.aget("a")) == "first"
+    asyncio.run(cache.aset("c", "third"))
+    assert cache.get("a") == "first"
+    assert cache.get("b") is None
+    cache.close()
@@ -0,0 +1,127 @@
+"""Tests for lenient parsing of the dimensions listed by an LLM."""
+
+import asyncio
+
+import pytest
+
+from prompt_brew.routers.autoprompt import dimensions
+from prompt_brew.routers.autoprompt.dimension_parser import (
+    DimensionsParser,
+    InvalidDimensionsError,
+    parse_dimensions,
+)
+
+TONE = {"Tone": ["formal", "casual"]}
+
+
+def test_code_fences_are_ignored():
+    response = '```json\n{"Tone": ["formal", "casual"]}\n```'
+    assert parse_dimensions(response, 1, 2) == TONE
+
+
+def test_trailing_commas_are_tolerated():
+    response = '{"Tone": ["formal", "casual",], "Length": ["short", "long",],}'
+    assert parse_dimensions(response, 2, 2) == TONE | {"Length": ["short", "long"]}
+
+
+def test_prose_before_the_object_is_ignored():
+    response = 'Here are the dimensions you asked for: {"Tone": ["formal", "casual"]}'
+    assert parse_dimensions(response, 1, 2) == TONE
+
+
+def test_object_under_a_wrapper_key_is_parsed():
+    response = '{"dimensions": {"Tone": ["formal", "casual"]}}'
+    assert parse_dimensions(response, 1, 2) == TONE
+
+
+def test_truncated_response_keeps_completed_dimensions():
+    response = '{"Tone": ["formal", "casual"], "Length": ["sho'
+    assert parse_dimensions(response, 2, 2) == TONE
+
+
+def test_surplus_values_are_dropped():
+    response = '{"Tone": ["formal", "casual", "playful"]}'
+    assert parse_dimensions(response, 1, 2) == TONE
+
+
+def test_missing_values_are_tolerated():
+    response = '{"Tone": ["formal"], "Length": []}'
+    assert parse_dimensions(response, 2, 2) == {"Tone": ["formal"]}
+
+
+def test_response_without_dimensions_is_invalid():
+    with pytest.raises(InvalidDimensionsError):
+        parse_dimensions("Sorry, I can't help with that.", 1, 2)
+
+
+def test_dimensions_are_completed_as_they_arrive():
+    parser = DimensionsParser(2, 2)
+    assert parser.feed('{"Tone": ["formal", "cas') == []
+    assert parser.feed('ual"], "Len') == [("Tone", ["formal", "casual"])]
+    assert not parser.has_surplus
+    assert parser.feed('gth": ["short", "long"]}') == [("Length", ["short", "long"])]
+    assert parser.close() == TONE | {"Length": ["short", "long"]}
+
+
+def test_surplus_dimension_is_noticed_once_begun():
+    parser = DimensionsParser(1, 2)
+    parser.feed('{"Tone": ["formal", "casual"], ')
+    assert not parser.has_surplus
+    parser.feed('"Len')
+    assert parser.has_surplus
+    assert parser.feed('gth": ["short", "long"]}') == []
+    assert parser.close() == TONE
+
+
+def stream_responses(monkeypatch, *responses: list[str]) -> list[int]:
+    """Make the LLM stream `responses` in turn; return the chunks read of each."""
+    reads = []
+
+    async def astream_open_ai(**kwargs):
+        chunks = responses[len(reads)]
+        reads.append(0)
+        for chunk in chunks:
+            reads[-1] += 1
+            yield chunk
+        kwargs["validate"]("".join(chunks))
+
+    monkeypatch.setattr(dimensions, "astream_open_ai", astream_open_ai)
+    return reads
+
+
+async def collect(**kwargs) -> list[tuple[str, list[str]]]:
+    return [
+        dimension
+        async for dimension in dimensions.stream_nominal_dimensions(
+            "Write a poem",
+            use_cache=False,
+            **kwargs,
+        )
+    ]
+
+
+def test_stream_stops_at_surplus_dimension(monkeypatch):
+    reads = stream_responses(
+        monkeypatch,
+        ['{"Tone": ["formal", "casual"],', ' "Length": ', '["short"]}'],
+    )
+    streamed = asyncio.run(collect(cat_num=1, val_num=2))
+    assert streamed == [("Tone", ["formal", "casual"])]
+    assert reads == [2]
+
+
+def test_stream_asks_again_if_no_dimensions_are_listed(monkeypatch):
+    reads = stream_responses(
+        monkeypatch,
+        ["I cannot do that."],
+        ['{"Tone": ["formal", "casual"]}'],
+    )
+    streamed = asyncio.run(collect(cat_num=1, val_num=2))
+    assert streamed == [("Tone", ["formal", "casual"])]
+    assert reads == [1, 1]
+
+
+def test_stream_fails_if_asking_again_lists_no_dimensions(monkeypatch):
+    stream_responses(monkeypatch, ["No."], ["Still no."])
+    with pytest.raises(InvalidDimensionsError):
+        asyncio.run(collect(cat_num=1, val_num=2))
@@ -0,0 +1,155 @@
+"""Tests for resuming an offline evaluation of prompt styles from its checkpoint."""
+
+import argparse
+import asyncio
+import csv
+import json
+
+import pytest
+
+from prompt_brew import evaluate
+from prompt_brew.evaluate import Checkpoint, EvaluationTask, fingerprint
+from prompt_brew.routers.autoprompt.open_ai import RefinedPromptResult
+from prompt_brew.routers.autoprompt.prompts import PromptStyle
+
+TASKS = [EvaluationTask("Write a poem")]
+ROWS = [{"topic": "bees"}, {"topic": "ants"}]
+STYLES = [PromptStyle.SIMPLE]
+FINGERPRINT = fingerprint(TASKS, ROWS, STYLES)
+
+
+def cell(row: int, error: str | None = None) -> dict:
+    return {
+        "task_index": 0,
+        "prompt_style": PromptStyle.SIMPLE.value,
+        "row": row,
+        "output": None if error else "a poem",
+        "error": error,
+    }
+
+
+def test_checkpoint_is_reloaded(tmp_path):
+    path = tmp_path / "checkpoint.jsonl"
+    checkpoint = Checkpoint(path, FINGERPRINT)
+    checkpoint.add_refinement(
+        {
+            "task_index": 0,
+            "prompt_style": PromptStyle.SIMPLE.value,
+            "refined_prompt": "about {{ topic }}",
+            "error": None,
+        },
+    )
+    checkpoint.add_cell(cell(0))
+    checkpoint.add_cell(cell(1, error="timed out"))
+    checkpoint.close()
+
+    reloaded = Checkpoint(path, FINGERPRINT)
+    reloaded.close()
+    assert reloaded.refined_prompt(0, PromptStyle.SIMPLE) == "about {{ topic }}"
+    assert reloaded.is_done(0, PromptStyle.SIMPLE, 0)
+    assert not reloaded.is_done(0, PromptStyle.SIMPLE, 1)  # failed, so retried
+
+
+def test_failed_refinement_is_not_reloaded(tmp_path):
+    path = tmp_path / "checkpoint.jsonl"
+    checkpoint = Checkpoint(path, FINGERPRINT)
+    checkpoint.add_refinement(
+        {
+            "task_index": 0,
+            "prompt_style": PromptStyle.SIMPLE.value,
+            "refined_prompt": None,
+            "error": "rate limited",
+        },
+    )
+    checkpoint.close()
+
+    reloaded = Checkpoint(path, FINGERPRINT)
+    reloaded.close()
+    assert reloaded.refined_prompt(0, PromptStyle.SIMPLE) is None
+
+
+def test_checkpoint_cut_off_mid_line_is_reloaded(tmp_path):
+    path = tmp_path / "checkpoint.jsonl"
+    checkpoint = Checkpoint(path, FINGERPRINT)
+    checkpoint.add_cell(cell(0))
+    checkpoint.close()
+    with path.open("a", encoding="utf-8") as file:
+        file.write(json.dumps({"type": "cell", **cell(1)})[:20])
+
+    reloaded = Checkpoint(path, FINGERPRINT)
+    reloaded.close()
+    assert reloaded.is_done(0, PromptStyle.SIMPLE, 0)
+    assert not reloaded.is_done(0, PromptStyle.SIMPLE, 1)
+
+
+def test_checkpoint_of_other_inputs_is_refused(tmp_path):
+    path = tmp_path / "checkpoint.jsonl"
+    Checkpoint(path, FINGERPRINT).close()
+    other = fingerprint(TASKS, ROWS[:1], STYLES)
+    assert other != FINGERPRINT
+    with pytest.raises(ValueError, match="different inputs"):
+        Checkpoint(path, other)
+
+
+@pytest.fixture
+def llm(monkeypatch) -> dict[str, list]:
+    """Fake the LLM calls of an evaluation; return the calls made and to fail."""
+    calls = {"refine": [], "run": [], "fail": []}
+
+    async def get_refined_prompts(prompt, requirements, input_variables, prompt_styles):
+        calls["refine"].append(prompt)
+        return [
+            RefinedPromptResult(style, "about {{ topic }}", None, 0.0)
+            for style in prompt_styles
+        ]
+
+    async def run_prompt(prompt, template=None, input_variables=None, priority=None):
+        calls["run"].append(prompt)
+        if prompt in calls["fail"]:
+            raise RuntimeError("model failed")
+        return prompt.upper()
+
+    monkeypatch.setattr(evaluate, "get_refined_prompts", get_refined_prompts)
+    monkeypatch.setattr(evaluate, "run_prompt", run_prompt)
+    return calls
+
+
+def run(tmp_path, tasks=None) -> int:
+    variables = tmp_path / "rows.csv"
+    variables.write_text("topic\nbees\nants\n", encoding="utf-8")
+    args = argparse.Namespace(
+        tasks=tasks,
+        variables=variables,
+        output=tmp_path / "results.csv",
+        checkpoint=None,
+        restart=False,
+        styles=STYLES,
+        concurrency=2,
+    )
+    return asyncio.run(evaluate._main(args))
+
+
+def test_rerun_retries_only_failed_cells(tmp_path, llm):
+    tasks = tmp_path / "tasks.txt"
+    tasks.write_text("Write a poem\n", encoding="utf-8")
+    llm["fail"].append("about ants")
+    assert run(tmp_path, tasks) == 1
+    assert (tmp_path / "results.csv.checkpoint.jsonl").exists()
+
+    llm["fail"].clear()
+    llm["refine"].clear()
+    llm["run"].clear()
+    assert run(tmp_path, tasks) == 0
+    assert llm["refine"] == []
+    assert llm["run"] == ["about ants"]
+    assert not (tmp_path / "results.csv.checkpoint.jsonl").exists()
+    with (tmp_path / "results.csv").open(encoding="utf-8", newline="") as file:
+        results = list(csv.DictReader(file))
+    assert [result["output"] for result in results] == ["ABOUT BEES", "ABOUT ANTS"]
+    assert [result["error"] for result in results] == ["", ""]
+
+
+def test_suggested_tasks_are_evaluated_by_default(tmp_path, llm, monkeypatch):
+    monkeypatch.setattr(evaluate.settings.warmup, "warmup_tasks", ["Write a poem"])
+    assert run(tmp_path) == 0
+    assert llm["refine"] == ["Write a poem"]
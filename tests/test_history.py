@@ -0,0 +1,130 @@
+"""Tests for the prompt run history and its batched writer."""
+
+import time
+
+import pytest
+
+from prompt_brew.config import HistorySettings
+from prompt_brew.routers.autoprompt.history import (
+    HistoryStore,
+    PromptRun,
+    build_history,
+    parse_cursor,
+    task_hash,
+)
+
+
+def make_store(tmp_path, **kwargs) -> HistoryStore:
+    store = HistoryStore(str(tmp_path / "history.sqlite3"), **kwargs)
+    store.open()
+    return store
+
+
+def test_nothing_is_recorded_by_default(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = build_history(HistorySettings())
+    store.open()
+    store.record(PromptRun("test", "Write a poem"))
+    store.close()
+    assert not store.enabled
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_database_is_created_when_opened(tmp_path):
+    store = HistoryStore(str(tmp_path / "history.sqlite3"))
+    assert not (tmp_path / "history.sqlite3").exists()
+    store.record(PromptRun("test", "Write a poem"))  # not open yet, so ignored
+    store.open()
+    assert (tmp_path / "history.sqlite3").exists()
+    assert store.list_runs() == []
+    store.close()
+
+
+def test_runs_are_written_on_close(tmp_path):
+    store = make_store(tmp_path, flush_interval=60)
+    store.record(PromptRun("refine", "Write a poem", style="SIMPLE", model="m"))
+    store.record(PromptRun("test", "Write a poem", input_variables={"a": "b"}))
+    store.close()
+
+    reopened = make_store(tmp_path)
+    runs = reopened.list_runs()
+    assert [run.kind for run in runs] == ["test", "refine"]
+    assert runs[0].input_variables == {"a": "b"}
+    assert reopened.get_run(runs[1].id) == runs[1]
+    assert reopened.get_run(runs[0].id + 1) is None
+    reopened.close()
+
+
+def test_full_batch_is_written_without_waiting(tmp_path):
+    store = make_store(tmp_path, batch_size=2, flush_interval=60)
+    store.record(PromptRun("test", "one"))
+    store.record(PromptRun("test", "two"))
+    deadline = time.monotonic() + 5
+    while len(store.list_runs()) < 2:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    store.close()
+
+
+def test_runs_are_filtered_and_paged(tmp_path):
+    store = make_store(tmp_path)
+    for index in range(5):
+        store.record(
+            PromptRun(
+                "refine",
+                "poem" if index % 2 else "email",
+                style="SIMPLE",
+                created_at=float(index),
+            ),
+        )
+    store.close()
+
+    reopened = make_store(tmp_path)
+    poems = reopened.list_runs(task_hash=task_hash("poem"))
+    assert [run.created_at for run in poems] == [3.0, 1.0]
+    first_page = reopened.list_runs(limit=2)
+    second_page = reopened.list_runs(before=parse_cursor(first_page[-1].cursor))
+    assert [run.created_at for run in first_page + second_page] == [
+        4.0,
+        3.0,
+        2.0,
+        1.0,
+        0.0,
+    ]
+    assert reopened.list_runs(kind="test") == []
+    reopened.close()
+
+
+def test_oldest_runs_beyond_the_most_to_keep_are_deleted(tmp_path):
+    store = make_store(tmp_path, max_runs=3)
+    for index in range(5):
+        store.record(PromptRun("test", f"prompt {index}", created_at=time.time()))
+    store.close()
+
+    reopened = make_store(tmp_path)
+    assert [run.prompt for run in reopened.list_runs()] == [
+        "prompt 4",
+        "prompt 3",
+        "prompt 2",
+    ]
+    reopened.close()
+
+
+def test_expired_runs_are_deleted(tmp_path):
+    store = make_store(tmp_path, ttl=60)
+    store.record(PromptRun("test", "old", created_at=time.time() - 120))
+    store.record(PromptRun("test", "new"))
+    store.close()
+
+    reopened = make_store(tmp_path)
+    assert [run.prompt for run in reopened.list_runs()] == ["new"]
+    reopened.close()
+
+
+def test_recording_notes_errors(tmp_path):
+    store = make_store(tmp_path)
+    with pytest.raises(ValueError), store.recording(PromptRun("test", "x")) as run:
+        raise ValueError("bad template")
+    store.close()
+    assert run.error == "bad template"
+    assert run.latency_seconds > 0
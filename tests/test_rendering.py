@@ -0,0 +1,32 @@
+"""Tests for the time limit on rendering prompt templates."""
+
+import time
+
+import pytest
+
+from prompt_brew.config import TemplateSettings
+from prompt_brew.routers.autoprompt.rendering import PromptRenderer, PromptRenderError
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        '{% for x in "a"*20000 %}{% for y in "a"*20000 %}{% endfor %}{% endfor %}',
+        "{% macro f(n) %}{% if n %}{{ f(n-1) }}{{ f(n-1) }}{% endif %}{% endmacro %}"
+        "{{ f(40) }}",
+    ],
+    ids=["nested loops", "recursive macro"],
+)
+def test_render_without_output_stops_at_deadline(source):
+    renderer = PromptRenderer(TemplateSettings(template_render_timeout=0.2))
+    start = time.monotonic()
+    with pytest.raises(PromptRenderError):
+        renderer.render(source, {})
+    assert time.monotonic() - start < 1
+
+
+def test_render_within_deadline():
+    renderer = PromptRenderer(TemplateSettings(template_render_timeout=0.2))
+    source = "{% for item in items %}{{ item.name }}{{ loop.index }} {% endfor %}"
+    items = [{"name": "a"}, {"name": "b"}]
+    assert renderer.render(source, {"items": items}) == "a1 b2 "
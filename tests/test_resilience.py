@@ -0,0 +1,136 @@
+"""Tests for retries and circuit breaking of OpenAI calls."""
+
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+
+from prompt_brew.config import ResilienceSettings
+from prompt_brew.routers.autoprompt.resilience import (
+    CircuitOpenError,
+    Resilience,
+    deadline,
+)
+
+MODEL = "gpt-test"
+
+
+def make_resilience() -> Resilience:
+    return Resilience(
+        ResilienceSettings(
+            circuit_failure_threshold=1,
+            circuit_reset_timeout=0.05,
+            retry_max_attempts=1,
+        )
+    )
+
+
+async def fail() -> str:
+    request = httpx.Request("POST", "http://openai.test/v1/chat/completions")
+    raise openai.InternalServerError(
+        "upstream failure",
+        response=httpx.Response(500, request=request),
+        body=None,
+    )
+
+
+async def succeed() -> str:
+    return "ok"
+
+
+async def hang() -> str:
+    await asyncio.sleep(10)
+    return "too late"
+
+
+async def open_circuit(resilience: Resilience) -> None:
+    """Open the circuit, then wait until it lets a trial call through."""
+    with pytest.raises(openai.InternalServerError):
+        await resilience.acall(MODEL, fail, hedge=False)
+    assert resilience.breaker(MODEL).is_open
+    await asyncio.sleep(0.06)
+
+
+def test_timed_out_trial_lets_next_call_through():
+    async def main():
+        resilience = make_resilience()
+        await open_circuit(resilience)
+        with deadline(0.05), pytest.raises(asyncio.TimeoutError):
+            await resilience.acall(MODEL, hang, hedge=False)
+        assert await resilience.acall(MODEL, succeed, hedge=False) == "ok"
+        assert not resilience.breaker(MODEL).is_open
+
+    asyncio.run(main())
+
+
+def test_cancelled_trial_lets_next_call_through():
+    async def main():
+        resilience = make_resilience()
+        await open_circuit(resilience)
+        trial = asyncio.ensure_future(resilience.acall(MODEL, hang, hedge=False))
+        await asyncio.sleep(0.01)
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+        assert await resilience.acall(MODEL, succeed, hedge=False) == "ok"
+        assert not resilience.breaker(MODEL).is_open
+
+    asyncio.run(main())
+
+
+def test_failed_trial_keeps_circuit_open():
+    async def main():
+        resilience = make_resilience()
+        await open_circuit(resilience)
+        with pytest.raises(openai.InternalServerError):
+            await resilience.acall(MODEL, fail, hedge=False)
+        with pytest.raises(CircuitOpenError):
+            await resilience.acall(MODEL, succeed, hedge=False)
+
+    asyncio.run(main())
+
+
+def rate_limit_error(retry_after: str) -> openai.RateLimitError:
+    request = httpx.Request("POST", "http://openai.test/v1/chat/completions")
+    return openai.RateLimitError(
+        "rate limited",
+        response=httpx.Response(
+            429,
+            headers={"retry-after": retry_after},
+            request=request,
+        ),
+        body=None,
+    )
+
+
+def retrying_resilience() -> Resilience:
+    return Resilience(
+        ResilienceSettings(retry_max_attempts=2, retry_backoff_max=1.0),
+    )
+
+
+def test_retry_after_within_backoff_max_is_waited_for():
+    calls = []
+
+    def attempt() -> str:
+        calls.append(time.monotonic())
+        if len(calls) == 1:
+            raise rate_limit_error("0.1")
+        return "ok"
+
+    assert retrying_resilience().call(MODEL, attempt) == "ok"
+    assert calls[1] - calls[0] >= 0.1
+
+
+def test_retry_after_beyond_backoff_max_is_not_waited_for():
+    calls = []
+
+    def attempt() -> str:
+        calls.append(time.monotonic())
+        raise rate_limit_error("3600")
+
+    with pytest.raises(openai.RateLimitError):
+        retrying_resilience().call(MODEL, attempt)
+    assert len(calls) == 1
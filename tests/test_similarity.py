@@ -0,0 +1,86 @@
+"""Tests for reusing values cached for near-duplicate task descriptions."""
+
+import pytest
+
+from prompt_brew.config import CacheSettings
+from prompt_brew.routers.autoprompt.similarity import (
+    SimilarityIndex,
+    build_similarity_index,
+    is_spelling_variant,
+)
+
+EMAIL = "Write a {} email to a customer apologizing for a delayed shipment"
+REPORT = (
+    "Summarize the quarterly sales report for the regional managers in {} and"
+    " highlight the three products whose revenue grew the most"
+)
+
+
+def make_index() -> SimilarityIndex:
+    return SimilarityIndex(threshold=0.95, max_entries=10, ttl=60)
+
+
+@pytest.mark.parametrize(
+    "cached, looked_up",
+    [
+        ("Write catchy LinkedIn posts", "write catchy linkedin posts for me"),
+        ("Create an email from a set of notes", "Create emails from sets of notes!"),
+        (REPORT.format("Germany"), REPORT.format("Germany").replace("ize", "ise")),
+        ("Write catchy LinkedIn posts", "Write catchy LinkdIn posts"),
+    ],
+)
+def test_near_duplicate_task_hits(cached, looked_up):
+    index = make_index()
+    index.set(cached, "dimensions")
+    match = index.get(looked_up)
+    assert match is not None and match.value == "dimensions"
+
+
+@pytest.mark.parametrize(
+    "cached, looked_up",
+    [
+        (EMAIL.format("formal"), EMAIL.format("informal")),
+        (REPORT.format("Germany"), REPORT.format("France")),
+        ("Translate English text to French", "Translate French text to English"),
+        ("Write a formal email", "Write a normal email"),
+        ("Write catchy LinkedIn posts", "Write catchy LinkedIn posts and tweets"),
+    ],
+    ids=[
+        "changed adjective",
+        "changed entity",
+        "changed word order",
+        "changed first letter",
+        "added word",
+    ],
+)
+def test_task_with_another_meaning_misses(cached, looked_up):
+    index = make_index()
+    index.set(cached, "dimensions")
+    assert index.get(looked_up) is None
+
+
+@pytest.mark.parametrize(
+    "a, b, expected",
+    [
+        ("summarize", "summarise", True),
+        ("linkedin", "linkdin", True),
+        ("colour", "color", True),
+        ("formal", "informal", False),
+        ("formal", "normal", False),
+        ("sort", "port", False),
+        ("summarize", "summarizing", False),
+    ],
+)
+def test_spelling_variants(a, b, expected):
+    assert is_spelling_variant(a, b) is expected
+    assert is_spelling_variant(b, a) is expected
+
+
+def test_values_are_only_reused_within_their_scope():
+    index = make_index()
+    index.set("Write catchy LinkedIn posts", "dimensions", scope=(5, 5, 5))
+    assert index.get("Write catchy LinkedIn posts", scope=(3, 3, 3)) is None
+
+
+def test_similarity_cache_is_off_by_default():
+    assert build_similarity_index(CacheSettings()) is None
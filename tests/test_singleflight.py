@@ -0,0 +1,85 @@
+"""Tests for coalescing identical concurrent calls."""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from prompt_brew.routers.autoprompt.singleflight import SingleFlight
+
+
+def test_concurrent_async_calls_share_one_call():
+    calls = []
+
+    async def call() -> str:
+        calls.append(None)
+        await asyncio.sleep(0.05)
+        return "response"
+
+    async def main():
+        flights = SingleFlight()
+        results = await asyncio.gather(*(flights.ado("key", call) for _ in range(3)))
+        assert results == ["response"] * 3
+        assert flights.coalesced == 2
+        # once finished, an identical call runs again
+        assert await flights.ado("key", call) == "response"
+
+    asyncio.run(main())
+    assert len(calls) == 2
+
+
+def test_async_calls_with_different_keys_are_not_shared():
+    async def main():
+        flights = SingleFlight()
+        results = await asyncio.gather(
+            flights.ado("a", lambda: asyncio.sleep(0.01, "a")),
+            flights.ado("b", lambda: asyncio.sleep(0.01, "b")),
+        )
+        assert results == ["a", "b"]
+        assert flights.coalesced == 0
+
+    asyncio.run(main())
+
+
+def test_cancelled_async_waiter_does_not_cancel_the_others():
+    async def main():
+        flights = SingleFlight()
+        first = asyncio.ensure_future(
+            flights.ado("key", lambda: asyncio.sleep(0.05, "response")),
+        )
+        second = asyncio.ensure_future(
+            flights.ado("key", lambda: asyncio.sleep(0.05, "other")),
+        )
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == "response"
+
+    asyncio.run(main())
+
+
+def test_concurrent_sync_calls_share_one_call_and_its_error():
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def call() -> str:
+        calls.append(None)
+        started.set()
+        release.wait(5)
+        raise ValueError("upstream failure")
+
+    flights = SingleFlight()
+    with ThreadPoolExecutor(3) as executor:
+        leader = executor.submit(flights.do, "key", call)
+        started.wait(5)
+        waiters = [executor.submit(flights.do, "key", call) for _ in range(2)]
+        while flights.coalesced < 2:
+            time.sleep(0.001)
+        release.set()
+        for future in [leader, *waiters]:
+            with pytest.raises(ValueError, match="upstream failure"):
+                future.result()
+    assert len(calls) == 1
+    assert flights.do("key", lambda: "response") == "response"
@@ -0,0 +1,68 @@
+"""Tests for streaming LLM responses as Server-Sent Events."""
+
+import asyncio
+from typing import NamedTuple
+
+import pytest
+
+from prompt_brew.routers.autoprompt.streaming import open_event_stream
+
+
+class Piece(NamedTuple):
+    name: str
+
+
+async def read_events(response) -> list[str]:
+    return [event async for event in response.body_iterator]
+
+
+def test_slow_first_chunk_times_out():
+    closed = []
+
+    async def chunks():
+        try:
+            await asyncio.sleep(10)
+            yield "too late"
+        finally:
+            closed.append(True)
+
+    async def main():
+        with pytest.raises(asyncio.TimeoutError):
+            await open_event_stream(chunks(), timeout=0.05)
+
+    asyncio.run(main())
+    assert closed == [True]
+
+
+def test_slow_later_chunk_ends_stream_with_error():
+    closed = []
+
+    async def chunks():
+        try:
+            yield "first"
+            await asyncio.sleep(10)
+            yield "too late"
+        finally:
+            closed.append(True)
+
+    async def main():
+        response = await open_event_stream(chunks(), timeout=0.05)
+        return await read_events(response)
+
+    events = asyncio.run(main())
+    assert events[0] == 'data: "first"\n\n'
+    assert events[-1].startswith("event: error\n")
+    assert "0.05 seconds" in events[-1]
+    assert closed == [True]
+
+
+def test_named_tuples_are_sent_as_objects():
+    async def chunks():
+        yield Piece("tone")
+
+    async def main():
+        response = await open_event_stream(chunks())
+        return await read_events(response)
+
+    events = asyncio.run(main())
+    assert events == ['data: {"name": "tone"}\n\n', "event: done\ndata: \n\n"]